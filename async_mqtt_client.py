@@ -0,0 +1,213 @@
+import paho.mqtt.client as mqtt
+import asyncio
+import compression
+import uuid
+
+
+class AsyncMQTTClient:
+    def __init__(self, broker_address="mqtt.eclipseprojects.io", port=1883, on_message_callback=None,
+                 will_topic=None, will_payload=None, will_retain=True,
+                 client_id=None, clean_session=True, max_inflight=100, max_rate=None):
+
+        self.broker_address = broker_address
+        self.port = port
+        self.on_message_callback = on_message_callback
+        self.max_inflight = max_inflight
+        self.send_interval = 1 / max_rate if max_rate else 0
+        self.next_send = 0.0
+
+        if client_id is None:
+            client_id = f"python-mqtt-{uuid.uuid4()}"
+        self.client_id = client_id
+
+        self.client = mqtt.Client(client_id=client_id, clean_session=clean_session,
+                                  callback_api_version=mqtt.CallbackAPIVersion.VERSION1)
+        # A janela é controlada aqui; o paho apenas não deve segurar publicações além dela.
+        self.client.max_inflight_messages_set(max_inflight)
+
+        if will_topic and will_payload:
+            self.client.will_set(will_topic, payload=will_payload, retain=will_retain, qos=1)
+
+        self.client.on_connect = self._on_connect
+        self.client.on_disconnect = self._on_disconnect
+        self.client.on_publish = self._on_publish
+        self.client.on_subscribe = self._on_subscribe
+        self.client.on_unsubscribe = self._on_unsubscribe
+        self.client.on_socket_open = self._on_socket_open
+        self.client.on_socket_close = self._on_socket_close
+        self.client.on_socket_register_write = self._on_socket_register_write
+        self.client.on_socket_unregister_write = self._on_socket_unregister_write
+        if self.on_message_callback:
+            self.client.on_message = self._on_message
+
+        self.loop = None
+        self.window = None
+        self.pending = {}
+        self.early_acks = {}
+        self.publish_mids = set()
+        self.connected = None
+        self.disconnected = None
+        self.misc_task = None
+
+    @property
+    def inflight(self):
+        return len(self.publish_mids)
+
+    @property
+    def window_full(self):
+        return self.window is not None and self.window.locked()
+
+    async def connect(self, timeout=10):
+        self.loop = asyncio.get_running_loop()
+        self.window = asyncio.Semaphore(self.max_inflight)
+        self.connected = self.loop.create_future()
+        self.disconnected = self.loop.create_future()
+        try:
+            # DNS e handshake TCP são bloqueantes: rodam no executor para não serializar conexões simultâneas.
+            await asyncio.wait_for(self.loop.run_in_executor(None, self.client.connect, self.broker_address,
+                                                             self.port, 60), timeout)
+            rc = await asyncio.wait_for(self.connected, timeout)
+        except Exception as e:
+            print(f"Erro ao conectar ao Broker MQTT: {e}")
+            return False
+        if rc != 0:
+            print(f"Conexão recusada pelo broker (rc={rc}).")
+            return False
+        return True
+
+    async def disconnect(self, timeout=5):
+        self.client.disconnect()
+        try:
+            await asyncio.wait_for(asyncio.shield(self.disconnected), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    async def start_publish(self, topic, payload, qos=1, retain=False):
+        # Retorna assim que houver espaço na janela; o future resolve no PUBACK (ou na escrita, para QoS 0).
+        if self.send_interval:
+            now = self.loop.time()
+            if self.next_send > now:
+                await asyncio.sleep(self.next_send - now)
+            self.next_send = max(now, self.next_send) + self.send_interval
+
+        await self.window.acquire()
+        future = self.loop.create_future()
+        payload = compression.compress(payload)
+        info = self.client.publish(topic, payload, qos=qos, retain=retain)
+        if info.rc != mqtt.MQTT_ERR_SUCCESS:
+            self.window.release()
+            future.set_exception(ConnectionError(mqtt.error_string(info.rc)))
+            return future
+
+        if info.mid in self.early_acks:
+            self.early_acks.pop(info.mid)
+            self.window.release()
+            future.set_result(info.mid)
+        else:
+            self.pending[info.mid] = future
+            self.publish_mids.add(info.mid)
+        return future
+
+    async def publish(self, topic, payload, qos=1, retain=False):
+        return await (await self.start_publish(topic, payload, qos=qos, retain=retain))
+
+    async def subscribe(self, topic, qos=1):
+        rc, mid = self.client.subscribe(topic, qos=qos)
+        return await self._wait_ack(rc, mid)
+
+    async def unsubscribe(self, topic):
+        rc, mid = self.client.unsubscribe(topic)
+        return await self._wait_ack(rc, mid)
+
+    async def _wait_ack(self, rc, mid):
+        if rc != mqtt.MQTT_ERR_SUCCESS:
+            raise ConnectionError(mqtt.error_string(rc))
+        if mid in self.early_acks:
+            return self.early_acks.pop(mid)
+        future = self.loop.create_future()
+        self.pending[mid] = future
+        return await future
+
+    def _resolve(self, mid, result):
+        future = self.pending.pop(mid, None)
+        if mid in self.publish_mids:
+            self.publish_mids.discard(mid)
+            self.window.release()
+        if future is None:
+            self.early_acks[mid] = result
+        elif not future.done():
+            future.set_result(result)
+
+    def _on_message(self, client, userdata, message):
+        try:
+            message.payload = compression.decompress(message.payload)
+        except ValueError as e:
+            print(f"Mensagem descartada em '{message.topic}': {e}")
+            return
+        self.on_message_callback(client, userdata, message)
+
+    def _on_connect(self, client, userdata, flags, rc):
+        if self.connected and not self.connected.done():
+            self.connected.set_result(rc)
+
+    def _on_disconnect(self, client, userdata, rc):
+        error = ConnectionError(f"Conexão encerrada (rc={rc}).")
+        for mid, future in list(self.pending.items()):
+            if not future.done():
+                future.set_exception(error)
+        for _ in self.publish_mids:
+            self.window.release()
+        self.pending.clear()
+        self.publish_mids.clear()
+        if self.connected and not self.connected.done():
+            self.connected.set_result(rc or mqtt.MQTT_ERR_CONN_LOST)
+        if self.disconnected and not self.disconnected.done():
+            self.disconnected.set_result(rc)
+
+    def _on_publish(self, client, userdata, mid):
+        self._resolve(mid, mid)
+
+    def _on_subscribe(self, client, userdata, mid, granted_qos):
+        self._resolve(mid, granted_qos)
+
+    def _on_unsubscribe(self, client, userdata, mid):
+        self._resolve(mid, mid)
+
+    def _on_loop(self, function, *args):
+        # Durante o connect os callbacks de socket vêm da thread do executor; o loop só é tocado na sua thread.
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is self.loop:
+            function(*args)
+        else:
+            self.loop.call_soon_threadsafe(function, *args)
+
+    def _on_socket_open(self, client, userdata, sock):
+        self._on_loop(self._watch_socket, client, sock)
+
+    def _watch_socket(self, client, sock):
+        self.loop.add_reader(sock, client.loop_read)
+        self.misc_task = self.loop.create_task(self._misc_loop())
+
+    def _on_socket_close(self, client, userdata, sock):
+        self._on_loop(self._unwatch_socket, sock)
+
+    def _unwatch_socket(self, sock):
+        self.loop.remove_reader(sock)
+        if self.misc_task:
+            self.misc_task.cancel()
+
+    def _on_socket_register_write(self, client, userdata, sock):
+        self._on_loop(self.loop.add_writer, sock, client.loop_write)
+
+    def _on_socket_unregister_write(self, client, userdata, sock):
+        self._on_loop(self.loop.remove_writer, sock)
+
+    async def _misc_loop(self):
+        while self.client.loop_misc() == mqtt.MQTT_ERR_SUCCESS:
+            try:
+                await asyncio.sleep(1)
+            except asyncio.CancelledError:
+                break
@@ -0,0 +1,313 @@
+from mqtt_client import MQTTClient
+from manager_core import ManagerCore
+from read_ack import CumulativeAck
+from login import SessionLogin
+from topics import UNIQUE_PREFIX, TOPIC_MGMT_USERS, TOPIC_USER_MSG_BASE, TOPIC_ACK_WILDCARD
+import envelope
+import argparse
+import collections
+import contextlib
+import io
+import json
+import sys
+import threading
+import time
+import uuid
+
+DEFAULT_BASELINE = "bench_baseline.json"
+DEFAULT_OUTPUT = "bench_output.txt"
+
+# Métrica -> direção em que ela melhora.
+METRICS = {
+    "fanout_msgs_per_s": "higher",
+    "ack_latency_p50_ms": "lower",
+    "ack_latency_p99_ms": "lower",
+    "counter_convergence_ms": "lower",
+    "login_p50_ms": "lower",
+    "login_p99_ms": "lower",
+}
+
+
+class DeliveryCounter:
+    def __init__(self):
+        self.count = 0
+        self.target = None
+        self.lock = threading.Lock()
+        self.done = threading.Event()
+
+    def expect(self, target):
+        with self.lock:
+            self.target = target
+            if self.count >= target:
+                self.done.set()
+
+    def add(self, amount):
+        with self.lock:
+            self.count += amount
+            if self.target is not None and self.count >= self.target:
+                self.done.set()
+
+
+class SimulatedUser:
+    # Reproduz o protocolo do user.py: login pela conexão da sessão, fila privada com ACK e
+    # recebimento das mensagens dos tópicos.
+    def __init__(self, name, broker_address, port, deliveries):
+        self.name = name
+        self.personal_topic = f"{TOPIC_USER_MSG_BASE}/{name}"
+        self.deliveries = deliveries
+        self.topics = set()
+        self.subscribed = threading.Event()
+        self.login_result = None
+        self.client = MQTTClient(broker_address=broker_address, port=port, on_message_callback=self.on_message,
+                                 client_id=name, clean_session=True)
+        self.read_ack = CumulativeAck(self.client, name)
+        self.login = SessionLogin(self.client, name, self.on_login)
+
+    def start(self, topic_names):
+        self.topics = {f"{UNIQUE_PREFIX}{topic_name}" for topic_name in topic_names}
+        if not self.login.start():
+            raise ConnectionError(f"Falha ao conectar o usuário simulado '{self.name}'.")
+
+    def on_login(self, result, state):
+        self.login_result = result
+        if result != "VALIDO":
+            self.subscribed.set()
+            return
+        self.client.client.on_subscribe = self.on_subscribe
+        # Sessão limpa: as inscrições são refeitas a cada (re)conexão.
+        self.client.on_connect_callback = self.on_connect
+        self.on_connect(self.client.client, None, None, 0)
+
+    def on_subscribe(self, client, userdata, mid, granted_qos):
+        if not self.subscribed.is_set():
+            self.login.timer.mark("inscrição")
+            self.subscribed.set()
+
+    def on_connect(self, client, userdata, flags, rc):
+        if rc == 0:
+            client.subscribe([(self.personal_topic, 1)] + [(topic, 1) for topic in sorted(self.topics)])
+
+    def on_message(self, client, userdata, message):
+        if self.login.handle(message.topic, message.payload):
+            return
+        if not message.payload or (message.topic != self.personal_topic and message.topic not in self.topics):
+            return
+        try:
+            parsed = envelope.Envelope.parse(message.payload)
+            count = envelope.batch_size(parsed) if parsed and parsed.kind == envelope.KIND_BATCH else 1
+        except ValueError:
+            return
+        if message.topic == self.personal_topic:
+            self.read_ack.ack(count)
+        else:
+            self.deliveries.add(count)
+
+    def stop(self):
+        self.read_ack.close()
+        self.client.disconnect()
+
+
+class AckTracker:
+    def __init__(self):
+        self.sent = collections.defaultdict(collections.deque)
+        self.positions = {}
+        self.latencies = []
+        self.lock = threading.Lock()
+        self.pending = 0
+        self.done = threading.Event()
+
+    def record_send(self, user_name):
+        with self.lock:
+            self.sent[user_name].append(time.perf_counter())
+            self.pending += 1
+            self.done.clear()
+
+    def on_message(self, client, userdata, message):
+        now = time.perf_counter()
+        user_name = message.topic.rsplit("/", 1)[-1]
+        position = envelope.ack_position(message.payload)
+        with self.lock:
+            consumed = 1
+            if position is not None:
+                session, acked = position
+                last_session, last_acked = self.positions.get(user_name, (None, 0))
+                consumed = acked - last_acked if session == last_session else acked
+                self.positions[user_name] = position
+            queue = self.sent.get(user_name)
+            while queue and consumed > 0:
+                self.latencies.append((now - queue.popleft()) * 1000)
+                self.pending -= 1
+                consumed -= 1
+            if not self.pending:
+                self.done.set()
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def wait_until(predicate, timeout):
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.001)
+    return predicate()
+
+
+def run_benchmark(broker_address, port, users, topics, messages, private_messages, timeout):
+    run_id = uuid.uuid4().hex[:8]
+    user_names = [f"bench-{run_id}-u{i}" for i in range(users)]
+    topic_names = [f"bench-{run_id}/t{i}" for i in range(topics)]
+    deliveries = DeliveryCounter()
+    acks = AckTracker()
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        core = ManagerCore(broker_address=broker_address, port=port)
+        if not core.start():
+            raise ConnectionError("Falha ao conectar o gerenciador ao broker.")
+        control = MQTTClient(broker_address=broker_address, port=port, on_message_callback=acks.on_message)
+        if not control.connect():
+            raise ConnectionError("Falha ao conectar o cliente de controle ao broker.")
+        control.subscribe(TOPIC_ACK_WILDCARD, qos=1)
+        for user_name in user_names:
+            control.publish(f"{TOPIC_MGMT_USERS}/{user_name}", "ADD", retain=True)
+        sessions = []
+        if not wait_until(lambda: all(u in core.message_counts for u in user_names), timeout):
+            raise TimeoutError("O gerenciador não sincronizou os usuários do benchmark.")
+        for user_name in user_names:
+            session = SimulatedUser(user_name, broker_address, port, deliveries)
+            sessions.append(session)
+            session.start(topic_names)
+            # Conexões em rajada não medem nada útil e alguns brokers de teste não lidam bem com elas.
+            if not session.subscribed.wait(timeout):
+                session.login.timeout()
+                raise ConnectionError(f"O usuário simulado '{session.name}' não concluiu o login a tempo.")
+            if session.login_result != "VALIDO":
+                raise ConnectionError(f"Login do usuário simulado '{session.name}' falhou: {session.login_result}.")
+
+    try:
+        time.sleep(0.5)
+
+        # 1) Fan-out: cada mensagem publicada em um tópico é entregue a todos os usuários.
+        expected = messages * topics * users
+        started = time.perf_counter()
+        for i in range(messages):
+            for topic_name in topic_names:
+                control.publish(f"{UNIQUE_PREFIX}{topic_name}", envelope.encode(envelope.KIND_CHAT, "bench", f"msg {i}"), qos=1)
+        deliveries.expect(expected)
+        if not deliveries.done.wait(timeout):
+            raise TimeoutError(f"Fan-out incompleto: {deliveries.count}/{expected} entregas.")
+        fanout_seconds = time.perf_counter() - started
+
+        # 2) Mensagem privada -> ACK, e 3) convergência dos contadores do gerenciador.
+        for i in range(private_messages):
+            user_name = user_names[i % users]
+            acks.record_send(user_name)
+            control.publish(f"{TOPIC_USER_MSG_BASE}/{user_name}", envelope.encode(envelope.KIND_PRIVATE, "bench", f"privada {i}"), qos=1)
+        last_send = time.perf_counter()
+        if private_messages and not acks.done.wait(timeout):
+            raise TimeoutError(f"ACKs incompletos: faltam {acks.pending}.")
+        if not wait_until(lambda: not any(core.message_counts.get(u) for u in user_names), timeout):
+            raise TimeoutError("Os contadores do gerenciador não voltaram a zero.")
+        convergence_ms = (time.perf_counter() - last_send) * 1000
+        # Conexão + autenticação + estado + inscrições, como no user.py.
+        logins = [session.login.timer.total_ms for session in sessions]
+    finally:
+        with contextlib.redirect_stdout(io.StringIO()):
+            for user_name in user_names:
+                control.publish(f"{TOPIC_MGMT_USERS}/{user_name}", "", retain=True)
+            for session in sessions:
+                session.stop()
+            control.disconnect()
+            core.stop()
+
+    return {
+        "params": {"broker": broker_address, "users": users, "topics": topics, "messages": messages, "private_messages": private_messages},
+        "fanout_msgs_per_s": round(expected / fanout_seconds, 1),
+        "ack_latency_p50_ms": round(percentile(acks.latencies, 50), 3),
+        "ack_latency_p99_ms": round(percentile(acks.latencies, 99), 3),
+        "counter_convergence_ms": round(convergence_ms, 3),
+        "login_p50_ms": round(percentile(logins, 50), 3),
+        "login_p99_ms": round(percentile(logins, 99), 3),
+    }
+
+
+def compare(baseline, result, tolerance):
+    lines = [f"{'métrica':<26}{'baseline':>14}{'atual':>14}{'variação':>11}"]
+    regressions = []
+    for metric, better in METRICS.items():
+        base, current = baseline.get(metric), result[metric]
+        if base is None:
+            lines.append(f"{metric:<26}{'-':>14}{current:>14}{'':>11}")
+            continue
+        change = (current - base) / base if base else 0.0
+        worse = change < -tolerance if better == "higher" else change > tolerance
+        marker = "  <-- REGRESSÃO" if worse else ""
+        lines.append(f"{metric:<26}{base:>14}{current:>14}{change:>+10.1%}{marker}")
+        if worse:
+            regressions.append(metric)
+    return "\n".join(lines), regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Gerador de carga e benchmark de latência do sistema MOM.")
+    parser.add_argument("--broker", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=1883)
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--topics", type=int, default=5)
+    parser.add_argument("--messages", type=int, default=50, help="Mensagens publicadas em cada tópico.")
+    parser.add_argument("--private-messages", type=int, default=500)
+    parser.add_argument("--timeout", type=float, default=60)
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--output", default=DEFAULT_OUTPUT)
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Variação aceita antes de acusar regressão.")
+    parser.add_argument("--update-baseline", action="store_true", help="Grava o resultado como novo baseline.")
+    parser.add_argument("--login-slo-ms", type=float, default=0,
+                        help="Meta absoluta para o p99 do login; acima dela encerra com código 1 (0 = desligado).")
+    args = parser.parse_args()
+
+    result = run_benchmark(args.broker, args.port, args.users, args.topics, args.messages,
+                           args.private_messages, args.timeout)
+    report = json.dumps(result, indent=2, sort_keys=True)
+    with open(args.output, "w", encoding="utf-8") as f:
+        f.write(report + "\n")
+    if args.login_slo_ms and result["login_p99_ms"] > args.login_slo_ms:
+        print(report)
+        print(f"Login p99 de {result['login_p99_ms']} ms acima da meta de {args.login_slo_ms:.0f} ms.", file=sys.stderr)
+        return 1
+
+    if args.update_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            f.write(report + "\n")
+        print(report)
+        print(f"Baseline gravado em {args.baseline}.")
+        return 0
+
+    try:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+    except FileNotFoundError:
+        print(report)
+        print(f"Baseline {args.baseline} não encontrado; use --update-baseline para criá-lo.")
+        return 0
+
+    if baseline.get("params") != result["params"]:
+        print(report)
+        print("Parâmetros diferentes do baseline; comparação ignorada.", file=sys.stderr)
+        return 2
+
+    table, regressions = compare(baseline, result, args.tolerance)
+    print(table)
+    if regressions:
+        print(f"Regressão de desempenho em: {', '.join(regressions)}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
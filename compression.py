@@ -0,0 +1,106 @@
+from metrics import METRICS
+import envelope
+import lzma
+import struct
+import time
+import zlib
+
+# 0xFB, como o 0xFA do envelope, nunca inicia um texto UTF-8 válido: payloads legados não são confundidos.
+MAGIC = 0xFB
+# Cabeçalho: marca, codec e tamanho original (uint32) do payload.
+HEADER = struct.Struct(">BBI")
+CODECS = {"zlib": 1, "lzma": 2}
+CODEC_NAMES = {value: name for name, value in CODECS.items()}
+# Limite do MQTT para um payload; maior que isso o cabeçalho só pode ser de um payload corrompido.
+MAX_PAYLOAD = 268435455
+
+DEFAULT_MIN_BYTES = 1024
+DEFAULT_CODEC = "zlib"
+# Valores usados pelo MQTTClient quando não recebe os seus; alterados por configure_from_args.
+min_bytes = DEFAULT_MIN_BYTES
+codec = DEFAULT_CODEC
+
+BYTES = METRICS.counter("mom_compression_bytes_total", "Bytes antes (raw) e depois (compressed) da compressão.",
+                        ("codec", "direction", "stage"))
+SKIPPED = METRICS.counter("mom_compression_skipped_total", "Payloads acima do limite que não diminuíram e seguiram sem compressão.")
+COMPRESS_SECONDS = METRICS.histogram("mom_compress_seconds", "Tempo para comprimir um payload.", ("codec",))
+DECOMPRESS_SECONDS = METRICS.histogram("mom_decompress_seconds", "Tempo para descomprimir um payload.", ("codec",))
+
+
+def _ratio():
+    # Bytes enviados comprimidos / bytes originais desses payloads (1 = nenhum ganho).
+    raw = compressed = 0
+    for _, labels, value in BYTES.samples():
+        if 'direction="out"' in labels:
+            if 'stage="raw"' in labels:
+                raw += value
+            else:
+                compressed += value
+    return compressed / raw if raw else 1
+
+
+METRICS.gauge("mom_compression_ratio", "Razão comprimido/original dos payloads enviados.", function=_ratio)
+
+
+def compress(payload, threshold=None, codec_name=None):
+    # Payloads pequenos, vazios (limpeza de retido) ou que não diminuem seguem como estão.
+    threshold = min_bytes if threshold is None else threshold
+    codec_name = codec_name or codec
+    if not threshold or envelope.WRITE_LEGACY or payload is None or len(payload) < threshold:
+        return payload
+    if isinstance(payload, str):
+        payload = payload.encode()
+    started = time.perf_counter()
+    if codec_name == "lzma":
+        body = lzma.compress(payload)
+    else:
+        body = zlib.compress(payload)
+    COMPRESS_SECONDS.observe(time.perf_counter() - started, codec=codec_name)
+    if HEADER.size + len(body) >= len(payload):
+        SKIPPED.inc()
+        return payload
+    BYTES.inc(len(payload), codec=codec_name, direction="out", stage="raw")
+    BYTES.inc(HEADER.size + len(body), codec=codec_name, direction="out", stage="compressed")
+    return HEADER.pack(MAGIC, CODECS[codec_name], len(payload)) + body
+
+
+def is_compressed(payload):
+    return len(payload) >= HEADER.size and payload[0] == MAGIC
+
+
+def decompress(payload):
+    # Payload sem a marca volta intacto; marcado e inválido gera ValueError.
+    if not payload or not is_compressed(payload):
+        return payload
+    _, codec_id, size = HEADER.unpack_from(payload)
+    codec_name = CODEC_NAMES.get(codec_id)
+    if codec_name is None or size > MAX_PAYLOAD:
+        raise ValueError(f"Payload comprimido inválido (codec {codec_id}, {size} bytes).")
+    started = time.perf_counter()
+    body = memoryview(payload)[HEADER.size:]
+    try:
+        # max_length limita a memória: um payload malicioso não se expande além do tamanho declarado.
+        if codec_name == "lzma":
+            data = lzma.LZMADecompressor().decompress(body, max_length=size + 1)
+        else:
+            data = zlib.decompressobj().decompress(body, size + 1)
+    except (zlib.error, lzma.LZMAError) as e:
+        raise ValueError(f"Falha ao descomprimir o payload: {e}")
+    if len(data) != size:
+        raise ValueError("Payload comprimido com tamanho divergente.")
+    DECOMPRESS_SECONDS.observe(time.perf_counter() - started, codec=codec_name)
+    BYTES.inc(len(payload), codec=codec_name, direction="in", stage="compressed")
+    BYTES.inc(size, codec=codec_name, direction="in", stage="raw")
+    return data
+
+
+def add_arguments(parser):
+    parser.add_argument("--compress-min-bytes", type=int, default=DEFAULT_MIN_BYTES,
+                        help="Comprime payloads a partir deste tamanho (0 = desligado).")
+    parser.add_argument("--compress-codec", choices=sorted(CODECS), default=DEFAULT_CODEC,
+                        help="Codec da compressão: zlib (rápido) ou lzma (menor, mais lento).")
+
+
+def configure_from_args(args):
+    global min_bytes, codec
+    min_bytes, codec = args.compress_min_bytes, args.compress_codec
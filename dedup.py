@@ -0,0 +1,53 @@
+from metrics import METRICS
+import collections
+import envelope
+import threading
+import time
+
+# Limites da janela de deduplicação: o que for mais restritivo vence.
+DEFAULT_MAX_ENTRIES = 65536
+DEFAULT_TTL_SECONDS = 300
+
+DUPLICATES = METRICS.counter("mom_dedup_dropped_total", "Mensagens repetidas descartadas antes dos handlers.")
+
+
+class DedupCache:
+    # Ids vistos recentemente, em ordem de chegada: os mais antigos saem quando passam de ttl segundos
+    # ou quando o cache passa de max_entries. Uma repetição dentro da janela não renova a entrada, então
+    # a frente do OrderedDict é sempre a mais antiga e a expiração é O(1) por inserção.
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES, ttl=DEFAULT_TTL_SECONDS):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def seen(self, key):
+        # Devolve True se key já passou pela janela; senão a registra e devolve False.
+        now = time.monotonic()
+        with self.lock:
+            added = self.entries.get(key)
+            if added is not None:
+                if now - added <= self.ttl:
+                    DUPLICATES.inc()
+                    return True
+                # Expirada mas ainda não removida: conta como nova e volta ao fim da ordem.
+                self.entries.move_to_end(key)
+            self.entries[key] = now
+            limit = now - self.ttl
+            while self.entries:
+                oldest_key, added = next(iter(self.entries.items()))
+                if len(self.entries) <= self.max_entries and added >= limit:
+                    break
+                del self.entries[oldest_key]
+            return False
+
+
+def message_key(payload):
+    # Id do envelope (64 bits, sequencial a partir de um início aleatório por processo); None para
+    # payloads legados ou vazios, que não têm id e nunca são descartados.
+    if not payload or len(payload) < envelope.HEADER.size or payload[0] != envelope.MAGIC:
+        return None
+    return envelope.HEADER.unpack_from(payload)[4]
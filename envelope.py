@@ -0,0 +1,186 @@
+import itertools
+import os
+import random
+import struct
+import time
+
+# 0xFA nunca inicia um texto UTF-8 válido, então não colide com os payloads legados.
+MAGIC = 0xFA
+VERSION = 1
+HEADER = struct.Struct(">BBBBQQB")
+FRAME = struct.Struct(">I")
+ACK = struct.Struct(">QQ")
+
+KIND_CHAT = 1
+KIND_PRIVATE = 2
+KIND_PRESENCE = 3
+KIND_AUTH_REQUEST = 4
+KIND_AUTH_RESPONSE = 5
+KIND_ACK = 6
+KIND_SUBSCRIPTIONS = 7
+KIND_BATCH = 8
+KIND_MGMT_SNAPSHOT = 9
+KIND_MGMT_DELTA = 10
+KIND_ROSTER_SNAPSHOT = 11
+KIND_ROSTER_DELTA = 12
+KIND_SUBSCRIPTIONS_JOURNAL = 13
+
+# Durante uma atualização gradual, MOM_LEGACY_PAYLOADS=1 mantém os clientes novos escrevendo no formato texto.
+WRITE_LEGACY = os.environ.get("MOM_LEGACY_PAYLOADS") == "1"
+
+_message_ids = itertools.count(random.getrandbits(63))
+
+
+def next_message_id():
+    return next(_message_ids) & 0xFFFFFFFFFFFFFFFF
+
+
+class Envelope:
+    __slots__ = ("buffer", "kind", "version", "flags", "msg_id", "timestamp", "_sender_end", "_sender", "_text")
+
+    def __init__(self, kind, buffer=None, version=VERSION, flags=0, msg_id=None, timestamp=None, sender_end=0):
+        self.buffer = buffer
+        self.kind = kind
+        self.version = version
+        self.flags = flags
+        self.msg_id = msg_id
+        self.timestamp = timestamp
+        self._sender_end = sender_end
+        self._sender = None
+        self._text = None
+
+    @property
+    def legacy(self):
+        return self.buffer is None
+
+    @property
+    def sender(self):
+        if self._sender is None and self.buffer is not None:
+            self._sender = str(self.buffer[HEADER.size:self._sender_end], "utf-8")
+        return self._sender
+
+    @property
+    def body(self):
+        if self.buffer is None:
+            return memoryview((self._text or "").encode())
+        return self.buffer[self._sender_end:]
+
+    @property
+    def text(self):
+        if self._text is None and self.buffer is not None:
+            self._text = str(self.buffer[self._sender_end:], "utf-8")
+        return self._text
+
+    @classmethod
+    def parse(cls, payload):
+        buffer = memoryview(payload)
+        if len(buffer) < HEADER.size or buffer[0] != MAGIC:
+            return None
+        magic, version, kind, flags, msg_id, timestamp, sender_len = HEADER.unpack_from(buffer)
+        if version != VERSION:
+            raise ValueError(f"Versão de envelope não suportada: {version}")
+        sender_end = HEADER.size + sender_len
+        if sender_end > len(buffer):
+            raise ValueError("Envelope truncado.")
+        return cls(kind, buffer, version, flags, msg_id, timestamp, sender_end)
+
+    @classmethod
+    def from_legacy(cls, kind, text):
+        envelope = cls(kind)
+        if kind in (KIND_CHAT, KIND_PRIVATE):
+            sender, sep, body = text.partition(": ")
+            envelope._sender, envelope._text = (sender, body) if sep else ("", text)
+        elif kind == KIND_PRESENCE:
+            envelope._sender, envelope._text = text.split(":")
+        elif kind == KIND_AUTH_REQUEST:
+            envelope._sender, envelope._text = text.split(";")
+        else:
+            envelope._text = text
+        return envelope
+
+
+def decode(payload, kind):
+    envelope = Envelope.parse(payload)
+    if envelope is None:
+        return Envelope.from_legacy(kind, bytes(payload).decode())
+    return envelope
+
+
+def encode(kind, sender="", body="", msg_id=None, timestamp=None, legacy=None):
+    if WRITE_LEGACY if legacy is None else legacy:
+        return encode_legacy(kind, sender, body)
+    sender_bytes = sender.encode()
+    body_bytes = body if isinstance(body, (bytes, bytearray)) else body.encode()
+    if msg_id is None:
+        msg_id = next_message_id()
+    if timestamp is None:
+        timestamp = time.time_ns() // 1_000_000
+    header = HEADER.pack(MAGIC, VERSION, kind, 0, msg_id, timestamp, len(sender_bytes))
+    return header + sender_bytes + body_bytes
+
+
+def encode_legacy(kind, sender, body):
+    if isinstance(body, (bytes, bytearray)):
+        body = body.decode()
+    if kind in (KIND_CHAT, KIND_PRIVATE):
+        return f"{sender}: {body}"
+    if kind == KIND_PRESENCE:
+        return f"{sender}:{body}"
+    if kind == KIND_AUTH_REQUEST:
+        return f"{sender};{body}"
+    if kind == KIND_ACK:
+        return body or "ACK"
+    return body
+
+
+def encode_ack(sender, session, acked):
+    # ACK cumulativo: total de mensagens privadas consumidas desde o início da sessão do usuário.
+    return encode(KIND_ACK, sender, ACK.pack(session, acked), legacy=False)
+
+
+def ack_position(payload):
+    # (sessão, total confirmado) de um ACK cumulativo; None para o ACK de uma única mensagem.
+    envelope = Envelope.parse(payload)
+    if envelope is None or envelope.kind != KIND_ACK or len(envelope.body) != ACK.size:
+        return None
+    return ACK.unpack_from(envelope.body)
+
+
+def kind_of(payload):
+    # Tipo do envelope sem decodificá-lo; None para payloads legados ou vazios.
+    if not payload or len(payload) < HEADER.size or payload[0] != MAGIC:
+        return None
+    return payload[2]
+
+
+def encode_batch(payloads, sender=""):
+    # Corpo do lote: quantidade de itens seguida de cada payload prefixado pelo seu tamanho.
+    parts = [FRAME.pack(len(payloads))]
+    for payload in payloads:
+        parts.append(FRAME.pack(len(payload)))
+        parts.append(payload)
+    return encode(KIND_BATCH, sender, b"".join(parts), legacy=False)
+
+
+def batch_size(envelope):
+    if len(envelope.body) < FRAME.size:
+        raise ValueError("Lote truncado.")
+    return FRAME.unpack_from(envelope.body)[0]
+
+
+def iter_batch(envelope):
+    # Valida o lote inteiro antes de devolver os itens: um lote truncado não é entregue pela metade.
+    body = envelope.body
+    count = batch_size(envelope)
+    offset = FRAME.size
+    items = []
+    for _ in range(count):
+        if offset + FRAME.size > len(body):
+            raise ValueError("Lote truncado.")
+        size = FRAME.unpack_from(body, offset)[0]
+        offset += FRAME.size
+        if offset + size > len(body):
+            raise ValueError("Lote truncado.")
+        items.append(body[offset:offset + size])
+        offset += size
+    return items
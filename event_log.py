@@ -0,0 +1,184 @@
+import collections
+import datetime
+import logging
+import logging.handlers
+import threading
+import time
+from history_store import Timeline
+from metrics import METRICS
+
+DEFAULT_CAPACITY = 5000
+SPILL_MAX_BYTES = 10 * 1024 * 1024
+SPILL_BACKUPS = 5
+HISTORY_PAGE = 200
+HISTORY_POLL_MS = 250
+
+REDRAW_SECONDS = METRICS.histogram("mom_redraw_seconds", "Duração de cada redesenho de lista ou do log (contagem = redesenhos).",
+                                   ("widget",))
+
+
+def open_spill_log(path, name="mom.eventos"):
+    logger = logging.getLogger(f"{name}.{path}")
+    logger.propagate = False
+    logger.setLevel(logging.INFO)
+    if not logger.handlers:
+        handler = logging.handlers.RotatingFileHandler(path, maxBytes=SPILL_MAX_BYTES,
+                                                       backupCount=SPILL_BACKUPS, encoding="utf-8")
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        logger.addHandler(handler)
+    return logger
+
+
+class EventLog:
+    # Com history (HistoryStore), as linhas de conversa são gravadas em disco, a tela abre com a página
+    # mais recente e páginas antigas são carregadas ao rolar até o topo. O widget nunca passa de
+    # capacity linhas: ao voltar além disso, as linhas do fim saem e a tela vira "arquivo" até o
+    # usuário rolar de volta ao fim, quando as linhas recentes (mantidas em memória) voltam.
+    def __init__(self, textbox, dispatcher, capacity=DEFAULT_CAPACITY, timestamps=False, spill_path=None,
+                 history=None, page_size=HISTORY_PAGE):
+        self.textbox = textbox
+        self.dispatcher = dispatcher
+        self.capacity = capacity
+        self.timestamps = timestamps
+        self.lines = collections.deque(maxlen=capacity)
+        self.pending = collections.deque()
+        self.dropped = 0
+        self.lock = threading.Lock()
+        self.widget_lines = 0
+        self.spill = open_spill_log(spill_path) if spill_path else None
+        self.history = history
+        self.page_size = page_size
+        # Horário de cada linha do widget, na mesma ordem, para reposicionar a paginação após cortes.
+        self.line_times = collections.deque()
+        self.archive = False
+        self.exhausted = False
+        # Horário da linha do topo após um corte; a paginação só é reposicionada quando for usada.
+        self.seek_to = None
+        if history:
+            self.timeline = Timeline(history)
+            self.load_older()
+            self.textbox.after(HISTORY_POLL_MS, self.poll)
+
+    def format(self, timestamp, message):
+        if not self.timestamps:
+            return message
+        moment = datetime.datetime.fromtimestamp(timestamp)
+        pattern = "%H:%M:%S" if moment.date() == datetime.date.today() else "%d/%m %H:%M:%S"
+        return f"[{moment.strftime(pattern)}] {message}"
+
+    def append(self, message, conversation=None):
+        # conversation ("topico/<nome>", "privado/<usuário>") marca a linha para o histórico em disco.
+        timestamp = time.time()
+        evicted = None
+        with self.lock:
+            self.pending.append((timestamp, self.format(timestamp, message), message, conversation))
+            if len(self.pending) >= self.capacity:
+                # Interface atrasada: só as últimas linhas chegariam ao widget de qualquer forma
+                # (uma posição fica reservada para o aviso de descarte).
+                evicted = self.pending.popleft()
+                self.dropped += 1
+        if evicted:
+            self.dispatcher.count_dropped("log")
+            if self.history and evicted[3]:
+                # A linha sai da tela, mas não do histórico em disco.
+                self.history.append(evicted[3], [(evicted[0], evicted[2])])
+        self.dispatcher.schedule("event_log", self.flush)
+
+    def flush(self):
+        with self.lock:
+            batch, self.pending = list(self.pending), collections.deque()
+            dropped, self.dropped = self.dropped, 0
+        if not batch:
+            return
+        if dropped:
+            timestamp = batch[0][0]
+            notice = f"... {dropped} linha(s) de log descartada(s) por excesso de carga."
+            batch.insert(0, (timestamp, self.format(timestamp, notice), notice, None))
+        if self.spill:
+            for _, line, _, _ in batch:
+                self.spill.info(line)
+        if self.history:
+            records = collections.defaultdict(list)
+            for timestamp, _, message, conversation in batch:
+                if conversation:
+                    records[conversation].append((timestamp, message))
+            for conversation, items in records.items():
+                self.history.append(conversation, items)
+
+        self.lines.extend((timestamp, line) for timestamp, line, _, _ in batch)
+        if self.archive:
+            # Navegando no histórico: as linhas novas ficam em self.lines até a volta ao fim.
+            return
+        with REDRAW_SECONDS.time(widget="log"):
+            self._insert(batch)
+
+    def _insert(self, batch):
+        # Linhas além da capacidade seriam removidas no mesmo ciclo; nem chegam ao widget.
+        batch = batch[-self.capacity:]
+        self.textbox.configure(state="normal")
+        self.textbox.insert("end", "\n".join(line for _, line, _, _ in batch) + "\n")
+        self.widget_lines += len(batch)
+        self.line_times.extend(timestamp for timestamp, _, _, _ in batch)
+        excess = self.widget_lines - self.capacity
+        if excess > 0:
+            self.textbox.delete("1.0", f"{excess + 1}.0")
+            self.widget_lines = self.capacity
+            self._trim_times(excess)
+        self.textbox.configure(state="disabled")
+        self.textbox.see("end")
+
+    def _trim_times(self, excess):
+        for _ in range(min(excess, len(self.line_times))):
+            self.line_times.popleft()
+        if self.history:
+            # O topo do widget avançou: a próxima página antiga começa antes da nova primeira linha.
+            # Só o horário é guardado aqui; a busca no disco fica para o load_older.
+            self.seek_to = self.line_times[0] if self.line_times else time.time()
+            self.exhausted = False
+
+    def poll(self):
+        try:
+            top, bottom = self.textbox.yview()
+        except Exception:
+            return
+        if top <= 0 and not self.exhausted:
+            self.load_older()
+        elif self.archive and bottom >= 1:
+            self.restore_recent()
+        self.textbox.after(HISTORY_POLL_MS, self.poll)
+
+    def load_older(self):
+        if self.seek_to is not None:
+            self.timeline.seek(self.seek_to)
+            self.seek_to = None
+        page = self.timeline.older(self.page_size)
+        if not page:
+            self.exhausted = True
+            return
+        self.textbox.configure(state="normal")
+        self.textbox.insert("1.0", "\n".join(self.format(timestamp, text) for timestamp, _, text in page) + "\n")
+        self.line_times.extendleft(timestamp for timestamp, _, _ in reversed(page))
+        self.widget_lines += len(page)
+        excess = self.widget_lines - self.capacity
+        if excess > 0:
+            self.textbox.delete(f"{self.capacity + 1}.0", "end")
+            for _ in range(excess):
+                self.line_times.pop()
+            self.widget_lines = self.capacity
+            self.archive = True
+        self.textbox.configure(state="disabled")
+        # Mantém na tela a linha que estava no topo antes da página entrar.
+        self.textbox.yview(f"{len(page) + 1}.0")
+
+    def restore_recent(self):
+        self.archive = False
+        self.textbox.configure(state="normal")
+        self.textbox.delete("1.0", "end")
+        if self.lines:
+            self.textbox.insert("end", "\n".join(line for _, line in self.lines) + "\n")
+        self.textbox.configure(state="disabled")
+        self.textbox.see("end")
+        self.widget_lines = len(self.lines)
+        self.line_times = collections.deque(timestamp for timestamp, _ in self.lines)
+        self.seek_to = self.line_times[0] if self.line_times else time.time()
+        self.exhausted = False
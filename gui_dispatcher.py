@@ -0,0 +1,157 @@
+from metrics import METRICS
+import collections
+import sys
+import threading
+import time
+
+# Intervalo (ms) em que a thread do Tk procura trabalho novo. As outras threads só enfileiram: qualquer
+# chamada ao Tk fora da thread dele bloqueia até ela atender, e trava o fechamento da janela.
+DEFAULT_POLL_MS = 10
+# Limite da fila geral (tarefas de controle) e de cada fila por chave (mensagens de um tópico).
+DEFAULT_MAX_TASKS = 10000
+DEFAULT_LANE_CAP = 500
+
+QUEUE_WAIT = METRICS.histogram("mom_gui_queue_wait_seconds", "Tempo entre agendar uma tarefa e executá-la na thread do Tk.")
+TASK_SECONDS = METRICS.histogram("mom_gui_task_seconds", "Duração das tarefas executadas na thread do Tk.")
+DRAIN_SECONDS = METRICS.histogram("mom_gui_drain_seconds", "Duração de cada ciclo de processamento da fila da interface.")
+DROPPED = METRICS.counter("mom_gui_dropped_total", "Tarefas descartadas pela interface por excesso de carga.", ("kind",))
+COALESCED = METRICS.counter("mom_gui_coalesced_total", "Agendamentos substituídos por uma versão mais nova da mesma chave.")
+
+
+class GuiDispatcher:
+    # Três formas de entregar trabalho à thread do Tk, todas limitadas:
+    #   put: fila geral em ordem (controle, login); acima de max_tasks a tarefa mais antiga sai.
+    #   schedule: uma tarefa por chave, a última versão vence (estado absoluto: presença, contadores).
+    #   put_capped: uma fila por chave com no máximo lane_cap tarefas (mensagens de um tópico); as mais
+    #     antigas saem e on_dropped(chave, quantidade) é chamado na thread do Tk antes da próxima daquela chave.
+    def __init__(self, root, budget_ms=15, poll_ms=DEFAULT_POLL_MS, max_tasks=DEFAULT_MAX_TASKS,
+                 lane_cap=DEFAULT_LANE_CAP, on_dropped=None):
+        self.root = root
+        self.budget = budget_ms / 1000
+        self.poll_ms = poll_ms
+        self.max_tasks = max_tasks
+        self.lane_cap = lane_cap
+        self.on_dropped = on_dropped
+        self.tasks = collections.deque()
+        self.pending = {}
+        self.lanes = {}
+        self.ready = collections.deque()
+        self.lane_tasks = 0
+        self.lane_drops = {}
+        self.drops = 0
+        self.lock = threading.Lock()
+        # Só usado na thread do Tk: há um drain encadeado por after(1) cuidando do acúmulo.
+        self.backlogged = False
+        METRICS.gauge("mom_gui_queue_depth", "Tarefas aguardando a thread do Tk.", function=self.depth)
+
+    def depth(self):
+        with self.lock:
+            return len(self.tasks) + self.lane_tasks + len(self.pending)
+
+    def status_text(self):
+        return f"Fila da interface: {self.depth()} | descartadas: {self.drops}"
+
+    def count_dropped(self, kind, count=1):
+        # Descartes feitos fora do dispatcher (ex.: linhas do log) entram no mesmo total.
+        with self.lock:
+            self.drops += count
+        DROPPED.inc(count, kind=kind)
+
+    def start(self):
+        self.poll()
+
+    def put(self, task):
+        with self.lock:
+            self.tasks.append((time.perf_counter(), task))
+            overflow = len(self.tasks) > self.max_tasks
+            if overflow:
+                self.tasks.popleft()
+                self.drops += 1
+        if overflow:
+            DROPPED.inc(kind="geral")
+
+    def schedule(self, key, task):
+        # Trabalho com a mesma chave é executado uma única vez por ciclo (a última versão vence).
+        with self.lock:
+            queued = self.pending.get(key)
+            # A espera conta desde o primeiro agendamento da chave, não da última versão.
+            self.pending[key] = (queued[0] if queued else time.perf_counter(), task)
+        if queued:
+            COALESCED.inc()
+
+    def put_capped(self, key, task, kind="chat"):
+        with self.lock:
+            lane = self.lanes.get(key)
+            if lane is None:
+                lane = self.lanes[key] = collections.deque()
+                self.ready.append(key)
+            lane.append((time.perf_counter(), task))
+            self.lane_tasks += 1
+            overflow = len(lane) > self.lane_cap
+            if overflow:
+                lane.popleft()
+                self.lane_tasks -= 1
+                self.lane_drops[key] = self.lane_drops.get(key, 0) + 1
+                self.drops += 1
+        if overflow:
+            DROPPED.inc(kind=kind)
+
+    def poll(self):
+        if not self.backlogged:
+            self.drain()
+        self.root.after(self.poll_ms, self.poll)
+
+    def _next(self):
+        # Fila geral primeiro; depois uma tarefa de cada fila por chave, em rodízio.
+        with self.lock:
+            if self.tasks:
+                queued_at, task = self.tasks.popleft()
+                return queued_at, task, None, 0
+            if not self.ready:
+                return None
+            key = self.ready.popleft()
+            lane = self.lanes[key]
+            queued_at, task = lane.popleft()
+            self.lane_tasks -= 1
+            if lane:
+                self.ready.append(key)
+            else:
+                del self.lanes[key]
+            return queued_at, task, key, self.lane_drops.pop(key, 0)
+
+    def drain(self):
+        started = time.perf_counter()
+        deadline = started + self.budget
+        while time.perf_counter() < deadline:
+            item = self._next()
+            if item is None:
+                break
+            queued_at, task, key, dropped = item
+            if dropped and self.on_dropped:
+                # O aviso entra no lugar das mensagens descartadas, antes da primeira que sobrou.
+                self.run(lambda: self.on_dropped(key, dropped), queued_at)
+            self.run(task, queued_at)
+        self.flush()
+        DRAIN_SECONDS.observe(time.perf_counter() - started)
+
+        with self.lock:
+            backlog = bool(self.tasks or self.lanes or self.pending)
+        self.backlogged = backlog
+        if backlog:
+            # Devolve o controle ao Tk para redesenhar antes do próximo lote.
+            self.root.after(1, self.drain)
+
+    def flush(self):
+        with self.lock:
+            pending, self.pending = self.pending, {}
+        for queued_at, task in pending.values():
+            self.run(task, queued_at)
+
+    def run(self, task, queued_at):
+        started = time.perf_counter()
+        QUEUE_WAIT.observe(started - queued_at)
+        try:
+            if task: task()
+        except Exception:
+            self.root.report_callback_exception(*sys.exc_info())
+        TASK_SECONDS.observe(time.perf_counter() - started)
@@ -0,0 +1,228 @@
+import bisect
+import os
+import struct
+import threading
+import urllib.parse
+
+DEFAULT_HISTORY_DIR = os.path.join(os.path.expanduser("~"), ".mom", "historico")
+SEGMENT_BYTES = 1024 * 1024
+MAX_SEGMENTS = 64
+
+# Registro: horário (float64), tamanho do texto (uint32) e o texto em UTF-8.
+RECORD = struct.Struct(">dI")
+# Índice: posição (uint64) de cada registro no .log do segmento, na ordem de gravação.
+OFFSET = struct.Struct(">Q")
+
+
+class Segment:
+    # Par .log/.idx nomeado pelo número do primeiro registro; o índice é lido do disco sob demanda.
+    def __init__(self, directory, base):
+        self.base = base
+        self.log_path = os.path.join(directory, f"{base:020d}.log")
+        self.idx_path = os.path.join(directory, f"{base:020d}.idx")
+        self.count = 0
+        self.size = 0
+
+    def recover(self):
+        # Gravação interrompida: descarta o registro incompleto no fim do .log e reindexa o que
+        # chegou ao .log mas não ao .idx (o .log é sempre gravado antes).
+        open(self.log_path, "ab").close()
+        open(self.idx_path, "ab").close()
+        log_size = os.path.getsize(self.log_path)
+        count = os.path.getsize(self.idx_path) // OFFSET.size
+        offsets = self._offsets(0, count)
+        end = 0
+        with open(self.log_path, "rb") as log:
+            while offsets:
+                log.seek(offsets[-1])
+                header = log.read(RECORD.size)
+                if len(header) == RECORD.size and offsets[-1] + RECORD.size + RECORD.unpack(header)[1] <= log_size:
+                    end = offsets[-1] + RECORD.size + RECORD.unpack(header)[1]
+                    break
+                offsets.pop()
+            missing = []
+            log.seek(end)
+            while True:
+                header = log.read(RECORD.size)
+                if len(header) < RECORD.size or end + RECORD.size + RECORD.unpack(header)[1] > log_size:
+                    break
+                missing.append(end)
+                end += RECORD.size + RECORD.unpack(header)[1]
+                log.seek(end)
+        os.truncate(self.log_path, end)
+        os.truncate(self.idx_path, len(offsets) * OFFSET.size)
+        if missing:
+            with open(self.idx_path, "ab") as idx:
+                idx.write(b"".join(OFFSET.pack(offset) for offset in missing))
+        self.count = len(offsets) + len(missing)
+        self.size = end
+
+    def _offsets(self, start, stop):
+        with open(self.idx_path, "rb") as idx:
+            idx.seek(start * OFFSET.size)
+            data = idx.read((stop - start) * OFFSET.size)
+        return [offset for (offset,) in OFFSET.iter_unpack(data[:len(data) - len(data) % OFFSET.size])]
+
+    def append(self, records):
+        offsets, chunks = [], []
+        position = self.size
+        for timestamp, text in records:
+            data = text.encode("utf-8")
+            offsets.append(OFFSET.pack(position))
+            chunks.append(RECORD.pack(timestamp, len(data)) + data)
+            position += RECORD.size + len(data)
+        with open(self.log_path, "ab") as log:
+            log.write(b"".join(chunks))
+        with open(self.idx_path, "ab") as idx:
+            idx.write(b"".join(offsets))
+        self.count += len(records)
+        self.size = position
+
+    def read(self, start, stop):
+        # start/stop relativos ao segmento; uma leitura contígua do .log para a página inteira.
+        if start >= stop:
+            return []
+        offsets = self._offsets(start, stop)
+        with open(self.log_path, "rb") as log:
+            log.seek(offsets[0])
+            end = self.size if stop >= self.count else self._offsets(stop, stop + 1)[0]
+            data = log.read(end - offsets[0])
+        records = []
+        for offset in offsets:
+            position = offset - offsets[0]
+            timestamp, length = RECORD.unpack_from(data, position)
+            start_text = position + RECORD.size
+            records.append((timestamp, data[start_text:start_text + length].decode("utf-8")))
+        return records
+
+    def delete(self):
+        for path in (self.log_path, self.idx_path):
+            if os.path.exists(path):
+                os.remove(path)
+
+
+class Conversation:
+    def __init__(self, directory, segment_bytes, max_segments):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.max_segments = max_segments
+        os.makedirs(directory, exist_ok=True)
+        bases = sorted({int(name[:20]) for name in os.listdir(directory) if name.endswith(".log")})
+        self.segments = [Segment(directory, base) for base in bases]
+        for segment in self.segments[:-1]:
+            segment.count = os.path.getsize(segment.idx_path) // OFFSET.size
+            segment.size = os.path.getsize(segment.log_path)
+        if self.segments:
+            self.segments[-1].recover()
+        else:
+            self.segments.append(Segment(directory, 0))
+            self.segments[-1].recover()
+
+    @property
+    def start(self):
+        return self.segments[0].base
+
+    @property
+    def end(self):
+        return self.segments[-1].base + self.segments[-1].count
+
+    def append(self, records):
+        segment = self.segments[-1]
+        if segment.size >= self.segment_bytes:
+            segment = Segment(self.directory, self.end)
+            segment.recover()
+            self.segments.append(segment)
+            while self.max_segments and len(self.segments) > self.max_segments:
+                self.segments.pop(0).delete()
+        segment.append(records)
+
+    def read(self, start, stop):
+        start, stop = max(start, self.start), min(stop, self.end)
+        records = []
+        bases = [segment.base for segment in self.segments]
+        i = bisect.bisect_right(bases, start) - 1
+        while start < stop and i < len(self.segments):
+            segment = self.segments[i]
+            chunk_stop = min(stop, segment.base + segment.count)
+            records.extend(segment.read(start - segment.base, chunk_stop - segment.base))
+            start = chunk_stop
+            i += 1
+        return records
+
+    def seek(self, timestamp):
+        # Primeiro registro com horário >= timestamp (os horários crescem na ordem de gravação).
+        low, high = self.start, self.end
+        while low < high:
+            middle = (low + high) // 2
+            if self.read(middle, middle + 1)[0][0] < timestamp:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+
+class HistoryStore:
+    # Histórico local só de acréscimo: uma pasta por conversa ("topico/<nome>", "privado/<usuário>"),
+    # em segmentos .log com índice de posições .idx. Nada fica em memória além dos metadados dos
+    # segmentos; as páginas são lidas do disco quando pedidas.
+    def __init__(self, directory, segment_bytes=SEGMENT_BYTES, max_segments=MAX_SEGMENTS):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.max_segments = max_segments
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self.opened = {}
+
+    def _conversation(self, name):
+        conversation = self.opened.get(name)
+        if conversation is None:
+            path = os.path.join(self.directory, urllib.parse.quote(name, safe=""))
+            conversation = self.opened[name] = Conversation(path, self.segment_bytes, self.max_segments)
+        return conversation
+
+    def conversations(self):
+        with self.lock:
+            names = {urllib.parse.unquote(name) for name in os.listdir(self.directory)}
+            return sorted(names | set(self.opened))
+
+    def append(self, name, records):
+        # records: [(horário, texto)] em ordem de gravação.
+        with self.lock:
+            self._conversation(name).append(records)
+
+    def bounds(self, name):
+        with self.lock:
+            conversation = self._conversation(name)
+            return conversation.start, conversation.end
+
+    def read(self, name, start, stop):
+        with self.lock:
+            return self._conversation(name).read(start, stop)
+
+    def seek(self, name, timestamp):
+        with self.lock:
+            return self._conversation(name).seek(timestamp)
+
+
+class Timeline:
+    # Linha do tempo de todas as conversas, paginada de trás para frente: cada conversa tem um
+    # cursor (fim exclusivo) e cada página é a intercalação, por horário, das mais recentes antes dele.
+    def __init__(self, store):
+        self.store = store
+        self.cursors = {}
+        self.seek(float("inf"))
+
+    def seek(self, timestamp):
+        self.cursors = {name: self.store.seek(name, timestamp) for name in self.store.conversations()}
+
+    def older(self, size):
+        candidates = []
+        for name, end in self.cursors.items():
+            start = max(self.store.bounds(name)[0], end - size)
+            for i, (timestamp, text) in enumerate(self.store.read(name, start, end)):
+                candidates.append((timestamp, start + i, name, text))
+        candidates.sort()
+        page = candidates[-size:]
+        for timestamp, index, name, text in reversed(page):
+            self.cursors[name] = index
+        return [(timestamp, name, text) for timestamp, index, name, text in page]
@@ -0,0 +1,97 @@
+from topics import TOPIC_AUTH_REQUEST, TOPIC_AUTH_RESPONSE_BASE
+from subscription_state import state_topic, journal_topic
+import envelope
+import time
+import uuid
+
+# Tempo máximo (ms) de espera pela resposta do gerenciador.
+AUTH_TIMEOUT_MS = 5000
+# Resultados do login além das respostas do gerenciador ("VALIDO"/"INVALIDO").
+NO_CONNECTION = "SEM_CONEXAO"
+NO_RESPONSE = "SEM_RESPOSTA"
+
+
+class PhaseTimer:
+    # Duração de cada fase (ms) desde a marca anterior, na ordem em que foram marcadas.
+    def __init__(self):
+        self.started = self.last = time.perf_counter()
+        self.phases = {}
+
+    def mark(self, phase):
+        now = time.perf_counter()
+        self.phases[phase] = (now - self.last) * 1000
+        self.last = now
+
+    @property
+    def total_ms(self):
+        return (self.last - self.started) * 1000
+
+    def summary(self):
+        parts = [f"{phase} {ms:.1f} ms" for phase, ms in self.phases.items()]
+        return f"{self.total_ms:.1f} ms ({', '.join(parts)})"
+
+
+class SessionLogin:
+    # Login pela própria conexão da sessão: logo após o CONNACK assina, num único SUBSCRIBE, a resposta
+    # da autenticação e o estado de inscrições (base e diário, retidos) e publica a requisição. O broker
+    # entrega os retidos ao tratar o SUBSCRIBE, antes de a requisição chegar ao gerenciador, então
+    # validação e estado voltam na mesma ida e volta. O resultado sai em
+    # on_result(resultado, (payload_da_base, payload_do_diário)), com None no que não estiver retido.
+    def __init__(self, mqtt_client, user_name, on_result):
+        self.mqtt_client = mqtt_client
+        self.user_name = user_name
+        self.on_result = on_result
+        self.response_topic = f"{TOPIC_AUTH_RESPONSE_BASE}/{uuid.uuid4()}"
+        self.state_topic = state_topic(user_name)
+        self.journal_topic = journal_topic(user_name)
+        self.state = None
+        self.journal = None
+        self.done = False
+        self.timer = PhaseTimer()
+
+    def start(self):
+        self.timer = PhaseTimer()
+        self.mqtt_client.on_connect_callback = self._on_connect
+        return self.mqtt_client.connect()
+
+    def _on_connect(self, client, userdata, flags, rc):
+        if self.done:
+            return
+        if rc != 0:
+            self._finish(NO_CONNECTION)
+            return
+        self.timer.mark("conexão")
+        self.mqtt_client.subscribe_many([(self.response_topic, 0), (self.state_topic, 1), (self.journal_topic, 1)])
+        payload = envelope.encode(envelope.KIND_AUTH_REQUEST, self.user_name, self.response_topic)
+        self.mqtt_client.publish(TOPIC_AUTH_REQUEST, payload, qos=0)
+
+    def handle(self, topic, payload):
+        # Consome as mensagens do login; devolve False para as que pertencem à aplicação.
+        if self.done:
+            return False
+        if topic == self.state_topic:
+            self.state = payload or None
+            return True
+        if topic == self.journal_topic:
+            self.journal = payload or None
+            return True
+        if topic != self.response_topic:
+            return False
+        try:
+            result = envelope.decode(payload, envelope.KIND_AUTH_RESPONSE).text
+        except ValueError:
+            result = "INVALIDO"
+        self.timer.mark("autenticação")
+        self._finish(result)
+        return True
+
+    def timeout(self):
+        if not self.done:
+            self._finish(NO_RESPONSE)
+
+    def _finish(self, result):
+        self.done = True
+        if self.mqtt_client.client.is_connected():
+            # O estado só interessa no login; depois disso as próprias publicações não precisam voltar.
+            self.mqtt_client.unsubscribe_many([self.response_topic, self.state_topic, self.journal_topic])
+        self.on_result(result, (self.state, self.journal))
@@ -0,0 +1,259 @@
+from topic_router import TopicRouter, topic_matches
+import collections
+import itertools
+import queue
+import threading
+
+# Endereço de broker que seleciona o transporte em processo (ex.: --broker loopback).
+LOOPBACK_ADDRESS = "loopback"
+
+
+def _split_shared(topic_filter):
+    # "$share/<grupo>/<filtro>" -> (grupo, filtro); assinaturas comuns não têm grupo.
+    if topic_filter.startswith("$share/"):
+        _, group, real_filter = topic_filter.split("/", 2)
+        return group, real_filter
+    return None, topic_filter
+
+
+def _to_bytes(payload):
+    if payload is None:
+        return b""
+    if isinstance(payload, str):
+        return payload.encode()
+    if isinstance(payload, (bytes, bytearray)):
+        return bytes(payload)
+    return str(payload).encode()
+
+
+class LoopbackMessage:
+    # Mesmos atributos lidos dos objetos MQTTMessage do paho.
+    __slots__ = ("topic", "payload", "qos", "retain", "mid", "dup")
+
+    def __init__(self, topic, payload, qos=0, retain=False):
+        self.topic = topic
+        self.payload = payload
+        self.qos = qos
+        self.retain = retain
+        self.mid = 0
+        self.dup = False
+
+
+class LoopbackSession:
+    def __init__(self, client_id, clean_session):
+        self.client_id = client_id
+        self.clean_session = clean_session
+        self.subscriptions = {}
+        self.pending = collections.deque()
+        self.client = None
+
+
+class LoopbackBroker:
+    # Broker em memória para clientes no mesmo processo: mensagens retidas, sessões persistentes
+    # (fila QoS 1 enquanto o cliente está desconectado) e Last Will quando a conexão cai.
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.sessions = {}
+        self.retained = {}
+        self.router = TopicRouter()
+        self.share_turns = collections.Counter()
+
+    def client(self, client_id, clean_session=True):
+        return LoopbackClient(self, client_id, clean_session)
+
+    def attach(self, client):
+        with self.lock:
+            session = self.sessions.get(client.client_id)
+            if session is not None and session.client is not None:
+                # Mesmo client_id conectado de novo: a conexão antiga é derrubada, como num broker real.
+                self.detach(session.client, graceful=True, rc=1)
+                session = self.sessions.get(client.client_id)
+            if session is not None and client.clean_session:
+                self._drop_session(session)
+                session = None
+            present = session is not None
+            if session is None:
+                session = self.sessions[client.client_id] = LoopbackSession(client.client_id, client.clean_session)
+            session.clean_session = client.clean_session
+            session.client = client
+            client.session = session
+            client.post("connect", {"session present": int(present)}, 0)
+            while session.pending:
+                client.post("message", session.pending.popleft())
+
+    def detach(self, client, graceful=True, rc=0):
+        with self.lock:
+            session = client.session
+            if session is None or session.client is not client:
+                return
+            session.client = None
+            client.session = None
+            if session.clean_session:
+                self._drop_session(session)
+            client.post("disconnect", rc)
+            if not graceful and client.will:
+                self.publish(*client.will)
+
+    def _drop_session(self, session):
+        for topic_filter in session.subscriptions:
+            self.router.remove(_split_shared(topic_filter)[1], (session, topic_filter))
+        session.subscriptions.clear()
+        session.pending.clear()
+        if self.sessions.get(session.client_id) is session:
+            del self.sessions[session.client_id]
+
+    def subscribe(self, client, mid, subscriptions):
+        with self.lock:
+            session = client.session
+            if session is None:
+                return
+            granted = []
+            for topic_filter, qos in subscriptions:
+                if topic_filter not in session.subscriptions:
+                    self.router.add(_split_shared(topic_filter)[1], (session, topic_filter))
+                session.subscriptions[topic_filter] = qos
+                granted.append(qos)
+            client.post("subscribe", mid, tuple(granted))
+            for topic_filter, qos in subscriptions:
+                if _split_shared(topic_filter)[0] is not None:
+                    continue
+                for topic, (payload, retained_qos) in self.retained.items():
+                    if topic_matches(topic_filter, topic):
+                        client.post("message", LoopbackMessage(topic, payload, min(qos, retained_qos), retain=True))
+
+    def unsubscribe(self, client, mid, topic_filters):
+        with self.lock:
+            session = client.session
+            if session is None:
+                return
+            for topic_filter in topic_filters:
+                if session.subscriptions.pop(topic_filter, None) is not None:
+                    self.router.remove(_split_shared(topic_filter)[1], (session, topic_filter))
+            client.post("unsubscribe", mid)
+
+    def publish(self, topic, payload, qos=0, retain=False):
+        with self.lock:
+            if retain:
+                if payload:
+                    self.retained[topic] = (payload, qos)
+                else:
+                    self.retained.pop(topic, None)
+            # Um assinante com filtros sobrepostos recebe uma única cópia, com o maior QoS concedido;
+            # cada grupo de assinatura compartilhada recebe uma cópia, alternando entre os membros.
+            targets = {}
+            groups = collections.defaultdict(list)
+            for _, (session, topic_filter) in self.router.match(topic):
+                if _split_shared(topic_filter)[0] is not None:
+                    groups[topic_filter].append(session)
+                    continue
+                granted = min(qos, session.subscriptions[topic_filter])
+                targets[session] = max(targets.get(session, 0), granted)
+            for topic_filter, members in groups.items():
+                session = members[self.share_turns[topic_filter] % len(members)]
+                self.share_turns[topic_filter] += 1
+                granted = min(qos, session.subscriptions[topic_filter])
+                targets[session] = max(targets.get(session, 0), granted)
+            for session, granted in targets.items():
+                message = LoopbackMessage(topic, payload, granted)
+                if session.client is not None:
+                    session.client.post("message", message)
+                elif granted > 0:
+                    session.pending.append(message)
+
+
+class LoopbackClient:
+    # Subconjunto da API do paho.mqtt.client.Client (callbacks VERSION1) usado pelo MQTTClient.
+    # Os callbacks rodam numa thread própria, como na thread de rede do paho.
+    def __init__(self, broker, client_id, clean_session=True):
+        self.broker = broker
+        self.client_id = client_id
+        self.clean_session = clean_session
+        self.session = None
+        self.will = None
+        self.connected = False
+        self.on_connect = None
+        self.on_disconnect = None
+        self.on_message = None
+        self.on_subscribe = None
+        self.on_unsubscribe = None
+        self.on_publish = None
+        self.events = queue.SimpleQueue()
+        self.thread = None
+        self.mids = itertools.count(1)
+
+    def will_set(self, topic, payload=None, qos=0, retain=False):
+        self.will = (topic, _to_bytes(payload), qos, retain)
+
+    def connect(self, host=None, port=None, keepalive=60):
+        self.broker.attach(self)
+        return 0
+
+    def is_connected(self):
+        return self.connected
+
+    def loop_start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._loop, daemon=True)
+            self.thread.start()
+
+    def loop_stop(self):
+        if self.thread is not None:
+            self.events.put(None)
+            if self.thread is not threading.current_thread():
+                self.thread.join()
+            self.thread = None
+
+    def disconnect(self):
+        self.broker.detach(self, graceful=True)
+        self.connected = False
+        return 0
+
+    def close(self):
+        # Queda da conexão sem DISCONNECT: o broker publica o Last Will.
+        self.broker.detach(self, graceful=False, rc=1)
+        self.connected = False
+
+    def publish(self, topic, payload=None, qos=0, retain=False):
+        mid = next(self.mids)
+        if self.session is None:
+            return 4, mid
+        self.broker.publish(topic, _to_bytes(payload), qos, retain)
+        if qos > 0:
+            # O broker em processo entrega na hora; a confirmação segue pela thread de callbacks.
+            self.post("publish", mid)
+        return 0, mid
+
+    def subscribe(self, topic, qos=0):
+        mid = next(self.mids)
+        subscriptions = topic if isinstance(topic, list) else [(topic, qos)]
+        self.broker.subscribe(self, mid, subscriptions)
+        return 0, mid
+
+    def unsubscribe(self, topic):
+        mid = next(self.mids)
+        self.broker.unsubscribe(self, mid, topic if isinstance(topic, list) else [topic])
+        return 0, mid
+
+    def post(self, kind, *args):
+        self.events.put((kind, args))
+
+    def _loop(self):
+        while True:
+            event = self.events.get()
+            if event is None:
+                return
+            kind, args = event
+            if kind == "connect":
+                self.connected = True
+            elif kind == "disconnect":
+                self.connected = False
+            callback = getattr(self, f"on_{kind}")
+            if callback is None:
+                continue
+            try:
+                callback(self, None, *args)
+            except Exception as e:
+                print(f"Erro no callback '{kind}' do cliente '{self.client_id}': {e}")
+
+
+DEFAULT_BROKER = LoopbackBroker()
@@ -1,136 +1,52 @@
 import customtkinter as ctk
-from mqtt_client import MQTTClient
-import queue
-import threading
-import time
-import json      
+from manager_core import ManagerCore, DEFAULT_STATE_DIR
+from gui_dispatcher import GuiDispatcher
+from widget_cache import KeyedList
+from event_log import EventLog
+import argparse
+import compression
+import metrics
 
-UNIQUE_PREFIX = "ppd-plinio-final/"
 COLOR_ONLINE = "#1F6AA5"
 COLOR_OFFLINE = "#C21807"
-
-TOPIC_MGMT_USERS = f"{UNIQUE_PREFIX}sistema/gerenciamento/usuarios"
-TOPIC_MGMT_TOPICS = f"{UNIQUE_PREFIX}sistema/gerenciamento/topicos"
-TOPIC_PRESENCE = f"{UNIQUE_PREFIX}sistema/presenca"
-TOPIC_USER_MSG_BASE = f"{UNIQUE_PREFIX}usuarios"
-TOPIC_USER_MSG_WILDCARD = f"{TOPIC_USER_MSG_BASE}/+"
-TOPIC_ACK_BASE = f"{UNIQUE_PREFIX}sistema/ack"
-TOPIC_ACK_WILDCARD = f"{TOPIC_ACK_BASE}/+"
-TOPIC_AUTH_REQUEST = f"{UNIQUE_PREFIX}sistema/auth/request"
+QUEUE_STATUS_MS = 1000
 
 
 class ManagerApp(ctk.CTk):
-    def __init__(self):
+    def __init__(self, core=None, log_file=None, state_dir=DEFAULT_STATE_DIR):
         super().__init__()
         self.title("Gerenciador MOM")
         self.geometry("800x600")
         self.protocol("WM_DELETE_WINDOW", self.on_closing)
         self.grid_columnconfigure(0, weight=1); self.grid_columnconfigure(1, weight=1)
         self.grid_rowconfigure(0, weight=1); self.grid_rowconfigure(1, weight=1)
-        self.users = []
-        self.topics = []
-        self.message_counts = {}
-        self.user_status = {}
         self.create_widgets()
-        self.gui_queue = queue.Queue()
-        self.mqtt_client = MQTTClient(broker_address="broker.hivemq.com", on_message_callback=self.on_message)
-        if self.mqtt_client.connect():
-            self.mqtt_client.subscribe(f"{TOPIC_MGMT_USERS}/+", qos=1)
-            self.mqtt_client.subscribe(f"{TOPIC_MGMT_TOPICS}/+", qos=1)
-            self.mqtt_client.subscribe(TOPIC_USER_MSG_WILDCARD, qos=1)
-            self.mqtt_client.subscribe(TOPIC_ACK_WILDCARD, qos=0)
-            self.mqtt_client.subscribe(TOPIC_PRESENCE, qos=1)
-            self.mqtt_client.subscribe(TOPIC_AUTH_REQUEST, qos=0)
-            self.add_log("Cliente MQTT conectado e inscrito nos tópicos.")
-        else:
-            self.add_log("FALHA AO CONECTAR AO BROKER.")
-        self.process_gui_queue()
-    
-    def process_gui_queue(self):
-        try:
-            while True:
-                task = self.gui_queue.get_nowait()
-                if task: task()
-        except queue.Empty: pass
-        finally:
-            self.after(100, self.process_gui_queue)
-
-    def on_message(self, client, userdata, message):
-        self.gui_queue.put(lambda: self.handle_message(message.topic, message.payload.decode()))
-        
-    def handle_message(self, topic, payload):
-        if topic.startswith(TOPIC_USER_MSG_BASE): self.handle_user_message(topic, payload)
-        elif topic.startswith(TOPIC_ACK_BASE): self.handle_ack_message(topic)
-        elif topic.startswith(TOPIC_MGMT_USERS): self.handle_user_sync(topic, payload)
-        elif topic.startswith(TOPIC_MGMT_TOPICS): self.handle_topic_sync(topic, payload)
-        elif topic == TOPIC_PRESENCE: self.handle_presence_update(payload)
-        elif topic == TOPIC_AUTH_REQUEST: self.handle_auth_request(payload)
-
-    def handle_auth_request(self, payload):
-        try:
-            user_to_check, response_topic = payload.split(";")
-            if user_to_check in self.users:
-                self.mqtt_client.publish(response_topic, "VALIDO", qos=0)
-                self.add_log(f"AUTH: Login validado para o usuário '{user_to_check}'.")
-            else:
-                self.mqtt_client.publish(response_topic, "INVALIDO", qos=0)
-                self.add_log(f"AUTH: Login negado para o usuário inexistente '{user_to_check}'.")
-        except ValueError:
-            self.add_log(f"AUTH: Recebida requisição de autenticação mal formatada: {payload}")
-
-    def handle_presence_update(self, payload):
-        try:
-            user_name, status = payload.split(":")
-            if user_name in self.users:
-                self.user_status[user_name] = status
-                self.add_log(f"PRESENÇA: {user_name} está {status}")
-                self.update_user_list_display()
-        except ValueError: pass
-
-    def handle_user_message(self, topic, payload):
-        if payload:
-            user_name = topic.split('/')[-1]
-            if user_name in self.message_counts:
-                self.message_counts[user_name] += 1
-                self.add_log(f"INFO: Mensagem enviada para {user_name}. Contador da fila: {self.message_counts[user_name]}.")
-                self.update_counts_display()
-
-    def handle_ack_message(self, topic):
-        user_name = topic.split('/')[-1]
-        if user_name in self.message_counts and self.message_counts[user_name] > 0:
-            self.message_counts[user_name] -= 1
-            self.add_log(f"INFO: {user_name} consumiu mensagem. Contador da fila: {self.message_counts[user_name]}.")
-            self.update_counts_display()
-
-    def handle_user_sync(self, topic, payload):
-        user_name = topic.split('/')[-1]
-        if payload == "ADD":
-            if user_name not in self.users:
-                self.users.append(user_name)
-                if user_name not in self.message_counts: self.message_counts[user_name] = 0
-                if user_name not in self.user_status: self.user_status[user_name] = "OFFLINE"
-                self.add_log(f"INFO: Usuário '{user_name}' sincronizado.")
-                self.update_all_displays()
-        elif not payload:
-            if user_name in self.users:
-                self.users.remove(user_name)
-                if user_name in self.message_counts: del self.message_counts[user_name]
-                if user_name in self.user_status: del self.user_status[user_name]
-                self.add_log(f"INFO: Usuário '{user_name}' removido.")
-                self.update_all_displays()
-
-    def handle_topic_sync(self, topic, payload):
-        topic_name = topic.split('/')[-1]
-        if payload == "ADD":
-            if topic_name not in self.topics:
-                self.topics.append(topic_name)
-                self.add_log(f"INFO: Tópico '{topic_name}' sincronizado.")
-                self.update_topic_list_display()
-        elif not payload:
-            if topic_name in self.topics:
-                self.topics.remove(topic_name)
-                self.add_log(f"INFO: Tópico '{topic_name}' removido.")
-                self.update_topic_list_display()
+        self.gui_queue = GuiDispatcher(self)
+        self.event_log = EventLog(self.log_textbox, self.gui_queue, spill_path=log_file)
+        self.owns_core = core is None
+        self.core = core or ManagerCore(state_dir=state_dir)
+        self.core.add_listener(self.on_core_event)
+        self.load_core_state()
+        if self.owns_core:
+            self.core.start()
+        self.gui_queue.start()
+        self.update_queue_status()
+
+    def on_core_event(self, event, *args):
+        # Chamado na thread de rede (ou de um worker) do núcleo: apenas agenda trabalho para o Tk.
+        if event == "log": self.add_log(args[0])
+        elif event == "user": self.schedule_user_row(args[0])
+        elif event == "count": self.schedule_count(args[0])
+        elif event == "topic": self.schedule_topic_row(args[0])
+
+    def load_core_state(self):
+        with self.core.lock:
+            users, topics = list(self.core.users), list(self.core.topics)
+        for user_name in users:
+            self.schedule_user_row(user_name)
+            self.schedule_count(user_name)
+        for topic_name in topics:
+            self.schedule_topic_row(topic_name)
 
     def create_widgets(self):
         user_frame = ctk.CTkFrame(self)
@@ -171,98 +87,65 @@ class ManagerApp(ctk.CTk):
         log_frame.grid_rowconfigure(1, weight=1)
         log_label = ctk.CTkLabel(log_frame, text="Log de Eventos", font=ctk.CTkFont(size=15, weight="bold"))
         log_label.grid(row=0, column=0, padx=10, pady=10)
+        self.detail_log_switch = ctk.CTkSwitch(log_frame, text="Log por mensagem", command=self.toggle_detail_log)
+        self.detail_log_switch.grid(row=0, column=1, padx=10, pady=10)
+        self.detail_log_switch.select()
         self.log_textbox = ctk.CTkTextbox(log_frame, state="disabled", wrap="word")
-        self.log_textbox.grid(row=1, column=0, padx=10, pady=(0,10), sticky="nsew")
+        self.log_textbox.grid(row=1, column=0, columnspan=2, padx=10, pady=(0,10), sticky="nsew")
+        # Profundidade da fila da interface e descartes por excesso de carga (também em /metrics).
+        self.queue_status_label = ctk.CTkLabel(log_frame, text="", text_color="gray", anchor="w")
+        self.queue_status_label.grid(row=2, column=0, columnspan=2, padx=10, pady=(0, 5), sticky="ew")
+        self.user_list = KeyedList(self.user_list_frame, self.create_user_list_item,
+                                   sections=(("ONLINE", "Online ({})", (5, 2)), ("OFFLINE", "Offline ({})", (10, 2))),
+                                   row_pack=dict(fill="x", padx=5, pady=2), name="usuarios")
+        self.topic_list = KeyedList(self.topic_list_frame, self.create_topic_list_item,
+                                    row_pack=dict(fill="x", padx=5, pady=2), name="topicos")
+        self.counts_list = KeyedList(self.counts_display_frame, self.create_count_item, self.update_count_item,
+                                     row_pack=dict(fill="x", padx=10, pady=2), name="contadores")
 
     def add_log(self, message):
-        self.log_textbox.configure(state="normal")
-        self.log_textbox.insert("end", message + "\n")
-        self.log_textbox.configure(state="disabled")
-        self.log_textbox.see("end")
+        self.event_log.append(message)
 
-    def _prime_user_session(self, username):
-        self.add_log(f"Preparando sessão persistente para o novo usuário: {username}...")
-        
-        temp_client = MQTTClient(broker_address="broker.hivemq.com", 
-                                 client_id=username, 
-                                 clean_session=False)
-        
-        if temp_client.connect():
-            private_topic = f"{TOPIC_USER_MSG_BASE}/{username}"
-            temp_client.subscribe(private_topic, qos=1)
-            
-            time.sleep(1) 
-            
-            temp_client.disconnect()
-            self.add_log(f"Sessão para '{username}' preparada com sucesso no broker.")
-        else:
-            self.add_log(f"FALHA ao preparar a sessão para '{username}'.")
+    def update_queue_status(self):
+        self.queue_status_label.configure(text=self.gui_queue.status_text())
+        self.after(QUEUE_STATUS_MS, self.update_queue_status)
 
+    def toggle_detail_log(self):
+        self.core.log_details = bool(self.detail_log_switch.get())
 
     def add_user(self):
-        user_name = self.user_entry.get().strip()
-        if not user_name:
-            self.add_log("ERRO: Nome do usuário não pode ser vazio.")
-            return
-        if user_name in self.users:
-            self.add_log(f"ERRO: Usuário '{user_name}' já existe.")
-            return
-            
-        self.mqtt_client.publish(f"{TOPIC_MGMT_USERS}/{user_name}", "ADD", retain=True)
-        
-        threading.Thread(target=self._prime_user_session, args=(user_name,), daemon=True).start()
-        
-        self.add_log(f"Comando para adicionar usuário '{user_name}' publicado.")
-        self.user_entry.delete(0, "end")
-    
-    def remove_user(self, user_name):
-        self.mqtt_client.publish(TOPIC_PRESENCE, f"{user_name}:OFFLINE", retain=True)
-        self.mqtt_client.publish(f"{TOPIC_MGMT_USERS}/{user_name}", "", retain=True)
-        
-        user_private_topic = f"{TOPIC_USER_MSG_BASE}/{user_name}"
-        self.mqtt_client.publish(user_private_topic, "", retain=True, qos=1)
+        if self.core.add_user(self.user_entry.get().strip()):
+            self.user_entry.delete(0, "end")
 
-        self.add_log(f"Comando para remover usuário '{user_name}' publicado.")
+    def remove_user(self, user_name):
+        self.core.remove_user(user_name)
 
     def add_topic(self):
-        topic_name = self.topic_entry.get().strip()
-        if not topic_name:
-            self.add_log("ERRO: Nome do tópico não pode ser vazio.")
-            return
-        if topic_name in self.topics:
-            self.add_log(f"ERRO: Tópico '{topic_name}' já existe.")
-            return
-        self.mqtt_client.publish(f"{TOPIC_MGMT_TOPICS}/{topic_name}", "ADD", retain=True)
-        self.add_log(f"Comando para adicionar tópico '{topic_name}' publicado.")
-        self.topic_entry.delete(0, "end")
+        if self.core.add_topic(self.topic_entry.get().strip()):
+            self.topic_entry.delete(0, "end")
 
     def remove_topic(self, topic_name):
-        self.mqtt_client.publish(f"{TOPIC_MGMT_TOPICS}/{topic_name}", "", retain=True)
-        self.add_log(f"Comando para remover tópico '{topic_name}' publicado.")
+        self.core.remove_topic(topic_name)
+
+    def schedule_user_row(self, user_name):
+        self.gui_queue.schedule(("user_row", user_name), lambda: self.update_user_list_display(user_name))
+
+    def schedule_count(self, user_name):
+        self.gui_queue.schedule(("count", user_name), lambda: self.update_counts_display(user_name))
 
-    def update_all_displays(self):
-        self.update_user_list_display()
-        self.update_counts_display()
-    
-    def update_user_list_display(self):
-        for widget in self.user_list_frame.winfo_children(): widget.destroy()
-        online_users = [u for u in self.users if self.user_status.get(u) == "ONLINE"]
-        offline_users = [u for u in self.users if self.user_status.get(u) != "ONLINE"]
-        if online_users:
-            header = ctk.CTkLabel(self.user_list_frame, text=f"Online ({len(online_users)})", font=ctk.CTkFont(weight="bold"))
-            header.pack(anchor="w", padx=5, pady=(5, 2))
-            for user_name in sorted(online_users):
-                self.create_user_list_item(user_name, True)
-        if offline_users:
-            header = ctk.CTkLabel(self.user_list_frame, text=f"Offline ({len(offline_users)})", font=ctk.CTkFont(weight="bold"))
-            header.pack(anchor="w", padx=5, pady=(10, 2))
-            for user_name in sorted(offline_users):
-                self.create_user_list_item(user_name, False)
-                
-    def create_user_list_item(self, user_name, is_online):
-        color = COLOR_ONLINE if is_online else COLOR_OFFLINE
-        item_frame = ctk.CTkFrame(self.user_list_frame)
-        item_frame.pack(fill="x", padx=5, pady=2)
+    def schedule_topic_row(self, topic_name):
+        self.gui_queue.schedule(("topic_row", topic_name), lambda: self.update_topic_list_display(topic_name))
+
+    def update_user_list_display(self, user_name):
+        if user_name not in self.core.users:
+            self.user_list.remove(user_name)
+            return
+        status = "ONLINE" if self.core.users.status(user_name) == "ONLINE" else "OFFLINE"
+        self.user_list.set(user_name, status, section=status)
+
+    def create_user_list_item(self, parent, user_name, status):
+        color = COLOR_ONLINE if status == "ONLINE" else COLOR_OFFLINE
+        item_frame = ctk.CTkFrame(parent)
         item_frame.grid_columnconfigure(1, weight=1)
         dot_label = ctk.CTkLabel(item_frame, text="●", text_color=color, font=ctk.CTkFont(size=18))
         dot_label.grid(row=0, column=0, sticky="w", padx=(5,2))
@@ -270,36 +153,54 @@ class ManagerApp(ctk.CTk):
         name_label.grid(row=0, column=1, sticky="ew")
         remove_button = ctk.CTkButton(item_frame, text="Remover", width=70, command=lambda name=user_name: self.remove_user(name))
         remove_button.grid(row=0, column=2, padx=5)
+        return item_frame
 
-    def update_topic_list_display(self):
-        for widget in self.topic_list_frame.winfo_children(): widget.destroy()
+    def update_topic_list_display(self, topic_name):
+        if topic_name in self.core.topics:
+            self.topic_list.set(topic_name)
+        else:
+            self.topic_list.remove(topic_name)
+
+    def create_topic_list_item(self, parent, topic_name, value):
+        item_frame = ctk.CTkFrame(parent)
+        item_frame.grid_columnconfigure(0, weight=1)
         
-        for topic_name in sorted(self.topics):
-            item_frame = ctk.CTkFrame(self.topic_list_frame)
-            item_frame.pack(fill="x", padx=5, pady=2)
-            item_frame.grid_columnconfigure(0, weight=1)
-            
-            label = ctk.CTkLabel(item_frame, text=topic_name, anchor="w")
-            label.grid(row=0, column=0, sticky="ew", padx=5)
+        label = ctk.CTkLabel(item_frame, text=topic_name, anchor="w")
+        label.grid(row=0, column=0, sticky="ew", padx=5)
+
+        remove_button = ctk.CTkButton(item_frame, text="Remover", width=70,
+                                      command=lambda name=topic_name: self.remove_topic(name))
+        remove_button.grid(row=0, column=1, padx=5)
+        return item_frame
+
+    def update_counts_display(self, user_name):
+        count = self.core.message_counts.get(user_name)
+        if count is not None:
+            self.counts_list.set(user_name, count)
+        else:
+            self.counts_list.remove(user_name)
 
-            remove_button = ctk.CTkButton(item_frame, text="Remover", width=70,
-                                          command=lambda name=topic_name: self.remove_topic(name))
-            remove_button.grid(row=0, column=1, padx=5)
+    def create_count_item(self, parent, user_name, count):
+        return ctk.CTkLabel(parent, text=f"{user_name}: {count}", anchor="w")
 
-    def update_counts_display(self):
-        for widget in self.counts_display_frame.winfo_children():
-            widget.destroy()
-        
-        for user_name, count in sorted(self.message_counts.items()):
-            label_text = f"{user_name}: {count}"
-            label = ctk.CTkLabel(self.counts_display_frame, text=label_text, anchor="w")
-            label.pack(fill="x", padx=10, pady=2)
+    def update_count_item(self, label, user_name, count):
+        label.configure(text=f"{user_name}: {count}")
 
     def on_closing(self):
-        if self.mqtt_client:
-            self.mqtt_client.disconnect()
+        self.core.remove_listener(self.on_core_event)
+        if self.owns_core:
+            self.core.stop()
         self.destroy()
 
 if __name__ == "__main__":
-    app = ManagerApp()
+    parser = argparse.ArgumentParser(description="Gerenciador MOM.")
+    parser.add_argument("--log-file", help="Grava o log de eventos também em um arquivo rotativo.")
+    parser.add_argument("--state-dir", default=DEFAULT_STATE_DIR,
+                        help="Diretório do estado persistido (vazio desativa a persistência).")
+    compression.add_arguments(parser)
+    metrics.add_arguments(parser)
+    args = parser.parse_args()
+    compression.configure_from_args(args)
+    metrics.start_from_args(args)
+    app = ManagerApp(log_file=args.log_file, state_dir=args.state_dir or None)
     app.mainloop()
\ No newline at end of file
@@ -0,0 +1,443 @@
+from mqtt_client import MQTTClient
+from event_log import open_spill_log
+from manager_store import ManagerStore
+from manager_shards import ShardReporter, shard_of
+from mgmt_sync import SnapshotPublisher, encode_delta
+from presence import RosterPublisher
+from registry import Registry
+import envelope
+import compression
+import metrics
+from provision import prime_sessions, provision_users
+from topic_router import TopicRouter
+from topics import (BROKER_ADDRESS, TOPIC_MGMT_USERS, TOPIC_MGMT_TOPICS, TOPIC_MGMT_USERS_WILDCARD,
+                    TOPIC_MGMT_TOPICS_WILDCARD, TOPIC_PRESENCE, TOPIC_USER_MSG_BASE, TOPIC_USER_MSG_WILDCARD,
+                    TOPIC_ACK_BASE, TOPIC_ACK_WILDCARD, TOPIC_AUTH_REQUEST, MANAGER_SHARE_GROUP,
+                    TOPIC_MGMT_DELTA, TOPIC_PRESENCE_USERS, TOPIC_PRESENCE_USERS_WILDCARD)
+import argparse
+import asyncio
+import datetime
+import os
+import queue
+import random
+import threading
+import time
+import zlib
+
+DEFAULT_STATE_DIR = os.path.join(os.path.expanduser("~"), ".mom", "gerenciador")
+# Tópicos por SUBSCRIBE ao assinar as filas de um shard: poucos pacotes sem esbarrar no limite do broker.
+SUBSCRIBE_CHUNK = 500
+
+
+class ManagerCore:
+    def __init__(self, broker_address=BROKER_ADDRESS, workers=0, state_dir=None, port=1883, shard=0, shards=1):
+        self.broker_address = broker_address
+        self.port = port
+        self.shard = shard
+        self.shards = shards
+        self.shard_reporter = None
+        self.users = Registry()
+        self.topics = Registry(default_status=None)
+        self.message_counts = {}
+        self.ack_positions = {}
+        # Versão do cadastro publicada no snapshot/deltas; a época muda quando a numeração recomeça.
+        self.mgmt_epoch = random.getrandbits(31)
+        self.mgmt_version = 0
+        self.snapshot_publisher = None
+        self.roster_publisher = None
+        self.store = ManagerStore(state_dir) if state_dir else None
+        if self.store:
+            state = self.store.load()
+            self.users = Registry(state["users"], statuses=state["status"])
+            self.topics = Registry(state["topics"], default_status=None)
+            self.message_counts = {u: state["counts"].get(u, 0) for u in self.users}
+            self.ack_positions = state["acks"]
+            if state["epoch"] is not None:
+                self.mgmt_epoch, self.mgmt_version = state["epoch"], state["version"]
+        self.lock = threading.RLock()
+        self.log_details = True
+        self.listeners = []
+        self.workers = workers
+        self.worker_queues = []
+        self.router = TopicRouter()
+        self.router.add(TOPIC_USER_MSG_WILDCARD, self.handle_user_message)
+        self.router.add(TOPIC_ACK_WILDCARD, self.handle_ack_message)
+        self.router.add(TOPIC_MGMT_USERS_WILDCARD, self.handle_user_sync)
+        self.router.add(TOPIC_MGMT_TOPICS_WILDCARD, self.handle_topic_sync)
+        self.router.add(TOPIC_PRESENCE_USERS_WILDCARD, lambda topic, payload: self.handle_presence_update(payload))
+        # Tópico único da versão anterior, ainda usado por clientes não atualizados.
+        self.router.add(TOPIC_PRESENCE, lambda topic, payload: self.handle_presence_update(payload))
+        self.router.add(TOPIC_AUTH_REQUEST, lambda topic, payload: self.handle_auth_request(payload))
+        self.mqtt_client = MQTTClient(broker_address=broker_address, port=port, on_message_callback=self.on_message)
+
+    def add_listener(self, listener):
+        self.listeners.append(listener)
+
+    def remove_listener(self, listener):
+        if listener in self.listeners:
+            self.listeners.remove(listener)
+
+    def emit(self, event, *args):
+        for listener in self.listeners:
+            listener(event, *args)
+
+    def log(self, message):
+        self.emit("log", message)
+
+    def owns(self, user_name):
+        return self.shards == 1 or shard_of(user_name, self.shards) == self.shard
+
+    def _user_topics(self, user_name):
+        return f"{TOPIC_USER_MSG_BASE}/{user_name}", f"{TOPIC_ACK_BASE}/{user_name}"
+
+    def start(self):
+        for _ in range(self.workers):
+            worker_queue = queue.SimpleQueue()
+            self.worker_queues.append(worker_queue)
+            threading.Thread(target=self._worker_loop, args=(worker_queue,), daemon=True).start()
+
+        if self.mqtt_client.connect():
+            subscriptions = [(TOPIC_MGMT_USERS_WILDCARD, 1), (TOPIC_MGMT_TOPICS_WILDCARD, 1),
+                             (TOPIC_PRESENCE_USERS_WILDCARD, 1), (TOPIC_PRESENCE, 1)]
+            if self.shards == 1:
+                self.mqtt_client.subscribe_many(subscriptions + [(TOPIC_USER_MSG_WILDCARD, 1), (TOPIC_ACK_WILDCARD, 1),
+                                                                 (TOPIC_AUTH_REQUEST, 0)])
+            else:
+                # Cada shard assina só as filas e ACKs dos seus usuários; o login vai para um shard qualquer.
+                self.mqtt_client.subscribe_many(subscriptions +
+                                                [(f"$share/{MANAGER_SHARE_GROUP}/{TOPIC_AUTH_REQUEST}", 0)])
+                with self.lock:
+                    owned = [u for u in self.users if self.owns(u)]
+                user_topics = [(topic, 1) for user_name in owned for topic in self._user_topics(user_name)]
+                for i in range(0, len(user_topics), SUBSCRIBE_CHUNK):
+                    self.mqtt_client.subscribe_many(user_topics[i:i + SUBSCRIBE_CHUNK])
+                self.shard_reporter = ShardReporter(self)
+                self.add_listener(self.shard_reporter.on_core_event)
+                self.shard_reporter.publish_all()
+                self.log(f"Shard {self.shard + 1}/{self.shards}: {len(owned)} usuário(s) atribuído(s).")
+            if self.shard == 0:
+                # Só um processo numera as mudanças do cadastro.
+                self.snapshot_publisher = SnapshotPublisher(self)
+                self.add_listener(self.snapshot_publisher.on_core_event)
+                if self.store:
+                    self.snapshot_publisher.publish()
+                # Lotes de presença para os clientes; todo shard recebe a presença de todos os usuários.
+                self.roster_publisher = RosterPublisher(self.mqtt_client)
+                self.add_listener(self.roster_publisher.on_core_event)
+                self.roster_publisher.start()
+            self.log("Cliente MQTT conectado e inscrito nos tópicos.")
+            return True
+        self.log("FALHA AO CONECTAR AO BROKER.")
+        return False
+
+    def stop(self):
+        for worker_queue in self.worker_queues:
+            worker_queue.put(None)
+        if self.shard_reporter:
+            self.shard_reporter.close()
+            self.shard_reporter.publish_all()
+        if self.snapshot_publisher:
+            self.snapshot_publisher.close()
+            self.snapshot_publisher.publish()
+        if self.roster_publisher:
+            self.roster_publisher.close()
+            self.roster_publisher.publish()
+        self.mqtt_client.disconnect()
+        if self.store:
+            with self.lock:
+                self.store.snapshot(self.export_state())
+            self.store.close()
+
+    def export_state(self):
+        with self.lock:
+            return {"users": list(self.users), "topics": list(self.topics),
+                    "counts": dict(self.message_counts), "status": self.users.statuses(),
+                    "acks": dict(self.ack_positions), "epoch": self.mgmt_epoch, "version": self.mgmt_version}
+
+    def _record(self, *fields):
+        # Chamado com self.lock adquirido, logo após a mudança de estado correspondente.
+        if self.store and self.store.append(*fields):
+            self.store.snapshot(self.export_state())
+
+    def _mgmt_change(self, op, name):
+        # Chamado com self.lock adquirido: o delta sai na mesma ordem da numeração.
+        if self.shard != 0:
+            return
+        self.mgmt_version += 1
+        self._record("v", self.mgmt_epoch, self.mgmt_version)
+        self.mqtt_client.publish(TOPIC_MGMT_DELTA, encode_delta(self.mgmt_epoch, self.mgmt_version, op, name), qos=1)
+
+    def _worker_loop(self, worker_queue):
+        while True:
+            item = worker_queue.get()
+            if item is None:
+                return
+            self.handle_message(*item)
+
+    def on_message(self, client, userdata, message):
+        # O payload segue em bytes; cada handler decodifica apenas o que precisa.
+        topic, payload = message.topic, message.payload
+        if not self.worker_queues:
+            self.handle_message(topic, payload)
+            return
+        # O último nível do tópico (usuário ou tópico) escolhe o worker, preservando a ordem por chave.
+        key = topic.rsplit('/', 1)[-1].encode()
+        self.worker_queues[zlib.crc32(key) % len(self.worker_queues)].put((topic, payload))
+
+    def handle_message(self, topic, payload):
+        self.router.dispatch(topic, payload)
+
+    def handle_auth_request(self, payload):
+        try:
+            request = envelope.decode(payload, envelope.KIND_AUTH_REQUEST)
+            user_to_check, response_topic = request.sender, request.text
+            if user_to_check in self.users:
+                self.mqtt_client.publish(response_topic, envelope.encode(envelope.KIND_AUTH_RESPONSE, body="VALIDO"), qos=0)
+                self.log(f"AUTH: Login validado para o usuário '{user_to_check}'.")
+            else:
+                self.mqtt_client.publish(response_topic, envelope.encode(envelope.KIND_AUTH_RESPONSE, body="INVALIDO"), qos=0)
+                self.log(f"AUTH: Login negado para o usuário inexistente '{user_to_check}'.")
+        except ValueError:
+            self.log(f"AUTH: Recebida requisição de autenticação mal formatada: {bytes(payload)!r}")
+
+    def handle_presence_update(self, payload):
+        try:
+            update = envelope.decode(payload, envelope.KIND_PRESENCE)
+            user_name, status = update.sender, update.text
+        except ValueError:
+            return
+        self.emit("presence", user_name, status)
+        with self.lock:
+            # Presença de um usuário ainda não sincronizado fica guardada no registro até o cadastro.
+            if not self.owns(user_name) or not self.users.set_status(user_name, status):
+                return
+            self._record("s", user_name, status)
+        self.log(f"PRESENÇA: {user_name} está {status}")
+        self.emit("user", user_name)
+
+    def handle_user_message(self, topic, payload):
+        if payload:
+            user_name = topic.split('/')[-1]
+            try:
+                message = envelope.Envelope.parse(payload)
+                delivered = envelope.batch_size(message) if message and message.kind == envelope.KIND_BATCH else 1
+            except ValueError:
+                self.log(f"INFO: Mensagem mal formatada para {user_name} ignorada.")
+                return
+            with self.lock:
+                if user_name not in self.message_counts:
+                    return
+                self.message_counts[user_name] += delivered
+                count = self.message_counts[user_name]
+                self._record("c", user_name, count)
+            if self.log_details:
+                self.log(f"INFO: Mensagem enviada para {user_name}. Contador da fila: {count}.")
+            self.emit("count", user_name)
+
+    def handle_ack_message(self, topic, payload):
+        try:
+            position = envelope.ack_position(payload)
+        except ValueError:
+            self.log(f"ACK: Confirmação mal formatada em {topic}.")
+            return
+        user_name = topic.split('/')[-1]
+        with self.lock:
+            if user_name not in self.message_counts:
+                return
+            if position is None:
+                consumed = 1
+            else:
+                # ACK cumulativo: aplica de uma vez tudo o que foi confirmado desde o último recebido.
+                session, acked = position
+                last_session, last_acked = self.ack_positions.get(user_name, (None, 0))
+                consumed = acked - last_acked if session == last_session else acked
+                if consumed <= 0:
+                    return
+                self.ack_positions[user_name] = (session, acked)
+                self._record("a", user_name, session, acked)
+            if not self.message_counts.get(user_name):
+                return
+            self.message_counts[user_name] = max(0, self.message_counts[user_name] - consumed)
+            count = self.message_counts[user_name]
+            self._record("c", user_name, count)
+        if self.log_details:
+            self.log(f"INFO: {user_name} consumiu {consumed} mensagem(ns). Contador da fila: {count}.")
+        self.emit("count", user_name)
+
+    def handle_user_sync(self, topic, payload):
+        user_name = topic.split('/')[-1]
+        with self.lock:
+            if payload == b"ADD":
+                if not self.users.add(user_name):
+                    return
+                if user_name not in self.message_counts: self.message_counts[user_name] = 0
+                self._record("u+", user_name)
+                self._mgmt_change("u+", user_name)
+                if self.users.status(user_name) != "OFFLINE":
+                    self._record("s", user_name, self.users.status(user_name))
+                message = f"INFO: Usuário '{user_name}' sincronizado."
+            elif not payload:
+                if not self.users.remove(user_name):
+                    return
+                if user_name in self.message_counts: del self.message_counts[user_name]
+                self.ack_positions.pop(user_name, None)
+                self._record("u-", user_name)
+                self._mgmt_change("u-", user_name)
+                message = f"INFO: Usuário '{user_name}' removido."
+            else:
+                return
+        if self.shards > 1 and self.owns(user_name):
+            if payload:
+                self.mqtt_client.subscribe_many([(user_topic, 1) for user_topic in self._user_topics(user_name)])
+            else:
+                self.mqtt_client.unsubscribe_many(self._user_topics(user_name))
+        self.log(message)
+        self.emit("user", user_name)
+        self.emit("count", user_name)
+
+    def handle_topic_sync(self, topic, payload):
+        topic_name = topic.split('/')[-1]
+        with self.lock:
+            if payload == b"ADD":
+                if not self.topics.add(topic_name):
+                    return
+                self._record("t+", topic_name)
+                self._mgmt_change("t+", topic_name)
+                message = f"INFO: Tópico '{topic_name}' sincronizado."
+            elif not payload:
+                if not self.topics.remove(topic_name):
+                    return
+                self._record("t-", topic_name)
+                self._mgmt_change("t-", topic_name)
+                message = f"INFO: Tópico '{topic_name}' removido."
+            else:
+                return
+        self.log(message)
+        self.emit("topic", topic_name)
+
+    def _prime_user_session(self, username):
+        self.log(f"Preparando sessão persistente para o novo usuário: {username}...")
+
+        failures = asyncio.run(prime_sessions([username], broker_address=self.broker_address, port=self.port))
+        if failures:
+            self.log(f"FALHA ao preparar a sessão para '{username}': {failures[username]}")
+        else:
+            self.log(f"Sessão para '{username}' preparada com sucesso no broker.")
+
+    def _provision_users(self, usernames):
+        report = asyncio.run(provision_users(usernames, broker_address=self.broker_address, port=self.port))
+        for line in report.summary().splitlines():
+            self.log(f"LOTE: {line}")
+
+    def add_user(self, user_name):
+        if not user_name:
+            self.log("ERRO: Nome do usuário não pode ser vazio.")
+            return False
+        if user_name in self.users:
+            self.log(f"ERRO: Usuário '{user_name}' já existe.")
+            return False
+
+        self.mqtt_client.publish(f"{TOPIC_MGMT_USERS}/{user_name}", "ADD", retain=True)
+
+        threading.Thread(target=self._prime_user_session, args=(user_name,), daemon=True).start()
+
+        self.log(f"Comando para adicionar usuário '{user_name}' publicado.")
+        return True
+
+    def add_users(self, usernames):
+        usernames = [u for u in dict.fromkeys(usernames) if u and u not in self.users]
+        if not usernames:
+            self.log("ERRO: Nenhum usuário novo para cadastrar.")
+            return False
+        threading.Thread(target=self._provision_users, args=(usernames,), daemon=True).start()
+        self.log(f"Cadastro em lote de {len(usernames)} usuário(s) iniciado.")
+        return True
+
+    def remove_user(self, user_name):
+        presence_topic = f"{TOPIC_PRESENCE_USERS}/{user_name}"
+        self.mqtt_client.publish(presence_topic, envelope.encode(envelope.KIND_PRESENCE, user_name, "OFFLINE"), qos=1)
+        self.mqtt_client.publish(presence_topic, "", retain=True, qos=1)
+        self.mqtt_client.publish(f"{TOPIC_MGMT_USERS}/{user_name}", "", retain=True)
+
+        user_private_topic = f"{TOPIC_USER_MSG_BASE}/{user_name}"
+        self.mqtt_client.publish(user_private_topic, "", retain=True, qos=1)
+
+        self.log(f"Comando para remover usuário '{user_name}' publicado.")
+
+    def add_topic(self, topic_name):
+        if not topic_name:
+            self.log("ERRO: Nome do tópico não pode ser vazio.")
+            return False
+        if topic_name in self.topics:
+            self.log(f"ERRO: Tópico '{topic_name}' já existe.")
+            return False
+        self.mqtt_client.publish(f"{TOPIC_MGMT_TOPICS}/{topic_name}", "ADD", retain=True)
+        self.log(f"Comando para adicionar tópico '{topic_name}' publicado.")
+        return True
+
+    def remove_topic(self, topic_name):
+        self.mqtt_client.publish(f"{TOPIC_MGMT_TOPICS}/{topic_name}", "", retain=True)
+        self.log(f"Comando para remover tópico '{topic_name}' publicado.")
+
+
+def make_log_printer(spill_path=None):
+    spill = open_spill_log(spill_path) if spill_path else None
+
+    def print_log(event, *args):
+        if event == "log":
+            timestamp = datetime.datetime.now().strftime("%H:%M:%S")
+            line = f"[{timestamp}] {args[0]}"
+            print(line, flush=True)
+            if spill:
+                spill.info(line)
+    return print_log
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Gerenciador MOM sem interface gráfica.")
+    parser.add_argument("--broker", default=BROKER_ADDRESS)
+    parser.add_argument("--port", type=int, default=1883)
+    parser.add_argument("--workers", type=int, default=0,
+                        help="Threads de processamento (0 = processa na thread de rede).")
+    parser.add_argument("--log-file", help="Grava o log também em um arquivo rotativo.")
+    parser.add_argument("--state-dir", default=DEFAULT_STATE_DIR,
+                        help="Diretório do estado persistido (contadores, presença e cadastro).")
+    parser.add_argument("--quiet", action="store_true",
+                        help="Omite as linhas de log por mensagem (envio e consumo).")
+    parser.add_argument("--shard", type=int, default=0, help="Índice deste processo entre os shards (0..N-1).")
+    parser.add_argument("--shards", type=int, default=1,
+                        help="Total de shards; cada um cuida dos usuários cujo hash cai no seu índice.")
+    parser.add_argument("--route-stats", type=float, default=0,
+                        help="Intervalo (s) para exibir as mensagens recebidas por rota (0 = só ao encerrar).")
+    compression.add_arguments(parser)
+    metrics.add_arguments(parser)
+    args = parser.parse_args()
+    compression.configure_from_args(args)
+    metrics.start_from_args(args)
+
+    state_dir = args.state_dir or None
+    if state_dir and args.shards > 1:
+        state_dir = os.path.join(state_dir, f"shard-{args.shard}")
+    core = ManagerCore(broker_address=args.broker, workers=args.workers, state_dir=state_dir,
+                       port=args.port, shard=args.shard, shards=args.shards)
+    core.log_details = not args.quiet
+    core.add_listener(make_log_printer(args.log_file))
+    if not core.start():
+        return 1
+    next_report = time.monotonic() + args.route_stats
+    try:
+        while True:
+            time.sleep(1)
+            if args.route_stats and time.monotonic() >= next_report:
+                next_report += args.route_stats
+                print(core.router.report(), flush=True)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        core.stop()
+        print(core.router.report(), flush=True)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
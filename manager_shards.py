@@ -0,0 +1,183 @@
+from mqtt_client import MQTTClient
+from throttle import Throttle
+from topics import (BROKER_ADDRESS, TOPIC_MANAGER_SHARDS_BASE, TOPIC_MANAGER_SHARDS_WILDCARD,
+                    TOPIC_MANAGER_SHARD_USERS_WILDCARD)
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+import zlib
+
+REPORT_INTERVAL_MS = 500
+
+
+def shard_of(user_name, shards):
+    return zlib.crc32(user_name.encode()) % shards
+
+
+class ShardReporter:
+    # Publica (retido) o estado do shard em duas partes: um registro [contador, presença, época] por
+    # usuário que ele possui, em .../shards/<shard>/usuarios/<usuário>, republicado só quando muda, e
+    # um resumo pequeno com os totais. Mudanças em rajada saem no máximo a cada interval_ms. A época
+    # muda a cada início do processo: registros de uma execução anterior são ignorados pelo agregador.
+    def __init__(self, core, interval_ms=REPORT_INTERVAL_MS):
+        self.core = core
+        self.topic = f"{TOPIC_MANAGER_SHARDS_BASE}/{core.shard}"
+        self.epoch = random.getrandbits(31)
+        self.published = {}
+        self.pending = 0
+        self.dirty = set()
+        self.summary = None
+        self.lock = threading.Lock()
+        self.throttle = Throttle(self.publish, interval_ms)
+
+    def on_core_event(self, event, *args):
+        if event not in ("count", "user"):
+            return
+        with self.lock:
+            self.dirty.add(args[0])
+        self.throttle.request()
+
+    def publish_all(self):
+        # Início e fim do shard: confere todos os usuários que ele possui, não só os alterados.
+        core = self.core
+        with core.lock:
+            owned = [u for u in core.users if core.owns(u)]
+        with self.lock:
+            self.dirty.update(owned)
+            self.dirty.update(self.published)
+        self.publish()
+
+    def publish(self):
+        core = self.core
+        with self.lock:
+            dirty, self.dirty = self.dirty, set()
+        with core.lock:
+            records = {u: [core.message_counts.get(u, 0), core.users.status(u, "OFFLINE"), self.epoch]
+                       if u in core.users and core.owns(u) else None for u in dirty}
+        # Publicados com o lock para que os registros de um usuário saiam na ordem em que mudaram.
+        with self.lock:
+            for user_name, record in records.items():
+                previous = self.published.get(user_name)
+                if record == previous:
+                    continue
+                self.pending += (record[0] if record else 0) - (previous[0] if previous else 0)
+                if record is None:
+                    del self.published[user_name]
+                else:
+                    self.published[user_name] = record
+                core.mqtt_client.publish(f"{self.topic}/usuarios/{user_name}", json.dumps(record) if record else "",
+                                         qos=1, retain=True)
+            summary = {"shard": core.shard, "shards": core.shards, "epoch": self.epoch,
+                       "users": len(self.published), "pending": self.pending}
+            if summary != self.summary:
+                core.mqtt_client.publish(self.topic, json.dumps(summary), qos=1, retain=True)
+                self.summary = summary
+
+    def close(self):
+        self.throttle.close()
+
+
+class ShardAggregator:
+    # Junta os resumos e registros retidos dos shards para exibição; não participa do processamento das mensagens.
+    def __init__(self, broker_address=BROKER_ADDRESS, port=1883):
+        self.summaries = {}
+        self.records = {}
+        self.lock = threading.Lock()
+        self.listeners = []
+        self.mqtt_client = MQTTClient(broker_address=broker_address, port=port, on_message_callback=self.on_message)
+
+    def add_listener(self, listener):
+        self.listeners.append(listener)
+
+    def start(self):
+        if not self.mqtt_client.connect():
+            return False
+        self.mqtt_client.subscribe_many([(TOPIC_MANAGER_SHARDS_WILDCARD, 1), (TOPIC_MANAGER_SHARD_USERS_WILDCARD, 1)])
+        return True
+
+    def stop(self):
+        self.mqtt_client.disconnect()
+
+    def on_message(self, client, userdata, message):
+        # .../shards/<shard> (resumo) ou .../shards/<shard>/usuarios/<usuário> (registro).
+        parts = message.topic[len(TOPIC_MANAGER_SHARDS_BASE) + 1:].split("/")
+        shard = parts[0]
+        try:
+            document = json.loads(message.payload) if message.payload else None
+        except ValueError:
+            return
+        with self.lock:
+            if len(parts) == 1:
+                target, key = self.summaries, shard
+            else:
+                target, key = self.records.setdefault(shard, {}), parts[-1]
+            if document is None:
+                target.pop(key, None)
+            else:
+                target[key] = document
+        for listener in self.listeners:
+            listener(shard)
+
+    def totals(self):
+        counts, status = {}, {}
+        with self.lock:
+            summaries = list(self.summaries.values())
+            for shard, summary in self.summaries.items():
+                for user_name, (count, user_status, epoch) in self.records.get(shard, {}).items():
+                    if epoch == summary.get("epoch"):
+                        counts[user_name] = count
+                        status[user_name] = user_status
+        expected = max((summary["shards"] for summary in summaries), default=0)
+        return {"shards": len(summaries), "expected_shards": expected, "counts": counts, "status": status,
+                "pending": sum(summary["pending"] for summary in summaries)}
+
+
+def launch_workers(shards, broker_address, port=1883, extra_args=()):
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "manager_core.py")
+    return [subprocess.Popen([sys.executable, script, "--broker", broker_address, "--port", str(port), "--quiet",
+                              "--shard", str(shard), "--shards", str(shards), *extra_args])
+            for shard in range(shards)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sobe os shards do Gerenciador e exibe os totais agregados.")
+    parser.add_argument("--broker", default=BROKER_ADDRESS)
+    parser.add_argument("--port", type=int, default=1883)
+    parser.add_argument("--shards", type=int, default=4, help="Quantidade de processos do Gerenciador.")
+    parser.add_argument("--no-launch", action="store_true",
+                        help="Apenas agrega; os shards já estão rodando em outros processos/máquinas.")
+    parser.add_argument("--interval", type=float, default=2, help="Intervalo (s) entre as linhas de totais.")
+    args = parser.parse_args()
+
+    workers = [] if args.no_launch else launch_workers(args.shards, args.broker, args.port)
+    aggregator = ShardAggregator(args.broker, args.port)
+    if not aggregator.start():
+        for worker in workers:
+            worker.terminate()
+        return 1
+    try:
+        while True:
+            time.sleep(args.interval)
+            totals = aggregator.totals()
+            online = sum(1 for status in totals["status"].values() if status == "ONLINE")
+            print(f"[{time.strftime('%H:%M:%S')}] shards: {totals['shards']}/{totals['expected_shards'] or args.shards}"
+                  f" | usuários: {len(totals['counts'])} ({online} online)"
+                  f" | mensagens pendentes: {totals['pending']}", flush=True)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        aggregator.stop()
+        for worker in workers:
+            worker.terminate()
+        for worker in workers:
+            worker.wait()
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,91 @@
+import json
+import os
+import threading
+
+SNAPSHOT_FILE = "snapshot.json"
+WAL_FILE = "wal.log"
+
+
+class ManagerStore:
+    # Snapshot periódico + log de escrita antecipada (WAL). Cada registro guarda o valor absoluto,
+    # então reaplicar o WAL sobre um snapshot mais novo é inofensivo.
+    def __init__(self, directory, snapshot_every=50000):
+        self.directory = directory
+        self.snapshot_path = os.path.join(directory, SNAPSHOT_FILE)
+        self.wal_path = os.path.join(directory, WAL_FILE)
+        self.snapshot_every = snapshot_every
+        self.appended = 0
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self.wal = None
+
+    def load(self):
+        state = {"users": [], "topics": [], "counts": {}, "status": {}, "acks": {}, "epoch": None, "version": 0}
+        if os.path.exists(self.snapshot_path):
+            with open(self.snapshot_path, encoding="utf-8") as f:
+                state.update(json.load(f))
+        users = dict.fromkeys(state["users"])
+        topics = dict.fromkeys(state["topics"])
+        counts, status = state["counts"], state["status"]
+        acks = {user: tuple(position) for user, position in state["acks"].items()}
+        epoch, version = state["epoch"], state["version"]
+
+        if os.path.exists(self.wal_path):
+            valid_bytes = 0
+            with open(self.wal_path, "rb") as f:
+                for line in f:
+                    if not line.endswith(b"\n"):
+                        break
+                    valid_bytes += len(line)
+                    fields = line[:-1].decode("utf-8").split("\t")
+                    op = fields[0]
+                    if op == "u+":
+                        users[fields[1]] = None
+                    elif op == "u-":
+                        users.pop(fields[1], None)
+                        counts.pop(fields[1], None)
+                        status.pop(fields[1], None)
+                        acks.pop(fields[1], None)
+                    elif op == "t+":
+                        topics[fields[1]] = None
+                    elif op == "t-":
+                        topics.pop(fields[1], None)
+                    elif op == "c" and len(fields) == 3:
+                        counts[fields[1]] = int(fields[2])
+                    elif op == "s" and len(fields) == 3:
+                        status[fields[1]] = fields[2]
+                    elif op == "a" and len(fields) == 4:
+                        acks[fields[1]] = (int(fields[2]), int(fields[3]))
+                    elif op == "v" and len(fields) == 3:
+                        epoch, version = int(fields[1]), int(fields[2])
+            # Linha incompleta no fim do arquivo (queda durante a escrita) é descartada.
+            os.truncate(self.wal_path, valid_bytes)
+
+        self.wal = open(self.wal_path, "a", encoding="utf-8")
+        return {"users": list(users), "topics": list(topics), "counts": counts, "status": status, "acks": acks,
+                "epoch": epoch, "version": version}
+
+    def append(self, *fields):
+        with self.lock:
+            self.wal.write("\t".join(str(field) for field in fields) + "\n")
+            self.wal.flush()
+            self.appended += 1
+            return self.appended >= self.snapshot_every
+
+    def snapshot(self, state):
+        with self.lock:
+            tmp_path = self.snapshot_path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(state, f)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.snapshot_path)
+            self.wal.close()
+            self.wal = open(self.wal_path, "w", encoding="utf-8")
+            self.appended = 0
+
+    def close(self):
+        with self.lock:
+            if self.wal:
+                self.wal.close()
+                self.wal = None
@@ -0,0 +1,329 @@
+import bisect
+import collections
+import http.server
+import os
+import signal
+import sys
+import threading
+import time
+import urllib.parse
+
+# Limites (s) dos histogramas de latência: de 100 µs a 10 s.
+DEFAULT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+PROFILE_INTERVAL_MS = 5
+
+
+def _label_text(names, values):
+    if not names:
+        return ""
+    pairs = []
+    for name, value in zip(names, values):
+        value = str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+        pairs.append(f'{name}="{value}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+class Metric:
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self.lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(labels.get(name, "") for name in self.labels)
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, name, help_text, labels=()):
+        super().__init__(name, help_text, labels)
+        self.values = collections.Counter()
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] += amount
+
+    def samples(self):
+        with self.lock:
+            values = dict(self.values)
+        return [(self.name, _label_text(self.labels, key), value) for key, value in sorted(values.items())]
+
+
+class Gauge(Metric):
+    # Valor definido explicitamente ou lido na hora da coleta (function), como a profundidade de uma fila.
+    kind = "gauge"
+
+    def __init__(self, name, help_text, labels=(), function=None):
+        super().__init__(name, help_text, labels)
+        self.values = {}
+        self.function = function
+
+    def set(self, value, **labels):
+        with self.lock:
+            self.values[self._key(labels)] = value
+
+    def samples(self):
+        if self.function is not None:
+            return [(self.name, "", self.function())]
+        with self.lock:
+            values = dict(self.values)
+        return [(self.name, _label_text(self.labels, key), value) for key, value in sorted(values.items())]
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(buckets)
+        self.series = {}
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        position = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            series = self.series.get(key)
+            if series is None:
+                series = self.series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][position] += 1
+            series[1] += value
+            series[2] += 1
+
+    def time(self, **labels):
+        return _Timer(self, labels)
+
+    def samples(self):
+        with self.lock:
+            series = {key: (list(counts), total, count) for key, (counts, total, count) in self.series.items()}
+        lines = []
+        for key, (counts, total, count) in sorted(series.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += bucket_count
+                labels = _label_text(self.labels + ("le",), key + (bound,))
+                lines.append((f"{self.name}_bucket", labels, cumulative))
+            label_text = _label_text(self.labels, key)
+            lines.append((f"{self.name}_sum", label_text, total))
+            lines.append((f"{self.name}_count", label_text, count))
+        return lines
+
+
+class _Timer:
+    __slots__ = ("histogram", "labels", "started")
+
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.started, **self.labels)
+
+
+class MetricsRegistry:
+    # Métricas do processo no formato texto do Prometheus (versão 0.0.4).
+    def __init__(self):
+        self.metrics = {}
+        self.lock = threading.Lock()
+
+    def _get(self, cls, name, help_text, labels, **kwargs):
+        with self.lock:
+            metric = self.metrics.get(name)
+            if metric is None:
+                metric = self.metrics[name] = cls(name, help_text, labels, **kwargs)
+            return metric
+
+    def counter(self, name, help_text, labels=()):
+        return self._get(Counter, name, help_text, labels)
+
+    def gauge(self, name, help_text, labels=(), function=None):
+        return self._get(Gauge, name, help_text, labels, function=function)
+
+    def histogram(self, name, help_text, labels=(), buckets=DEFAULT_BUCKETS):
+        return self._get(Histogram, name, help_text, labels, buckets=buckets)
+
+    def render(self):
+        with self.lock:
+            metrics = list(self.metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{labels} {value}")
+        return "\n".join(lines) + "\n"
+
+    def write(self, path):
+        # Escrita atômica, para o coletor de arquivos do node_exporter nunca ler um arquivo pela metade.
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(self.render())
+        os.replace(tmp_path, path)
+
+
+METRICS = MetricsRegistry()
+
+
+class SamplingProfiler:
+    # Amostra periodicamente a pilha de todas as threads (sys._current_frames) e conta as pilhas vistas.
+    # Desligado não custa nada; ligado, a thread de amostragem acorda a cada interval_ms.
+    def __init__(self, interval_ms=PROFILE_INTERVAL_MS):
+        self.interval = interval_ms / 1000
+        self.stacks = collections.Counter()
+        self.samples = 0
+        self.thread = None
+        self.running = threading.Event()
+        self.lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self.running.is_set()
+
+    def start(self):
+        with self.lock:
+            if self.thread is not None:
+                return
+            self.stacks.clear()
+            self.samples = 0
+            self.running.set()
+            self.thread = threading.Thread(target=self._loop, daemon=True)
+            self.thread.start()
+
+    def stop(self):
+        with self.lock:
+            thread, self.thread = self.thread, None
+            self.running.clear()
+        if thread is not None and thread is not threading.current_thread():
+            thread.join()
+
+    def toggle(self):
+        if self.enabled:
+            self.stop()
+        else:
+            self.start()
+        return self.enabled
+
+    def _loop(self):
+        own = threading.get_ident()
+        while self.running.is_set():
+            frames = sys._current_frames()
+            with self.lock:
+                self.samples += 1
+                for thread_id, frame in frames.items():
+                    if thread_id == own:
+                        continue
+                    stack = []
+                    while frame is not None:
+                        code = frame.f_code
+                        stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}:{frame.f_lineno}")
+                        frame = frame.f_back
+                    self.stacks[";".join(reversed(stack))] += 1
+            time.sleep(self.interval)
+
+    def collapsed(self):
+        # Formato "pilha;colapsada contagem", aceito pelo flamegraph.pl e pelo speedscope.
+        with self.lock:
+            return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+    def report(self, top=25):
+        # Funções mais vistas no topo da pilha (tempo próprio) e em qualquer posição (tempo acumulado).
+        own, cumulative = collections.Counter(), collections.Counter()
+        with self.lock:
+            samples = self.samples
+            for stack, count in self.stacks.items():
+                frames = stack.split(";")
+                own[frames[-1]] += count
+                for frame in set(frames):
+                    cumulative[frame] += count
+        lines = [f"Amostras: {samples} ({'ligado' if self.enabled else 'desligado'})", "", "Próprio:"]
+        lines += [f"{count:>8}  {frame}" for frame, count in own.most_common(top)]
+        lines += ["", "Acumulado:"]
+        lines += [f"{count:>8}  {frame}" for frame, count in cumulative.most_common(top)]
+        return "\n".join(lines) + "\n"
+
+
+PROFILER = SamplingProfiler()
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    registry = METRICS
+    profiler = PROFILER
+
+    def do_GET(self):
+        url = urllib.parse.urlsplit(self.path)
+        query = urllib.parse.parse_qs(url.query)
+        if url.path == "/metrics":
+            self._reply(self.registry.render(), "text/plain; version=0.0.4; charset=utf-8")
+        elif url.path == "/profile":
+            # /profile?enable=1 liga, ?enable=0 desliga; &format=collapsed devolve as pilhas completas.
+            enable = query.get("enable", [None])[0]
+            if enable == "1":
+                self.profiler.start()
+            elif enable == "0":
+                self.profiler.stop()
+            collapsed = query.get("format", [""])[0] == "collapsed"
+            self._reply(self.profiler.collapsed() if collapsed else self.profiler.report(), "text/plain; charset=utf-8")
+        else:
+            self.send_error(404)
+
+    def _reply(self, text, content_type):
+        body = text.encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(port, host="127.0.0.1"):
+    # GET /metrics (Prometheus) e /profile (profiler por amostragem) numa thread de fundo.
+    server = http.server.ThreadingHTTPServer((host, port), _Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def write_periodically(path, interval=5.0):
+    def loop():
+        while True:
+            try:
+                METRICS.write(path)
+            except OSError as e:
+                print(f"Erro ao gravar as métricas em '{path}': {e}")
+            time.sleep(interval)
+    threading.Thread(target=loop, daemon=True).start()
+
+
+def install_profiler_signal():
+    # SIGUSR2 liga/desliga o profiler; ao desligar, o relatório vai para a saída padrão.
+    if not hasattr(signal, "SIGUSR2"):
+        return
+
+    def toggle(signum, frame):
+        if not PROFILER.toggle():
+            print(PROFILER.report(), flush=True)
+    signal.signal(signal.SIGUSR2, toggle)
+
+
+def add_arguments(parser):
+    parser.add_argument("--metrics-port", type=int, default=0,
+                        help="Porta local do endpoint Prometheus (/metrics) e do profiler (/profile); 0 = desligado.")
+    parser.add_argument("--metrics-file", help="Grava as métricas neste arquivo a cada 5 s (formato Prometheus).")
+
+
+def start_from_args(args):
+    if args.metrics_port:
+        serve(args.metrics_port)
+        print(f"Métricas em http://127.0.0.1:{args.metrics_port}/metrics")
+    if args.metrics_file:
+        write_periodically(args.metrics_file)
+    install_profiler_signal()
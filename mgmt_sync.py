@@ -0,0 +1,115 @@
+from topics import TOPIC_MGMT_SNAPSHOT
+from throttle import Throttle
+import envelope
+import json
+import zlib
+
+# Tempo (ms) que o cliente espera pelo snapshot retido antes de voltar aos registros por item.
+SNAPSHOT_WAIT_MS = 1500
+# Intervalo mínimo (ms) entre duas republicações do snapshot pelo gerenciador.
+SNAPSHOT_INTERVAL_MS = 1000
+
+
+def encode_snapshot(epoch, version, users, topics):
+    document = json.dumps({"epoch": epoch, "version": version, "users": list(users), "topics": list(topics)})
+    return envelope.encode(envelope.KIND_MGMT_SNAPSHOT, body=zlib.compress(document.encode()), legacy=False)
+
+
+def decode_snapshot(payload):
+    message = envelope.Envelope.parse(payload)
+    if message is None or message.kind != envelope.KIND_MGMT_SNAPSHOT:
+        raise ValueError("Snapshot de cadastro inválido.")
+    return json.loads(zlib.decompress(message.body))
+
+
+def encode_delta(epoch, version, op, name):
+    document = json.dumps({"epoch": epoch, "version": version, "op": op, "name": name})
+    return envelope.encode(envelope.KIND_MGMT_DELTA, body=document, legacy=False)
+
+
+def decode_delta(payload):
+    message = envelope.Envelope.parse(payload)
+    if message is None or message.kind != envelope.KIND_MGMT_DELTA:
+        raise ValueError("Delta de cadastro inválido.")
+    return json.loads(message.text)
+
+
+class MgmtSync:
+    # Lado do cliente: carrega o snapshot e aplica, em ordem, só os deltas posteriores à sua versão.
+    # Deltas que chegam antes do snapshot (ou depois de uma lacuna) ficam guardados até o próximo snapshot.
+    # O cliente só precisa ficar inscrito no snapshot até carregá-lo; request_snapshot o pede de novo.
+    def __init__(self, apply_snapshot, apply_change, request_snapshot):
+        self.apply_snapshot = apply_snapshot
+        self.apply_change = apply_change
+        self.request_snapshot = request_snapshot
+        self.epoch = None
+        self.version = None
+        self.pending = {}
+        self.requested = True
+
+    @property
+    def loaded(self):
+        return self.version is not None
+
+    def on_snapshot(self, payload):
+        if not payload:
+            return
+        snapshot = decode_snapshot(payload)
+        if snapshot["epoch"] == self.epoch and snapshot["version"] <= self.version:
+            return
+        self.epoch, self.version = snapshot["epoch"], snapshot["version"]
+        self.requested = False
+        self.apply_snapshot(snapshot["users"], snapshot["topics"])
+        self.pending = {v: d for v, d in self.pending.items() if d["epoch"] == self.epoch and v > self.version}
+        return self._drain()
+
+    def on_delta(self, payload):
+        delta = decode_delta(payload)
+        if not self.loaded or delta["epoch"] != self.epoch:
+            self.pending[delta["version"]] = delta
+            self._request()
+            return
+        if delta["version"] <= self.version:
+            return
+        self.pending[delta["version"]] = delta
+        if not self._drain():
+            # Lacuna na sequência: um delta se perdeu, então o estado completo é pedido de novo.
+            self._request()
+
+    def _request(self):
+        if not self.requested:
+            self.requested = True
+            self.request_snapshot()
+
+    def _drain(self):
+        while self.version + 1 in self.pending:
+            self.version += 1
+            delta = self.pending.pop(self.version)
+            self.apply_change(delta["op"], delta["name"])
+        return not self.pending
+
+
+class SnapshotPublisher:
+    # Lado do gerenciador: republica o snapshot retido no máximo uma vez a cada interval_ms,
+    # e só quando a versão do cadastro mudou desde o último publicado.
+    def __init__(self, core, interval_ms=SNAPSHOT_INTERVAL_MS):
+        self.core = core
+        self.published = None
+        self.throttle = Throttle(self.publish, interval_ms)
+
+    def on_core_event(self, event, *args):
+        if event in ("user", "topic"):
+            self.throttle.request()
+
+    def publish(self):
+        core = self.core
+        with core.lock:
+            version = (core.mgmt_epoch, core.mgmt_version)
+            if version == self.published:
+                return
+            payload = encode_snapshot(core.mgmt_epoch, core.mgmt_version, core.users, core.topics)
+        core.mqtt_client.publish(TOPIC_MGMT_SNAPSHOT, payload, qos=1, retain=True)
+        self.published = version
+
+    def close(self):
+        self.throttle.close()
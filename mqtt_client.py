@@ -1,10 +1,35 @@
 import paho.mqtt.client as mqtt
+from dedup import DedupCache, message_key, DEFAULT_MAX_ENTRIES, DEFAULT_TTL_SECONDS
+from metrics import METRICS
+import compression
+import envelope
+import loopback
+import threading
+import time
 import uuid
 
+PUBLISHED = METRICS.counter("mom_mqtt_published_total", "Mensagens publicadas (um lote conta uma vez).", ("qos",))
+RECEIVED = METRICS.counter("mom_mqtt_received_total", "Mensagens recebidas do broker.")
+PUBACK_SECONDS = METRICS.histogram("mom_mqtt_puback_seconds", "Tempo entre publicar com QoS 1/2 e a confirmação do broker.")
+CONNECTS = METRICS.counter("mom_mqtt_connects_total", "Conexões aceitas pelo broker (CONNACK com sucesso).")
+RECONNECTS = METRICS.counter("mom_mqtt_reconnects_total", "Reconexões após a primeira conexão de cada cliente.")
+DISCONNECTS = METRICS.counter("mom_mqtt_disconnects_total", "Desconexões, separando as inesperadas.", ("unexpected",))
+# Só o tráfego de conversa entra em lotes; ACKs, autenticação e cadastro são lidos um a um pelo destino.
+BATCHED_KINDS = (envelope.KIND_CHAT, envelope.KIND_PRIVATE)
+
+
+def paho_transport(client_id, clean_session):
+    return mqtt.Client(client_id=client_id, clean_session=clean_session,
+                       callback_api_version=mqtt.CallbackAPIVersion.VERSION1)
+
+
 class MQTTClient:
     def __init__(self, broker_address="mqtt.eclipseprojects.io", port=1883, on_message_callback=None, 
                  will_topic=None, will_payload=None, will_retain=True, 
-                 client_id=None, clean_session=True):
+                 client_id=None, clean_session=True,
+                 batch_window_ms=0, batch_max_messages=100, batch_max_bytes=256 * 1024, transport=None,
+                 compress_min_bytes=None, compress_codec=None,
+                 dedup_entries=DEFAULT_MAX_ENTRIES, dedup_ttl=DEFAULT_TTL_SECONDS):
 
         self.broker_address = broker_address
         self.port = port
@@ -12,29 +37,170 @@ class MQTTClient:
         
         if client_id is None:
             client_id = f"python-mqtt-{uuid.uuid4()}"
+        self.client_id = client_id
 
-        self.client = mqtt.Client(client_id=client_id, clean_session=clean_session, 
-                                  callback_api_version=mqtt.CallbackAPIVersion.VERSION1)
+        # transport(client_id, clean_session) cria o cliente de protocolo; o padrão é o paho via TCP.
+        if transport is None:
+            transport = loopback.DEFAULT_BROKER.client if broker_address == loopback.LOOPBACK_ADDRESS else paho_transport
+        self.client = transport(client_id, clean_session)
         
         if self.on_message_callback:
-            self.client.on_message = self.on_message_callback
+            self.client.on_message = self._on_message
+        # on_connect_callback(client, userdata, flags, rc) recebe o CONNACK depois das métricas.
+        self.on_connect_callback = None
+        self.connections = 0
+        self.inflight = {}
+        self.acked_early = set()
+        self.inflight_lock = threading.Lock()
+        self.client.on_connect = self._on_connect
+        self.client.on_disconnect = self._on_disconnect
+        self.client.on_publish = self._on_publish
 
         if will_topic and will_payload:
             self.client.will_set(will_topic, payload=will_payload, retain=will_retain, qos=1)
             print(f"Last Will configurado para o tópico '{will_topic}'")
 
+        # None usa a configuração do processo (compression.configure_from_args); 0 desliga a compressão.
+        self.compress_min_bytes = compress_min_bytes
+        self.compress_codec = compress_codec
+        # QoS 1 e sessões persistentes reenviam mensagens na reconexão; dedup_entries=0 desliga o descarte.
+        self.dedup = DedupCache(dedup_entries, dedup_ttl) if dedup_entries else None
+
+        self.batch_lock = threading.Condition()
+        self.batches = {}
+        self.batch_thread = None
+        self.batch_window = 0
+        self.set_batching(batch_window_ms, batch_max_messages, batch_max_bytes)
+
+    def set_batching(self, window_ms, max_messages=None, max_bytes=None):
+        # window_ms=0 desliga o agrupamento (chat sensível à latência); feeds em massa usam alguns ms.
+        with self.batch_lock:
+            self.batch_window = window_ms / 1000 if not envelope.WRITE_LEGACY else 0
+            if max_messages is not None: self.batch_max_messages = max_messages
+            if max_bytes is not None: self.batch_max_bytes = max_bytes
+            if self.batch_window and self.batch_thread is None:
+                self.batch_thread = threading.Thread(target=self._batch_loop, daemon=True)
+                self.batch_thread.start()
+            self.batch_lock.notify()
+        if not self.batch_window:
+            self.flush()
+
     def connect(self):
         try:
             self.client.connect(self.broker_address, self.port, 60)
             self.client.loop_start()
-            print(f"Conectado ao Broker MQTT como '{self.client._client_id.decode()}'!")
+            print(f"Conectado ao Broker MQTT como '{self.client_id}'!")
             return True
         except Exception as e:
             print(f"Erro ao conectar ao Broker MQTT: {e}")
             return False
 
+    def _on_message(self, client, userdata, message):
+        RECEIVED.inc()
+        try:
+            message.payload = compression.decompress(message.payload)
+        except ValueError as e:
+            print(f"Mensagem descartada em '{message.topic}': {e}")
+            return
+        # Reentregas de retidas (ao assinar de novo) são intencionais e não passam pelo cache.
+        if self.dedup is not None and not message.retain:
+            key = message_key(message.payload)
+            if key is not None and self.dedup.seen(key):
+                return
+        self.on_message_callback(client, userdata, message)
+
+    def _on_connect(self, client, userdata, flags, rc):
+        if rc == 0:
+            CONNECTS.inc()
+            if self.connections:
+                RECONNECTS.inc()
+            self.connections += 1
+        if self.on_connect_callback:
+            self.on_connect_callback(client, userdata, flags, rc)
+
+    def _on_disconnect(self, client, userdata, rc):
+        DISCONNECTS.inc(unexpected=str(rc != 0).lower())
+        with self.inflight_lock:
+            # Confirmações que não virão mais: a sessão reenviará as mensagens com outro ciclo.
+            self.inflight.clear()
+
+    def _on_publish(self, client, userdata, mid):
+        now = time.perf_counter()
+        with self.inflight_lock:
+            sent = self.inflight.pop(mid, None)
+            if sent is None:
+                # Confirmação antes de o envio ser registrado (ou envio QoS 0, que não é registrado).
+                if len(self.acked_early) > 1024:
+                    self.acked_early.clear()
+                self.acked_early.add(mid)
+                return
+        PUBACK_SECONDS.observe(now - sent)
+
+    def _publish(self, topic, payload, qos, retain=False):
+        PUBLISHED.inc(qos=str(qos))
+        # Depois do agrupamento: um lote de mensagens parecidas comprime melhor que cada uma.
+        payload = compression.compress(payload, self.compress_min_bytes, self.compress_codec)
+        sent = time.perf_counter()
+        # Sem segurar o lock durante o publish: o paho chama on_publish com os próprios locks adquiridos.
+        result = self.client.publish(topic, payload, qos=qos, retain=retain)
+        if qos > 0:
+            with self.inflight_lock:
+                if result[1] in self.acked_early:
+                    self.acked_early.discard(result[1])
+                    acked = True
+                else:
+                    self.inflight[result[1]] = sent
+                    acked = False
+            if acked:
+                PUBACK_SECONDS.observe(time.perf_counter() - sent)
+        return result
+
     def publish(self, topic, payload, qos=1, retain=False):
-        self.client.publish(topic, payload, qos=qos, retain=retain)
+        if self.batch_window and not retain and envelope.kind_of(payload) in BATCHED_KINDS:
+            self._add_to_batch(topic, payload, qos)
+            return
+        self._publish(topic, payload, qos, retain)
+
+    def _add_to_batch(self, topic, payload, qos):
+        if isinstance(payload, str):
+            payload = payload.encode()
+        full = None
+        with self.batch_lock:
+            key = (topic, qos)
+            batch = self.batches.get(key)
+            if batch is None:
+                batch = self.batches[key] = [[], 0, time.monotonic() + self.batch_window]
+                self.batch_lock.notify()
+            batch[0].append(payload)
+            batch[1] += len(payload)
+            if len(batch[0]) >= self.batch_max_messages or batch[1] >= self.batch_max_bytes:
+                full = self.batches.pop(key)[0]
+        if full:
+            self._send_batch(key, full)
+
+    def _batch_loop(self):
+        while True:
+            with self.batch_lock:
+                now = time.monotonic()
+                due = [key for key, batch in self.batches.items() if batch[2] <= now]
+                if not due:
+                    deadlines = [batch[2] for batch in self.batches.values()]
+                    self.batch_lock.wait(min(deadlines) - now if deadlines else None)
+                    continue
+                ready = [(key, self.batches.pop(key)[0]) for key in due]
+            for key, payloads in ready:
+                self._send_batch(key, payloads)
+
+    def _send_batch(self, key, payloads):
+        topic, qos = key
+        payload = payloads[0] if len(payloads) == 1 else envelope.encode_batch(payloads)
+        self._publish(topic, payload, qos)
+
+    def flush(self):
+        with self.batch_lock:
+            ready, self.batches = self.batches, {}
+        for key, batch in ready.items():
+            self._send_batch(key, batch[0])
 
     def subscribe(self, topic, qos=1):
         self.client.subscribe(topic, qos=qos)
@@ -44,7 +210,19 @@ class MQTTClient:
         self.client.unsubscribe(topic)
         print(f"Inscrição cancelada para o tópico: {topic}")
 
+    def subscribe_many(self, subscriptions):
+        # [(tópico, qos), ...] num único SUBSCRIBE: uma ida e volta em vez de uma por tópico.
+        if subscriptions:
+            self.client.subscribe(list(subscriptions))
+            print(f"Inscrito em {len(subscriptions)} tópico(s) num único pacote.")
+
+    def unsubscribe_many(self, topics):
+        if topics:
+            self.client.unsubscribe(list(topics))
+            print(f"Inscrição cancelada para {len(topics)} tópico(s) num único pacote.")
+
     def disconnect(self):
+        self.flush()
         self.client.loop_stop()
         self.client.disconnect()
         print("Desconectado do Broker MQTT.")
\ No newline at end of file
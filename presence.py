@@ -0,0 +1,144 @@
+from topics import TOPIC_PRESENCE_SNAPSHOT, TOPIC_PRESENCE_DELTA
+from throttle import Throttle
+import envelope
+import json
+import random
+import threading
+import zlib
+
+# Intervalo mínimo (ms) entre dois lotes de presença publicados pelo gerenciador.
+ROSTER_INTERVAL_MS = 500
+
+
+def encode_roster_snapshot(epoch, seq, online):
+    document = json.dumps({"epoch": epoch, "seq": seq, "online": sorted(online)})
+    return envelope.encode(envelope.KIND_ROSTER_SNAPSHOT, body=zlib.compress(document.encode()), legacy=False)
+
+
+def decode_roster_snapshot(payload):
+    message = envelope.Envelope.parse(payload)
+    if message is None or message.kind != envelope.KIND_ROSTER_SNAPSHOT:
+        raise ValueError("Snapshot de presença inválido.")
+    return json.loads(zlib.decompress(message.body))
+
+
+def encode_roster_delta(epoch, seq, changes):
+    document = json.dumps({"epoch": epoch, "seq": seq, "changes": changes})
+    return envelope.encode(envelope.KIND_ROSTER_DELTA, body=document, legacy=False)
+
+
+def decode_roster_delta(payload):
+    message = envelope.Envelope.parse(payload)
+    if message is None or message.kind != envelope.KIND_ROSTER_DELTA:
+        raise ValueError("Delta de presença inválido.")
+    return json.loads(message.text)
+
+
+class RosterPublisher:
+    # Lado do gerenciador: junta as mudanças de presença (a última de cada usuário vence) e publica
+    # no máximo um lote a cada interval_ms, junto com o snapshot retido de quem está online.
+    # Uma rajada de logins vira poucos lotes, não uma mensagem por login para cada cliente.
+    def __init__(self, mqtt_client, interval_ms=ROSTER_INTERVAL_MS):
+        self.mqtt_client = mqtt_client
+        self.epoch = random.getrandbits(31)
+        self.seq = 0
+        self.online = set()
+        self.changes = {}
+        self.lock = threading.Lock()
+        self.throttle = Throttle(self.publish, interval_ms)
+
+    def on_core_event(self, event, *args):
+        if event == "presence":
+            self.update(*args)
+
+    def update(self, user_name, status):
+        online = status == "ONLINE"
+        with self.lock:
+            if online == (user_name in self.online):
+                return
+            if online:
+                self.online.add(user_name)
+            else:
+                self.online.discard(user_name)
+            self.changes[user_name] = "ONLINE" if online else "OFFLINE"
+        self.throttle.request()
+
+    def start(self):
+        # Primeiro snapshot depois que as presenças retidas chegarem, mesmo sem nenhuma mudança.
+        self.throttle.request()
+
+    def publish(self):
+        with self.lock:
+            changes, self.changes = self.changes, {}
+            if not changes and self.seq:
+                return
+            self.seq += 1
+            delta = encode_roster_delta(self.epoch, self.seq, changes)
+            snapshot = encode_roster_snapshot(self.epoch, self.seq, self.online)
+            # Publicados com o lock para que lotes e snapshots saiam na ordem da numeração.
+            self.mqtt_client.publish(TOPIC_PRESENCE_DELTA, delta, qos=1)
+            self.mqtt_client.publish(TOPIC_PRESENCE_SNAPSHOT, snapshot, qos=1, retain=True)
+
+    def close(self):
+        self.throttle.close()
+
+
+class RosterSync:
+    # Lado do cliente: carrega o snapshot e aplica, em ordem, os lotes posteriores a ele. Depois de uma
+    # lacuna a numeração não avança: os lotes seguintes esperam guardados e o snapshot é pedido de novo,
+    # aceito mesmo com a numeração atual, já que o lote perdido pode ter sido o último publicado.
+    # apply(statuses, full): full=True indica que quem não está em statuses está offline.
+    def __init__(self, apply, request_snapshot):
+        self.apply = apply
+        self.request_snapshot = request_snapshot
+        self.epoch = None
+        self.seq = None
+        self.pending = {}
+        self.gap = None
+
+    @property
+    def loaded(self):
+        return self.seq is not None
+
+    def on_snapshot(self, payload):
+        # Devolve True quando o cliente está em dia e o snapshot pode deixar de ser assinado.
+        if not payload:
+            return False
+        snapshot = decode_roster_snapshot(payload)
+        if snapshot["epoch"] == self.epoch and (snapshot["seq"] < self.seq or
+                                                (snapshot["seq"] == self.seq and self.gap is None)):
+            return self.gap is None
+        self.epoch, self.seq = snapshot["epoch"], snapshot["seq"]
+        self.apply(dict.fromkeys(snapshot["online"], "ONLINE"), True)
+        self.pending = {seq: d for seq, d in self.pending.items() if d["epoch"] == self.epoch and seq > self.seq}
+        if self._drain():
+            return True
+        self._request()
+        return False
+
+    def on_delta(self, payload):
+        delta = decode_roster_delta(payload)
+        if not self.loaded or delta["epoch"] != self.epoch:
+            # Antes do snapshot (ou com o gerenciador reiniciado) os lotes esperam o estado completo.
+            self.pending[delta["seq"]] = delta
+            if self.loaded:
+                self._request()
+            return
+        if delta["seq"] <= self.seq:
+            return
+        self.pending[delta["seq"]] = delta
+        if not self._drain():
+            self._request()
+
+    def _request(self):
+        if self.gap is None:
+            self.gap = self.seq + 1
+            self.request_snapshot()
+
+    def _drain(self):
+        while self.seq + 1 in self.pending:
+            self.seq += 1
+            self.apply(self.pending.pop(self.seq)["changes"], False)
+        if not self.pending:
+            self.gap = None
+        return not self.pending
@@ -0,0 +1,135 @@
+from async_mqtt_client import AsyncMQTTClient
+import loopback
+from topics import BROKER_ADDRESS, TOPIC_MGMT_USERS, TOPIC_USER_MSG_BASE
+import argparse
+import asyncio
+import time
+import uuid
+
+
+class ProvisionReport:
+    def __init__(self, total):
+        self.total = total
+        self.failures = {}
+        self.publish_seconds = 0.0
+        self.prime_seconds = 0.0
+
+    @property
+    def succeeded(self):
+        return self.total - len(self.failures)
+
+    def summary(self):
+        elapsed = self.publish_seconds + self.prime_seconds
+        rate = self.succeeded / elapsed if elapsed else 0.0
+        lines = [
+            f"Usuários processados: {self.total} ({self.succeeded} ok, {len(self.failures)} falha(s))",
+            f"Registros publicados em {self.publish_seconds:.2f}s; sessões preparadas em {self.prime_seconds:.2f}s",
+            f"Vazão: {rate:.1f} usuários/s",
+        ]
+        for user_name, error in sorted(self.failures.items()):
+            lines.append(f"FALHA: {user_name}: {error}")
+        return "\n".join(lines)
+
+
+def read_user_file(path):
+    users = []
+    seen = set()
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            user_name = line.strip()
+            if not user_name or user_name.startswith("#") or user_name in seen:
+                continue
+            seen.add(user_name)
+            users.append(user_name)
+    return users
+
+
+async def publish_user_records(usernames, broker_address=BROKER_ADDRESS, port=1883, window=500):
+    if broker_address == loopback.LOOPBACK_ADDRESS:
+        client = loopback.DEFAULT_BROKER.client(f"provision-{uuid.uuid4()}")
+        client.connect()
+        for user_name in usernames:
+            client.publish(f"{TOPIC_MGMT_USERS}/{user_name}", "ADD", qos=1, retain=True)
+        client.disconnect()
+        return {}
+
+    client = AsyncMQTTClient(broker_address=broker_address, port=port, max_inflight=window)
+    if not await client.connect():
+        return {user_name: "falha ao conectar ao broker" for user_name in usernames}
+    try:
+        futures = []
+        for user_name in usernames:
+            futures.append(await client.start_publish(f"{TOPIC_MGMT_USERS}/{user_name}", "ADD", qos=1, retain=True))
+        results = await asyncio.gather(*futures, return_exceptions=True)
+    finally:
+        await client.disconnect()
+    return {user_name: str(result) for user_name, result in zip(usernames, results) if isinstance(result, Exception)}
+
+
+async def prime_session(user_name, broker_address=BROKER_ADDRESS, port=1883, timeout=10):
+    # Cria a sessão persistente (clean_session=False) com a fila privada; o SUBACK confirma que o broker a registrou.
+    if broker_address == loopback.LOOPBACK_ADDRESS:
+        client = loopback.DEFAULT_BROKER.client(user_name, clean_session=False)
+        client.connect()
+        client.subscribe(f"{TOPIC_USER_MSG_BASE}/{user_name}", qos=1)
+        client.disconnect()
+        return
+
+    client = AsyncMQTTClient(broker_address=broker_address, port=port, client_id=user_name, clean_session=False)
+    if not await client.connect(timeout=timeout):
+        raise ConnectionError("falha ao conectar ao broker")
+    try:
+        granted = await asyncio.wait_for(client.subscribe(f"{TOPIC_USER_MSG_BASE}/{user_name}", qos=1), timeout)
+        if any(qos >= 0x80 for qos in granted):
+            raise ConnectionError("inscrição recusada pelo broker")
+    finally:
+        await client.disconnect()
+
+
+async def prime_sessions(usernames, broker_address=BROKER_ADDRESS, port=1883, concurrency=50, timeout=10):
+    limit = asyncio.Semaphore(concurrency)
+    failures = {}
+
+    async def prime(user_name):
+        async with limit:
+            try:
+                await prime_session(user_name, broker_address, port, timeout)
+            except Exception as e:
+                failures[user_name] = str(e) or type(e).__name__
+
+    await asyncio.gather(*(prime(user_name) for user_name in usernames))
+    return failures
+
+
+async def provision_users(usernames, broker_address=BROKER_ADDRESS, port=1883, window=500, concurrency=50, timeout=10):
+    report = ProvisionReport(len(usernames))
+
+    started = time.perf_counter()
+    report.failures.update(await publish_user_records(usernames, broker_address, port, window))
+    report.publish_seconds = time.perf_counter() - started
+
+    started = time.perf_counter()
+    pending = [user_name for user_name in usernames if user_name not in report.failures]
+    report.failures.update(await prime_sessions(pending, broker_address, port, concurrency, timeout))
+    report.prime_seconds = time.perf_counter() - started
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cadastro em lote de usuários no sistema MOM.")
+    parser.add_argument("arquivo", help="Arquivo com um nome de usuário por linha.")
+    parser.add_argument("--broker", default=BROKER_ADDRESS)
+    parser.add_argument("--port", type=int, default=1883)
+    parser.add_argument("--window", type=int, default=500, help="Publicações QoS 1 simultâneas em voo.")
+    parser.add_argument("--concurrency", type=int, default=50, help="Conexões simultâneas para preparar sessões.")
+    parser.add_argument("--timeout", type=float, default=10, help="Tempo máximo (s) por conexão/SUBACK.")
+    args = parser.parse_args()
+
+    usernames = read_user_file(args.arquivo)
+    report = asyncio.run(provision_users(usernames, args.broker, args.port, args.window, args.concurrency, args.timeout))
+    print(report.summary())
+    return 1 if report.failures else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
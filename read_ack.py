@@ -0,0 +1,62 @@
+from topics import TOPIC_ACK_BASE
+from throttle import start_timer
+import envelope
+import random
+import threading
+import time
+
+DEFAULT_INTERVAL_MS = 5
+
+
+class CumulativeAck:
+    # Agrupa as confirmações de leitura: no máximo um ACK a cada interval_ms, levando o total consumido
+    # na sessão. Um ACK perdido é compensado pelo seguinte, e o gerenciador aplica tudo de uma vez.
+    # Com o usuário ocioso o ACK sai na hora; só as rajadas esperam o fim do intervalo.
+    # call_later(atraso, função) agenda o envio adiado; num loop asyncio basta passar loop.call_later.
+    def __init__(self, mqtt_client, user_name, interval_ms=DEFAULT_INTERVAL_MS, call_later=start_timer):
+        self.mqtt_client = mqtt_client
+        self.user_name = user_name
+        self.topic = f"{TOPIC_ACK_BASE}/{user_name}"
+        self.interval = interval_ms / 1000
+        self.session = random.getrandbits(63)
+        self.acked = 0
+        self.sent = 0
+        self.last_sent = 0.0
+        self.timer = None
+        self.call_later = call_later
+        self.lock = threading.Lock()
+
+    def ack(self, count=1):
+        if envelope.WRITE_LEGACY:
+            # Gerenciadores antigos só entendem um ACK por mensagem.
+            for _ in range(count):
+                self.mqtt_client.publish(self.topic, envelope.encode(envelope.KIND_ACK, self.user_name), qos=0)
+            return
+        with self.lock:
+            self.acked += count
+            if self.timer is not None:
+                return
+            wait = self.last_sent + self.interval - time.monotonic()
+            if wait <= 0:
+                self._send()
+                return
+            self.timer = self.call_later(wait, self.flush)
+
+    def flush(self):
+        with self.lock:
+            self.timer = None
+            if self.acked != self.sent:
+                self._send()
+
+    def _send(self):
+        # Chamado com self.lock adquirido, para que os totais saiam em ordem crescente.
+        self.sent = self.acked
+        self.last_sent = time.monotonic()
+        self.mqtt_client.publish(self.topic, envelope.encode_ack(self.user_name, self.session, self.sent), qos=1)
+
+    def close(self):
+        with self.lock:
+            timer = self.timer
+        if timer is not None:
+            timer.cancel()
+        self.flush()
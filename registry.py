@@ -0,0 +1,112 @@
+import bisect
+import collections
+import threading
+
+
+class Registry:
+    # Cadastro de nomes (usuários ou tópicos): pertinência O(1) pelo dicionário, índice ordenado
+    # mantido incrementalmente e baldes por status com contagem O(1). Nomes novos entram numa
+    # lista de espera que é intercalada ao índice na próxima leitura ordenada, então uma rajada
+    # de sincronizações não paga uma inserção ordenada por nome.
+    def __init__(self, names=(), default_status="OFFLINE", statuses=None):
+        self.default_status = default_status
+        statuses = statuses or {}
+        # Carga inicial em bloco: uma única ordenação em vez de uma inserção binária por nome.
+        self.entries = {name: statuses.get(name, default_status) for name in names}
+        self.index = sorted(self.entries)
+        self.added = []
+        self.lock = threading.Lock()
+        self.buckets = collections.defaultdict(set)
+        for name, status in self.entries.items():
+            self.buckets[status].add(name)
+        # Presença que chegou antes do cadastro (ordem entre tópicos retidos não é garantida).
+        self.early_status = {}
+
+    def __contains__(self, name):
+        return name in self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __iter__(self):
+        return iter(self._sorted())
+
+    def _sorted(self):
+        with self.lock:
+            if self.added:
+                # Duas sequências ordenadas: o timsort as intercala em tempo linear.
+                self.added.sort()
+                self.index = self.index + self.added
+                self.index.sort()
+                self.added = []
+            return self.index
+
+    def add(self, name, status=None):
+        if name in self.entries:
+            return False
+        if status is None:
+            status = self.early_status.pop(name, self.default_status)
+        self.entries[name] = status
+        self.buckets[status].add(name)
+        with self.lock:
+            self.added.append(name)
+        return True
+
+    def remove(self, name):
+        if name not in self.entries:
+            return False
+        status = self.entries.pop(name)
+        self.buckets[status].discard(name)
+        index = self._sorted()
+        with self.lock:
+            del index[bisect.bisect_left(index, name)]
+        return True
+
+    def reset(self, names):
+        # Troca o cadastro inteiro (ex.: snapshot carregado), mantendo o status já conhecido de cada nome.
+        with self.lock:
+            statuses = {**self.early_status, **self.entries}
+            self.entries = {name: statuses.get(name, self.default_status) for name in names}
+            self.early_status = {name: status for name, status in statuses.items() if name not in self.entries}
+            self.index = sorted(self.entries)
+            self.added = []
+            self.buckets = collections.defaultdict(set)
+            for name, status in self.entries.items():
+                self.buckets[status].add(name)
+
+    def replace_statuses(self, statuses):
+        # Status completo (ex.: snapshot de presença): quem não aparece volta ao status padrão.
+        self.early_status = {name: status for name, status in statuses.items() if name not in self.entries}
+        self.buckets = collections.defaultdict(set)
+        for name in self.entries:
+            status = self.entries[name] = statuses.get(name, self.default_status)
+            self.buckets[status].add(name)
+
+    def status(self, name, default=None):
+        return self.entries.get(name, default)
+
+    def set_status(self, name, status):
+        if name not in self.entries:
+            self.early_status[name] = status
+            return False
+        current = self.entries[name]
+        if current == status:
+            return False
+        self.buckets[current].discard(name)
+        self.buckets[status].add(name)
+        self.entries[name] = status
+        return True
+
+    def count(self, status):
+        return len(self.buckets.get(status, ()))
+
+    def names(self, status=None):
+        if status is None:
+            return list(self._sorted())
+        return sorted(self.buckets.get(status, ()))
+
+    def page(self, start, stop):
+        return self._sorted()[start:stop]
+
+    def statuses(self):
+        return dict(self.entries)
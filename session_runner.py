@@ -0,0 +1,359 @@
+from login import SessionLogin, AUTH_TIMEOUT_MS, NO_CONNECTION
+from subscription_state import SubscriptionState
+from read_ack import CumulativeAck
+from dedup import DedupCache, message_key
+from provision import provision_users
+from topics import BROKER_ADDRESS, UNIQUE_PREFIX, TOPIC_PRESENCE_USERS, TOPIC_USER_MSG_BASE
+import paho.mqtt.client as mqtt
+import argparse
+import asyncio
+import collections
+import compression
+import envelope
+import json
+import metrics
+import random
+import resource
+import sys
+import time
+
+# Sessões iniciadas por segundo, para não derrubar o broker (e o Gerenciador) com uma rajada de logins.
+DEFAULT_RATE = 200
+STATS_INTERVAL = 5
+# Intervalo (s) do loop_misc do paho (keepalive, retransmissões) e do envio de mensagens dos bots.
+TICK_SECONDS = 1
+
+
+class LoopMQTTClient:
+    # Subconjunto síncrono do MQTTClient (o que SessionLogin e CumulativeAck usam) com o paho movido pelo
+    # selector do loop asyncio, como no AsyncMQTTClient: nenhuma thread de rede por sessão.
+    __slots__ = ("loop", "broker_address", "port", "client", "on_message_callback", "on_connect_callback",
+                 "dedup")
+
+    def __init__(self, loop, broker_address, port, client_id, on_message_callback, clean_session=False,
+                 will_topic=None, will_payload=None):
+        self.loop = loop
+        self.broker_address = broker_address
+        self.port = port
+        self.on_message_callback = on_message_callback
+        self.on_connect_callback = None
+        # Mesmo descarte de reentregas do MQTTClient: a sessão persistente também recebe duplicatas do QoS 1.
+        self.dedup = DedupCache()
+        self.client = mqtt.Client(client_id=client_id, clean_session=clean_session,
+                                  callback_api_version=mqtt.CallbackAPIVersion.VERSION1)
+        if will_topic and will_payload:
+            self.client.will_set(will_topic, payload=will_payload, retain=True, qos=1)
+        self.client.on_connect = self._on_connect
+        self.client.on_message = self._on_message
+        self.client.on_socket_open = self._on_socket_open
+        self.client.on_socket_close = self._on_socket_close
+        self.client.on_socket_register_write = self._on_socket_register_write
+        self.client.on_socket_unregister_write = self._on_socket_unregister_write
+
+    def connect(self):
+        # DNS e handshake TCP são bloqueantes: rodam no executor, como no AsyncMQTTClient, para um broker
+        # lento não parar o loop de todas as sessões. A falha chega pelo on_connect_callback, com rc != 0.
+        connecting = self.loop.run_in_executor(None, self.client.connect, self.broker_address, self.port, 60)
+        connecting.add_done_callback(self._on_connect_done)
+        return True
+
+    def _on_connect_done(self, connecting):
+        error = connecting.exception()
+        if error is not None:
+            print(f"Erro ao conectar ao Broker MQTT: {error}")
+            self._on_connect(self.client, None, {}, mqtt.CONNACK_REFUSED_SERVER_UNAVAILABLE)
+
+    def _on_connect(self, client, userdata, flags, rc):
+        if self.on_connect_callback:
+            self.on_connect_callback(client, userdata, flags, rc)
+
+    def _on_message(self, client, userdata, message):
+        try:
+            message.payload = compression.decompress(message.payload)
+        except ValueError as e:
+            print(f"Mensagem descartada em '{message.topic}': {e}")
+            return
+        # Reentregas de retidas (ao assinar de novo) são intencionais e não passam pelo cache.
+        if not message.retain:
+            key = message_key(message.payload)
+            if key is not None and self.dedup.seen(key):
+                return
+        self.on_message_callback(client, userdata, message)
+
+    def _on_loop(self, function, *args):
+        # Durante o connect os callbacks de socket vêm da thread do executor; o loop só é tocado na sua thread.
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is self.loop:
+            function(*args)
+        else:
+            self.loop.call_soon_threadsafe(function, *args)
+
+    def _on_socket_open(self, client, userdata, sock):
+        self._on_loop(self.loop.add_reader, sock, client.loop_read)
+
+    def _on_socket_close(self, client, userdata, sock):
+        self._on_loop(self._unwatch_socket, sock)
+
+    def _unwatch_socket(self, sock):
+        self.loop.remove_reader(sock)
+        self.loop.remove_writer(sock)
+
+    def _on_socket_register_write(self, client, userdata, sock):
+        self._on_loop(self.loop.add_writer, sock, client.loop_write)
+
+    def _on_socket_unregister_write(self, client, userdata, sock):
+        self._on_loop(self.loop.remove_writer, sock)
+
+    def publish(self, topic, payload, qos=1, retain=False):
+        return self.client.publish(topic, compression.compress(payload), qos=qos, retain=retain)
+
+    def subscribe(self, topic, qos=1):
+        self.client.subscribe(topic, qos=qos)
+
+    def unsubscribe(self, topic):
+        self.client.unsubscribe(topic)
+
+    def subscribe_many(self, subscriptions):
+        if subscriptions:
+            self.client.subscribe(list(subscriptions))
+
+    def unsubscribe_many(self, topics):
+        if topics:
+            self.client.unsubscribe(list(topics))
+
+    def disconnect(self):
+        self.client.disconnect()
+
+
+class HeadlessSession:
+    # Protocolo do UserApp sem interface: login pela conexão da sessão, restauração das inscrições,
+    # fila privada com ACK cumulativo e tráfego nos tópicos. Os contadores ficam no runner, então
+    # cada sessão guarda só o cliente, o ACK e os nomes dos seus tópicos.
+    __slots__ = ("runner", "name", "topics", "personal_topic", "client", "login", "read_ack", "online")
+
+    def __init__(self, runner, name, topics):
+        self.runner = runner
+        self.name = name
+        self.topics = topics
+        self.personal_topic = f"{TOPIC_USER_MSG_BASE}/{name}"
+        self.client = LoopMQTTClient(runner.loop, runner.broker_address, runner.port, name, self.on_message,
+                                     will_topic=f"{TOPIC_PRESENCE_USERS}/{name}",
+                                     will_payload=envelope.encode(envelope.KIND_PRESENCE, name, "OFFLINE"))
+        self.read_ack = CumulativeAck(self.client, name, call_later=runner.loop.call_later)
+        self.login = None
+        self.online = False
+
+    def start(self):
+        self.login = SessionLogin(self.client, self.name, self.on_login)
+        if not self.login.start():
+            self.login = None
+            self.runner.finished(self, NO_CONNECTION, None)
+            return
+        self.runner.loop.call_later(AUTH_TIMEOUT_MS / 1000, self.login.timeout)
+
+    def on_login(self, result, state):
+        login, self.login = self.login, None
+        if result != "VALIDO":
+            self.client.disconnect()
+            self.runner.finished(self, result, None)
+            return
+        # O estado só é usado aqui; a sessão guarda apenas a tupla final de tópicos.
+        subscriptions = SubscriptionState(self.name)
+        try:
+            subscriptions.load(*state)
+        except (ValueError, KeyError, TypeError):
+            pass
+        if subscriptions.replace(subscriptions.topics | set(self.topics)):
+            subscriptions.publish(self.client)
+        self.topics = tuple(sorted(subscriptions.topics))
+        self.client.subscribe_many([(self.personal_topic, 1)] +
+                                   [(f"{UNIQUE_PREFIX}{topic_name}", 1) for topic_name in self.topics])
+        self.client.publish(f"{TOPIC_PRESENCE_USERS}/{self.name}",
+                            envelope.encode(envelope.KIND_PRESENCE, self.name, "ONLINE"), qos=1, retain=True)
+        self.online = True
+        self.runner.finished(self, result, login.timer.total_ms)
+
+    def on_message(self, client, userdata, message):
+        if self.login is not None and self.login.handle(message.topic, message.payload):
+            return
+        if not message.payload:
+            return
+        try:
+            parsed = envelope.Envelope.parse(message.payload)
+            count = envelope.batch_size(parsed) if parsed and parsed.kind == envelope.KIND_BATCH else 1
+        except ValueError:
+            return
+        if message.topic == self.personal_topic:
+            self.read_ack.ack(count)
+            self.runner.stats["privadas"] += count
+        else:
+            self.runner.stats["recebidas"] += count
+
+    def send_topic_message(self, text):
+        if not self.topics:
+            return False
+        topic_name = random.choice(self.topics)
+        self.client.publish(f"{UNIQUE_PREFIX}{topic_name}", envelope.encode(envelope.KIND_CHAT, self.name, text), qos=1)
+        return True
+
+    def send_private_message(self, recipient, text):
+        self.client.publish(f"{TOPIC_USER_MSG_BASE}/{recipient}", envelope.encode(envelope.KIND_PRIVATE, self.name, text),
+                            qos=1)
+        return True
+
+    def stop(self):
+        self.read_ack.close()
+        if self.online:
+            self.online = False
+            self.client.publish(f"{TOPIC_PRESENCE_USERS}/{self.name}",
+                                envelope.encode(envelope.KIND_PRESENCE, self.name, "OFFLINE"), qos=1, retain=True)
+        self.client.disconnect()
+
+
+class SessionRunner:
+    # Muitas sessões num único loop asyncio: a leitura de todos os sockets passa pelo mesmo selector e
+    # um único temporizador faz o loop_misc de todas e dispara os envios configurados.
+    def __init__(self, names, topics, broker_address=BROKER_ADDRESS, port=1883, rate=DEFAULT_RATE,
+                 send_interval=0, private_interval=0, message="ping"):
+        self.names = names
+        self.topics = tuple(topics)
+        self.broker_address = broker_address
+        self.port = port
+        self.rate = rate
+        self.send_interval = send_interval
+        self.private_interval = private_interval
+        self.message = message
+        self.loop = None
+        self.sessions = []
+        self.online = []
+        self.results = collections.Counter()
+        self.stats = collections.Counter()
+        self.login_ms = []
+        self.all_finished = None
+
+    def finished(self, session, result, login_ms):
+        self.results[result] += 1
+        if login_ms is not None:
+            self.login_ms.append(login_ms)
+            self.online.append(session)
+        if sum(self.results.values()) == len(self.names) and not self.all_finished.done():
+            self.all_finished.set_result(None)
+
+    async def _tick(self):
+        while True:
+            await asyncio.sleep(TICK_SECONDS)
+            for session in self.sessions:
+                session.client.client.loop_misc()
+            self._send(self.send_interval, lambda session: session.send_topic_message(self.message))
+            self._send(self.private_interval, lambda session: session.send_private_message(
+                random.choice(self.online).name, self.message))
+
+    def _send(self, interval, send):
+        # Em média, cada sessão online envia uma mensagem a cada interval segundos.
+        if not interval or not self.online:
+            return
+        expected = len(self.online) * TICK_SECONDS / interval
+        count = int(expected) + (random.random() < expected % 1)
+        for session in random.sample(self.online, min(count, len(self.online))):
+            if send(session):
+                self.stats["enviadas"] += 1
+
+    def report(self, elapsed):
+        ok = self.results.get("VALIDO", 0)
+        failures = ", ".join(f"{result}={count}" for result, count in self.results.items() if result != "VALIDO")
+        line = (f"[{elapsed:6.1f} s] sessões {ok}/{len(self.names)}"
+                f"{f' (falhas: {failures})' if failures else ''} | enviadas {self.stats['enviadas']}"
+                f" | recebidas {self.stats['recebidas']} | privadas confirmadas {self.stats['privadas']}")
+        print(line, flush=True)
+
+    async def run(self, duration=0, stats_interval=STATS_INTERVAL):
+        self.loop = asyncio.get_running_loop()
+        self.all_finished = self.loop.create_future()
+        if not self.names:
+            return
+        started = time.perf_counter()
+        rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        ticker = self.loop.create_task(self._tick())
+        try:
+            for name in self.names:
+                session = HeadlessSession(self, name, self.topics)
+                self.sessions.append(session)
+                session.start()
+                await asyncio.sleep(1 / self.rate if self.rate else 0)
+            await asyncio.wait_for(asyncio.shield(self.all_finished), AUTH_TIMEOUT_MS / 1000 + 5)
+        except asyncio.TimeoutError:
+            pass
+        rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        self.report(time.perf_counter() - started)
+        if self.login_ms:
+            login_ms = sorted(self.login_ms)
+            p50, p99 = login_ms[len(login_ms) // 2], login_ms[min(len(login_ms) - 1, int(len(login_ms) * 0.99))]
+            print(f"Login: p50 {p50:.1f} ms, p99 {p99:.1f} ms.")
+        # ru_maxrss em KiB no Linux: o pico do processo depois de todas as sessões abertas.
+        print(f"Memória: ~{(rss_after - rss_before) / len(self.sessions):.1f} KiB por sessão "
+              f"({len(self.sessions)} sessões, pico {rss_after / 1024:.1f} MiB).", flush=True)
+
+        try:
+            deadline = time.perf_counter() + duration if duration else None
+            while deadline is None or time.perf_counter() < deadline:
+                wait = stats_interval if deadline is None else min(stats_interval, deadline - time.perf_counter())
+                await asyncio.sleep(max(wait, 0))
+                self.report(time.perf_counter() - started)
+        finally:
+            ticker.cancel()
+            for session in self.sessions:
+                session.stop()
+            # Um ciclo do loop para os DISCONNECT (e presenças OFFLINE) saírem antes de encerrar.
+            await asyncio.sleep(0.5)
+
+
+def load_config(path, sessions=None):
+    # {"users": [...]} ou {"prefix": "bot", "count": 100}; "topics", "send_interval_s",
+    # "private_interval_s" e "message" definem o tráfego de cada sessão.
+    with open(path, encoding="utf-8") as f:
+        config = json.load(f)
+    names = list(config.get("users", []))
+    count = sessions if sessions is not None else config.get("count", len(names))
+    prefix = config.get("prefix", "bot")
+    names = names[:count] + [f"{prefix}{i}" for i in range(len(names), count)]
+    return names, config
+
+
+async def main_async(args):
+    names, config = load_config(args.config, args.sessions)
+    if args.provision:
+        report = await provision_users(names, args.broker, args.port)
+        print(f"Cadastro: {len(names) - len(report.failures)}/{len(names)} usuário(s) prontos.")
+    runner = SessionRunner(names, config.get("topics", []), args.broker, args.port, rate=args.rate,
+                           send_interval=config.get("send_interval_s", 0),
+                           private_interval=config.get("private_interval_s", 0),
+                           message=config.get("message", "ping"))
+    await runner.run(args.duration, args.stats_interval)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Executa muitas sessões de usuário MOM sem interface num único processo.")
+    parser.add_argument("config", help="Arquivo JSON com os usuários e o tráfego das sessões.")
+    parser.add_argument("-n", "--sessions", type=int, help="Quantidade de sessões (substitui \"count\" do arquivo).")
+    parser.add_argument("--broker", default=BROKER_ADDRESS)
+    parser.add_argument("--port", type=int, default=1883)
+    parser.add_argument("--rate", type=float, default=DEFAULT_RATE, help="Sessões iniciadas por segundo (0 = sem limite).")
+    parser.add_argument("--duration", type=float, default=0, help="Segundos com as sessões abertas (0 = até Ctrl+C).")
+    parser.add_argument("--stats-interval", type=float, default=STATS_INTERVAL, help="Intervalo (s) entre as linhas de totais.")
+    parser.add_argument("--provision", action="store_true", help="Cadastra os usuários antes de abrir as sessões.")
+    compression.add_arguments(parser)
+    metrics.add_arguments(parser)
+    args = parser.parse_args()
+    compression.configure_from_args(args)
+    metrics.start_from_args(args)
+    try:
+        asyncio.run(main_async(args))
+    except KeyboardInterrupt:
+        sys.exit(130)
+
+
+if __name__ == "__main__":
+    main()
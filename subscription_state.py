@@ -0,0 +1,101 @@
+from topics import TOPIC_USER_SUBS_STATE_BASE
+import envelope
+import json
+
+# Operações acumuladas no diário antes de a base ser regravada (compactação).
+COMPACT_AFTER = 32
+
+
+def state_topic(user_name):
+    return f"{TOPIC_USER_SUBS_STATE_BASE}/{user_name}"
+
+
+def journal_topic(user_name):
+    return f"{TOPIC_USER_SUBS_STATE_BASE}/{user_name}/diario"
+
+
+class SubscriptionState:
+    # Inscrições do usuário em dois documentos retidos: a base ({"version", "topics"}) e o diário com
+    # as operações posteriores a ela ({"base", "ops": [[versão, "+"/"-", tópico], ...]}). Assinar ou
+    # cancelar um tópico republica só o diário; a cada COMPACT_AFTER operações a base é regravada com
+    # a lista completa e o diário é apagado. A base antiga (lista JSON) é lida como versão 0.
+    def __init__(self, user_name):
+        self.user_name = user_name
+        self.topic = state_topic(user_name)
+        self.journal_topic = journal_topic(user_name)
+        self.topics = set()
+        self.version = 0
+        self.base_version = 0
+        self.ops = []
+
+    def load(self, base, journal=None):
+        # Payloads retidos da base e do diário (ou None). ValueError se algum estiver corrompido.
+        topics, version = set(), 0
+        if base:
+            document = json.loads(envelope.decode(base, envelope.KIND_SUBSCRIPTIONS).text)
+            if isinstance(document, list):
+                topics = set(document)
+            elif isinstance(document, dict):
+                topics, version = set(document.get("topics", [])), document.get("version", 0)
+            else:
+                raise ValueError("Estado de inscrições inválido.")
+        ops = []
+        if journal:
+            document = json.loads(envelope.decode(journal, envelope.KIND_SUBSCRIPTIONS_JOURNAL).text)
+            # Operações já incorporadas à base (diário antigo ainda retido) são ignoradas.
+            ops = [op for op in document.get("ops", []) if op[0] > version]
+        self.topics, self.version, self.base_version, self.ops = topics, version, version, []
+        for op in sorted(ops):
+            self._apply(*op)
+
+    def _apply(self, version, op, name):
+        if op == "+":
+            self.topics.add(name)
+        else:
+            self.topics.discard(name)
+        self.version = version
+        self.ops.append([version, op, name])
+
+    def add(self, name):
+        if name in self.topics:
+            return False
+        self._apply(self.version + 1, "+", name)
+        return True
+
+    def remove(self, name):
+        if name not in self.topics:
+            return False
+        self._apply(self.version + 1, "-", name)
+        return True
+
+    def replace(self, names):
+        # Aplica a diferença para chegar em names; devolve True se algo mudou.
+        names = set(names)
+        changed = False
+        for name in sorted(self.topics - names):
+            changed = self.remove(name) or changed
+        for name in sorted(names - self.topics):
+            changed = self.add(name) or changed
+        return changed
+
+    def publish(self, mqtt_client):
+        if envelope.WRITE_LEGACY:
+            # Clientes antigos só leem a base como lista completa.
+            payload = envelope.encode(envelope.KIND_SUBSCRIPTIONS, self.user_name, json.dumps(sorted(self.topics)))
+            mqtt_client.publish(self.topic, payload, qos=1, retain=True)
+            return
+        if len(self.ops) >= COMPACT_AFTER:
+            self.compact(mqtt_client)
+            return
+        document = json.dumps({"base": self.base_version, "ops": self.ops})
+        payload = envelope.encode(envelope.KIND_SUBSCRIPTIONS_JOURNAL, self.user_name, document, legacy=False)
+        mqtt_client.publish(self.journal_topic, payload, qos=1, retain=True)
+
+    def compact(self, mqtt_client):
+        # Base primeiro: quem ler a base nova com o diário antigo ignora as operações já incorporadas.
+        document = json.dumps({"version": self.version, "topics": sorted(self.topics)})
+        payload = envelope.encode(envelope.KIND_SUBSCRIPTIONS, self.user_name, document, legacy=False)
+        mqtt_client.publish(self.topic, payload, qos=1, retain=True)
+        mqtt_client.publish(self.journal_topic, b"", qos=1, retain=True)
+        self.base_version = self.version
+        self.ops = []
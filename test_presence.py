@@ -0,0 +1,55 @@
+from presence import RosterSync, encode_roster_delta, encode_roster_snapshot
+import unittest
+
+EPOCH = 7
+
+
+class RosterSyncTest(unittest.TestCase):
+    def setUp(self):
+        self.statuses = {}
+        self.requests = 0
+        self.sync = RosterSync(self.apply, self.request_snapshot)
+
+    def apply(self, statuses, full):
+        if full:
+            self.statuses = {}
+        self.statuses.update(statuses)
+
+    def request_snapshot(self):
+        self.requests += 1
+
+    def online(self):
+        return {user for user, status in self.statuses.items() if status == "ONLINE"}
+
+    def test_lost_delta_is_recovered_by_snapshot(self):
+        self.assertTrue(self.sync.on_snapshot(encode_roster_snapshot(EPOCH, 1, ["a"])))
+        self.sync.on_delta(encode_roster_delta(EPOCH, 2, {"c": "ONLINE"}))
+        # Lote 3 ({"b": "ONLINE"}) perdido.
+        self.sync.on_delta(encode_roster_delta(EPOCH, 4, {"d": "ONLINE"}))
+        self.assertEqual(self.requests, 1)
+        self.assertEqual(self.sync.seq, 2)
+        self.assertTrue(self.sync.on_snapshot(encode_roster_snapshot(EPOCH, 4, ["a", "b", "c", "d"])))
+        self.assertEqual(self.online(), {"a", "b", "c", "d"})
+        self.assertIsNone(self.sync.gap)
+        # Uma nova lacuna volta a pedir o snapshot.
+        self.sync.on_delta(encode_roster_delta(EPOCH, 6, {"e": "ONLINE"}))
+        self.assertEqual(self.requests, 2)
+
+    def test_same_seq_snapshot_closes_gap(self):
+        # O lote perdido foi o último publicado: o snapshot retido tem a numeração já conhecida.
+        self.sync.on_snapshot(encode_roster_snapshot(EPOCH, 1, ["a"]))
+        self.sync.on_delta(encode_roster_delta(EPOCH, 3, {"b": "ONLINE"}))
+        self.assertFalse(self.sync.on_snapshot(encode_roster_snapshot(EPOCH, 1, ["a"])))
+        self.assertTrue(self.sync.on_snapshot(encode_roster_snapshot(EPOCH, 3, ["a", "b"])))
+        self.assertEqual(self.online(), {"a", "b"})
+
+    def test_deltas_after_snapshot_are_applied_in_order(self):
+        self.sync.on_delta(encode_roster_delta(EPOCH, 3, {"a": "OFFLINE"}))
+        self.sync.on_delta(encode_roster_delta(EPOCH, 2, {"b": "ONLINE"}))
+        self.assertTrue(self.sync.on_snapshot(encode_roster_snapshot(EPOCH, 1, ["a"])))
+        self.assertEqual(self.online(), {"b"})
+        self.assertEqual(self.sync.seq, 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
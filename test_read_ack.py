@@ -0,0 +1,63 @@
+from manager_core import ManagerCore
+from mqtt_client import MQTTClient
+from read_ack import CumulativeAck
+from topics import TOPIC_MGMT_USERS, TOPIC_USER_MSG_BASE
+import envelope
+import loopback
+import time
+import unittest
+import uuid
+
+
+def wait_until(predicate, timeout=5):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.01)
+    return predicate()
+
+
+class CumulativeAckLoopbackTest(unittest.TestCase):
+    # Gerenciador e usuário no broker em processo, com o agrupamento de publicações ligado no usuário.
+    def setUp(self):
+        self.user_name = f"ack-{uuid.uuid4().hex[:8]}"
+        self.core = ManagerCore(broker_address=loopback.LOOPBACK_ADDRESS)
+        self.core.log_details = False
+        self.assertTrue(self.core.start())
+        self.client = MQTTClient(broker_address=loopback.LOOPBACK_ADDRESS, client_id=self.user_name,
+                                 batch_window_ms=50)
+        self.assertTrue(self.client.connect())
+        self.client.publish(f"{TOPIC_MGMT_USERS}/{self.user_name}", "ADD", qos=1, retain=True)
+        self.assertTrue(wait_until(lambda: self.user_name in self.core.message_counts))
+
+    def tearDown(self):
+        self.client.disconnect()
+        self.core.stop()
+
+    def pending(self):
+        with self.core.lock:
+            return self.core.message_counts.get(self.user_name)
+
+    def test_acks_are_not_batched(self):
+        for i in range(20):
+            payload = envelope.encode(envelope.KIND_PRIVATE, "remetente", f"mensagem {i}")
+            self.client.publish(f"{TOPIC_USER_MSG_BASE}/{self.user_name}", payload, qos=1)
+        self.assertTrue(wait_until(lambda: self.pending() == 20))
+        read_ack = CumulativeAck(self.client, self.user_name)
+        for _ in range(20):
+            read_ack.ack()
+            time.sleep(0.006)
+        read_ack.close()
+        self.assertTrue(wait_until(lambda: self.pending() == 0), f"contador ficou em {self.pending()}")
+
+    def test_truncated_batch_is_ignored(self):
+        with self.core.lock:
+            self.core.message_counts[self.user_name] = 3
+        header_only = envelope.encode_batch([])[:-2]
+        self.core.handle_user_message(f"usuarios/{self.user_name}", header_only)
+        self.assertEqual(self.pending(), 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
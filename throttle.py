@@ -0,0 +1,34 @@
+import threading
+
+
+def start_timer(delay, function):
+    timer = threading.Timer(delay, function)
+    timer.daemon = True
+    timer.start()
+    return timer
+
+
+class Throttle:
+    # Executa function no máximo uma vez a cada interval_ms: o primeiro pedido agenda a execução e os
+    # seguintes, até ela sair, são atendidos por ela. Quem chama junta as mudanças no meio-tempo.
+    def __init__(self, function, interval_ms):
+        self.function = function
+        self.interval = interval_ms / 1000
+        self.timer = None
+        self.lock = threading.Lock()
+
+    def request(self):
+        with self.lock:
+            if self.timer is None:
+                self.timer = start_timer(self.interval, self._run)
+
+    def _run(self):
+        with self.lock:
+            self.timer = None
+        self.function()
+
+    def close(self):
+        with self.lock:
+            timer, self.timer = self.timer, None
+        if timer is not None:
+            timer.cancel()
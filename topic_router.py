@@ -0,0 +1,98 @@
+from metrics import METRICS
+import collections
+import time
+
+ROUTE_MESSAGES = METRICS.counter("mom_route_messages_total", "Mensagens entregues a cada rota.", ("route",))
+ROUTE_UNMATCHED = METRICS.counter("mom_route_unmatched_total", "Mensagens sem rota.")
+HANDLER_SECONDS = METRICS.histogram("mom_handler_seconds", "Duração dos handlers por rota.", ("route",))
+
+
+def topic_matches(topic_filter, topic):
+    filter_levels = topic_filter.split("/")
+    levels = topic.split("/")
+    for depth, level in enumerate(filter_levels):
+        if level == "#":
+            return True
+        if depth >= len(levels) or level not in ("+", levels[depth]):
+            return False
+    return len(filter_levels) == len(levels)
+
+
+class RouteNode:
+    __slots__ = ("children", "handlers")
+
+    def __init__(self):
+        self.children = {}
+        self.handlers = []
+
+
+class TopicRouter:
+    def __init__(self):
+        self.root = RouteNode()
+        self.hits = collections.Counter()
+        self.misses = 0
+
+    def add(self, topic_filter, handler):
+        node = self.root
+        for level in topic_filter.split("/"):
+            node = node.children.setdefault(level, RouteNode())
+        node.handlers.append((topic_filter, handler))
+
+    def remove(self, topic_filter, handler=None):
+        path = [self.root]
+        levels = topic_filter.split("/")
+        for level in levels:
+            node = path[-1].children.get(level)
+            if node is None:
+                return False
+            path.append(node)
+
+        node = path[-1]
+        before = len(node.handlers)
+        node.handlers = [(f, h) for f, h in node.handlers if handler is not None and h != handler]
+        # Poda os nós que ficaram sem handlers e sem filhos.
+        for level, parent, child in zip(reversed(levels), reversed(path[:-1]), reversed(path[1:])):
+            if child.handlers or child.children:
+                break
+            del parent.children[level]
+        return len(node.handlers) != before
+
+    def match(self, topic):
+        found = []
+        levels = topic.split("/")
+        stack = [(self.root, 0)]
+        while stack:
+            node, depth = stack.pop()
+            wildcard = node.children.get("#")
+            if wildcard is not None:
+                found.extend(wildcard.handlers)
+            if depth == len(levels):
+                found.extend(node.handlers)
+                continue
+            child = node.children.get(levels[depth])
+            if child is not None:
+                stack.append((child, depth + 1))
+            child = node.children.get("+")
+            if child is not None:
+                stack.append((child, depth + 1))
+        return found
+
+    def dispatch(self, topic, *args):
+        routes = self.match(topic)
+        if not routes:
+            self.misses += 1
+            ROUTE_UNMATCHED.inc()
+        for topic_filter, handler in routes:
+            self.hits[topic_filter] += 1
+            ROUTE_MESSAGES.inc(route=topic_filter)
+            started = time.perf_counter()
+            try:
+                handler(topic, *args)
+            finally:
+                HANDLER_SECONDS.observe(time.perf_counter() - started, route=topic_filter)
+        return len(routes)
+
+    def report(self):
+        lines = [f"{hits:>10}  {topic_filter}" for topic_filter, hits in self.hits.most_common()]
+        lines.append(f"{self.misses:>10}  (sem rota)")
+        return "\n".join(lines)
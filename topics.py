@@ -0,0 +1,27 @@
+UNIQUE_PREFIX = "ppd-plinio-final/"
+BROKER_ADDRESS = "broker.hivemq.com"
+
+TOPIC_MGMT_USERS = f"{UNIQUE_PREFIX}sistema/gerenciamento/usuarios"
+TOPIC_MGMT_TOPICS = f"{UNIQUE_PREFIX}sistema/gerenciamento/topicos"
+TOPIC_MGMT_USERS_WILDCARD = f"{TOPIC_MGMT_USERS}/+"
+TOPIC_MGMT_TOPICS_WILDCARD = f"{TOPIC_MGMT_TOPICS}/+"
+TOPIC_MGMT_SNAPSHOT = f"{UNIQUE_PREFIX}sistema/gerenciamento/snapshot"
+TOPIC_MGMT_DELTA = f"{UNIQUE_PREFIX}sistema/gerenciamento/delta"
+TOPIC_PRESENCE = f"{UNIQUE_PREFIX}sistema/presenca"
+TOPIC_PRESENCE_REQUEST = f"{UNIQUE_PREFIX}sistema/presenca/requisicao"
+TOPIC_PRESENCE_USERS = f"{UNIQUE_PREFIX}sistema/presenca/usuarios"
+TOPIC_PRESENCE_USERS_WILDCARD = f"{TOPIC_PRESENCE_USERS}/+"
+TOPIC_PRESENCE_SNAPSHOT = f"{UNIQUE_PREFIX}sistema/presenca/snapshot"
+TOPIC_PRESENCE_DELTA = f"{UNIQUE_PREFIX}sistema/presenca/delta"
+TOPIC_USER_MSG_BASE = f"{UNIQUE_PREFIX}usuarios"
+TOPIC_USER_MSG_WILDCARD = f"{TOPIC_USER_MSG_BASE}/+"
+TOPIC_ACK_BASE = f"{UNIQUE_PREFIX}sistema/ack"
+TOPIC_ACK_WILDCARD = f"{TOPIC_ACK_BASE}/+"
+TOPIC_AUTH_REQUEST = f"{UNIQUE_PREFIX}sistema/auth/request"
+TOPIC_AUTH_RESPONSE_BASE = f"{UNIQUE_PREFIX}sistema/auth/response"
+TOPIC_USER_SUBS_STATE_BASE = f"{UNIQUE_PREFIX}state/subscriptions"
+TOPIC_MANAGER_SHARDS_BASE = f"{UNIQUE_PREFIX}sistema/gerenciador/shards"
+TOPIC_MANAGER_SHARDS_WILDCARD = f"{TOPIC_MANAGER_SHARDS_BASE}/+"
+TOPIC_MANAGER_SHARD_USERS_WILDCARD = f"{TOPIC_MANAGER_SHARDS_BASE}/+/usuarios/+"
+# Grupo da assinatura compartilhada ($share): cada requisição de login vai para um único shard.
+MANAGER_SHARE_GROUP = "mom-gerenciador"
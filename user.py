@@ -1,46 +1,77 @@
 import customtkinter as ctk
 from mqtt_client import MQTTClient
-import datetime
-import queue
-import uuid
-import json
+from gui_dispatcher import GuiDispatcher
+from widget_cache import KeyedList
+from event_log import EventLog
+from history_store import HistoryStore, DEFAULT_HISTORY_DIR
+from topic_router import TopicRouter
+from read_ack import CumulativeAck
+from registry import Registry
+from mgmt_sync import MgmtSync, SNAPSHOT_WAIT_MS
+from presence import RosterSync
+import compression
+import metrics
+from login import SessionLogin, AUTH_TIMEOUT_MS, NO_CONNECTION, NO_RESPONSE
+from subscription_state import SubscriptionState
+import envelope
+from topics import (UNIQUE_PREFIX, BROKER_ADDRESS, TOPIC_MGMT_USERS, TOPIC_MGMT_TOPICS, TOPIC_MGMT_USERS_WILDCARD,
+                    TOPIC_MGMT_TOPICS_WILDCARD, TOPIC_MGMT_SNAPSHOT, TOPIC_MGMT_DELTA, TOPIC_PRESENCE,
+                    TOPIC_PRESENCE_USERS, TOPIC_PRESENCE_USERS_WILDCARD, TOPIC_PRESENCE_SNAPSHOT, TOPIC_PRESENCE_DELTA,
+                    TOPIC_USER_MSG_BASE)
+import argparse
+import collections
+import os
+import urllib.parse
 
-UNIQUE_PREFIX = "ppd-plinio-final/"
 COLOR_ONLINE = "#1F6AA5"
 COLOR_OFFLINE = "#C21807"
 COLOR_VALID = "#009E00"
-
-TOPIC_MGMT_USERS = f"{UNIQUE_PREFIX}sistema/gerenciamento/usuarios"
-TOPIC_MGMT_TOPICS = f"{UNIQUE_PREFIX}sistema/gerenciamento/topicos"
-TOPIC_MGMT_USERS_WILDCARD = f"{TOPIC_MGMT_USERS}/+"
-TOPIC_MGMT_TOPICS_WILDCARD = f"{TOPIC_MGMT_TOPICS}/+"
-TOPIC_PRESENCE = f"{UNIQUE_PREFIX}sistema/presenca"
-TOPIC_PRESENCE_REQUEST = f"{UNIQUE_PREFIX}sistema/presenca/requisicao"
-TOPIC_USER_MSG_BASE = f"{UNIQUE_PREFIX}usuarios"
-TOPIC_ACK_BASE = f"{UNIQUE_PREFIX}sistema/ack"
-TOPIC_AUTH_REQUEST = f"{UNIQUE_PREFIX}sistema/auth/request"
-TOPIC_AUTH_RESPONSE_BASE = f"{UNIQUE_PREFIX}sistema/auth/response"
-TOPIC_USER_SUBS_STATE_BASE = f"{UNIQUE_PREFIX}state/subscriptions"
+# Meta (ms) do clique em "Entrar" até a tela pronta, com a sessão persistente aberta.
+DEFAULT_LOGIN_SLO_MS = 2000
+QUEUE_STATUS_MS = 1000
+# Tópicos de estado absoluto (o payload mais novo substitui os anteriores): na fila da interface
+# só a última mensagem de cada um precisa ser processada.
+LATEST_ONLY_PREFIXES = (f"{TOPIC_MGMT_USERS}/", f"{TOPIC_MGMT_TOPICS}/", f"{TOPIC_PRESENCE_USERS}/")
+LATEST_ONLY_TOPICS = (TOPIC_MGMT_SNAPSHOT, TOPIC_PRESENCE_SNAPSHOT)
+# Deltas numerados: podem ser descartados sob carga, pois a lacuna faz o snapshot ser pedido de novo.
+DELTA_TOPICS = (TOPIC_MGMT_DELTA, TOPIC_PRESENCE_DELTA)
+# Mensagens privadas processadas por ciclo da interface; as demais esperam na caixa de entrada.
+PRIVATE_CHUNK = 200
 
 
 class UserApp(ctk.CTk):
-    def __init__(self):
+    def __init__(self, batch_window_ms=0, login_slo_ms=DEFAULT_LOGIN_SLO_MS, history_dir=DEFAULT_HISTORY_DIR):
         super().__init__()
         self.title("Aplicação de Usuário MOM")
         self.geometry("400x250")
         self.user_name = None
         self.mqtt_client = None
         self.auth_client = None
-        self.users = []
-        self.topics = set()
+        self.login = None
+        self.login_slo_ms = login_slo_ms
+        self.read_ack = None
+        self.users = Registry()
+        self.topics = Registry(default_status=None)
+        self.mgmt_sync = MgmtSync(self.apply_mgmt_snapshot, self.apply_mgmt_change, self.request_mgmt_snapshot)
+        self.roster_sync = RosterSync(self.apply_roster, self.request_roster_snapshot)
+        self.presence_topic = None
         self.active_subscriptions = set()
-        self.user_status = {}
-        self.gui_queue = queue.Queue()
-        self.state_topic = None
-        self.state_restored = False
+        self.gui_queue = GuiDispatcher(self, on_dropped=self.report_dropped)
+        self.personal_topic = None
+        self.subscription_state = None
+        self.logged_in = False
         self.message_buffer = []
+        # Mensagens privadas nunca são descartadas pela fila da interface: esperam aqui, em ordem.
+        self.private_inbox = collections.deque()
+        # Avisos anteriores à tela principal (login, reprodução da fila) esperam o log ser criado.
+        self.event_log = None
+        self.early_log = []
+        self.router = TopicRouter()
+        self.batch_window_ms = batch_window_ms
+        self.history_dir = history_dir
         
         self.create_login_widgets()
+        self.gui_queue.start()
 
     def create_login_widgets(self):
         self.login_frame = ctk.CTkFrame(self)
@@ -62,153 +93,320 @@ class UserApp(ctk.CTk):
             return
 
         self.login_button.configure(state="disabled", text="Validando...")
-        self.status_label.configure(text="Conectando para validar...", text_color="gray")
-
-        response_id = str(uuid.uuid4())
-        self.auth_response_topic = f"{TOPIC_AUTH_RESPONSE_BASE}/{response_id}"
-        self.auth_client = MQTTClient(broker_address="broker.hivemq.com", on_message_callback=self.handle_auth_response)
-        
-        if self.auth_client.connect():
-            self.auth_client.subscribe(self.auth_response_topic, qos=0)
-            payload = f"{self.user_name};{self.auth_response_topic}"
-            self.auth_client.publish(TOPIC_AUTH_REQUEST, payload, qos=0)
+        self.status_label.configure(text="Conectando...", text_color="gray")
+
+        # Validação numa conexão sem sessão, que também traz o estado de inscrições retido. A sessão
+        # persistente só é aberta com o usuário válido: a fila offline não é entregue (nem confirmada
+        # ao broker) antes disso, e um nome qualquer não deixa uma sessão criada no broker.
+        self.auth_client = MQTTClient(broker_address=BROKER_ADDRESS, on_message_callback=self.on_message)
+        self.subscription_state = SubscriptionState(self.user_name)
+        self.personal_topic = f"{TOPIC_USER_MSG_BASE}/{self.user_name}"
+        self.login = SessionLogin(self.auth_client, self.user_name,
+                                  lambda result, state: self.gui_queue.put(lambda: self.finish_login(result, state)))
+        self.protocol("WM_DELETE_WINDOW", self.on_closing)
+        if self.login.start():
             self.status_label.configure(text="Aguardando validação do gerente...")
+            self.after(AUTH_TIMEOUT_MS, self.login.timeout)
         else:
             self.status_label.configure(text="Erro de conexão. Tente novamente.", text_color=COLOR_OFFLINE)
             self.login_button.configure(state="normal", text="Entrar")
 
-    def handle_auth_response(self, client, userdata, message):
-        payload = message.payload.decode()
-        self.auth_client.disconnect()
-
-        if payload == "VALIDO":
-            self.status_label.configure(text="Usuário válido! Entrando...", text_color=COLOR_VALID)
-            self.after(500, self.proceed_with_main_login)
-        else:
-            self.status_label.configure(text="Usuário inválido ou não cadastrado.", text_color=COLOR_OFFLINE)
+    def open_session(self):
+        will_payload = envelope.encode(envelope.KIND_PRESENCE, self.user_name, "OFFLINE")
+        self.presence_topic = f"{TOPIC_PRESENCE_USERS}/{self.user_name}"
+        self.mqtt_client = MQTTClient(broker_address=BROKER_ADDRESS,
+                                      on_message_callback=self.on_message,
+                                      will_topic=self.presence_topic,
+                                      will_payload=will_payload,
+                                      will_retain=True,
+                                      client_id=self.user_name,
+                                      clean_session=False,
+                                      batch_window_ms=self.batch_window_ms)
+        # Antes do connect: a fila offline chega logo após o CONNACK e cada mensagem exibida é confirmada.
+        self.read_ack = CumulativeAck(self.mqtt_client, self.user_name)
+        if self.mqtt_client.connect():
+            return True
+        self.read_ack = None
+        self.mqtt_client = None
+        return False
+
+    def finish_login(self, result, state_payload):
+        auth_client, self.auth_client = self.auth_client, None
+        if auth_client:
+            auth_client.disconnect()
+        if result == "VALIDO" and not self.open_session():
+            result = NO_CONNECTION
+        if result != "VALIDO":
+            messages = {NO_CONNECTION: "Erro de conexão. Tente novamente.",
+                        NO_RESPONSE: "O gerente não respondeu. Tente novamente."}
+            self.status_label.configure(text=messages.get(result, "Usuário inválido ou não cadastrado."),
+                                        text_color=COLOR_OFFLINE)
             self.login_button.configure(state="normal", text="Entrar")
+            # Só chegaram retidos pela conexão de validação; a fila privada segue intacta no broker.
+            self.message_buffer.clear()
+            self.early_log.clear()
+            return
+        self.login.timer.mark("sessão")
 
-    def proceed_with_main_login(self):
         self.login_frame.destroy()
         self.geometry("900x700")
         self.title(f"MOM - Usuário: {self.user_name}")
         self.setup_main_ui()
 
-        will_payload = f"{self.user_name}:OFFLINE"
+        self.router.add(TOPIC_MGMT_USERS_WILDCARD, self.handle_user_sync)
+        self.router.add(TOPIC_MGMT_TOPICS_WILDCARD, self.handle_topic_sync)
+        self.router.add(TOPIC_MGMT_SNAPSHOT, self.handle_mgmt_snapshot)
+        self.router.add(TOPIC_MGMT_DELTA, self.handle_mgmt_delta)
+        self.router.add(TOPIC_PRESENCE_SNAPSHOT, self.handle_roster_snapshot)
+        self.router.add(TOPIC_PRESENCE_DELTA, self.handle_roster_delta)
+        self.router.add(TOPIC_PRESENCE_USERS_WILDCARD, lambda topic, payload: self.handle_presence_update(payload))
+        self.router.add(TOPIC_PRESENCE, lambda topic, payload: self.handle_presence_update(payload))
+        self.router.add(self.personal_topic, self.handle_private_message)
+
+        timer = self.login.timer
+        restored = self.restore_subscription_state(state_payload)
+        timer.mark("estado")
+
+        # Tudo num único SUBSCRIBE: canal privado, cadastro num snapshot retido + deltas numerados (os
+        # registros por item ficam de reserva), presença em lotes do gerenciador e os tópicos restaurados.
+        self.mqtt_client.subscribe_many([(self.personal_topic, 1),
+                                         (TOPIC_MGMT_DELTA, 1), (TOPIC_MGMT_SNAPSHOT, 1),
+                                         (TOPIC_PRESENCE_DELTA, 1), (TOPIC_PRESENCE_SNAPSHOT, 1)] +
+                                        [(f"{UNIQUE_PREFIX}{sub_topic}", 1) for sub_topic in sorted(restored)])
+        self.after(SNAPSHOT_WAIT_MS, self.check_mgmt_snapshot)
+        self.after(SNAPSHOT_WAIT_MS, self.check_roster_snapshot)
+        self.publish_presence("ONLINE")
+
+        # Mensagens recebidas antes de a tela ficar pronta; a fila offline chega depois, pela sessão recém-aberta.
+        self.logged_in = True
+        buffered, self.message_buffer = self.message_buffer, []
+        for buffered_topic, buffered_payload in buffered:
+            self.handle_message(buffered_topic, buffered_payload)
+        timer.mark("reprodução")
+
+        self.add_log(f"Conectado como '{self.user_name}'. Sessão persistente ativada.")
+        self.add_log(f"Login em {timer.summary()}.")
+        if timer.total_ms > self.login_slo_ms:
+            self.add_log(f"ALERTA: login acima da meta de {self.login_slo_ms:.0f} ms.")
 
-        self.mqtt_client = MQTTClient(broker_address="broker.hivemq.com", 
-                                      on_message_callback=self.on_message,
-                                      will_topic=TOPIC_PRESENCE, 
-                                      will_payload=will_payload, 
-                                      will_retain=True,
-                                      client_id=self.user_name,
-                                      clean_session=False)
-        
-        if self.mqtt_client.connect():
-            self.personal_topic = f"{TOPIC_USER_MSG_BASE}/{self.user_name}"
-            self.state_topic = f"{TOPIC_USER_SUBS_STATE_BASE}/{self.user_name}"
-            
-            self.mqtt_client.subscribe(self.personal_topic, qos=1)
-            self.mqtt_client.subscribe(TOPIC_MGMT_USERS_WILDCARD, qos=1)
-            self.mqtt_client.subscribe(TOPIC_MGMT_TOPICS_WILDCARD, qos=1)
-            self.mqtt_client.subscribe(TOPIC_PRESENCE, qos=0)
-            
-            self.mqtt_client.subscribe(self.state_topic, qos=1)
-            self.add_log("Sincronizando estado de inscrições...")
-            
-            self.mqtt_client.publish(TOPIC_PRESENCE, f"{self.user_name}:ONLINE", retain=True)
-            self.add_log(f"Conectado como '{self.user_name}'. Sessão persistente ativada.")
-            self.protocol("WM_DELETE_WINDOW", self.on_closing)
-            self.process_gui_queue()
+    def on_message(self, client, userdata, message):
+        topic, payload = message.topic, message.payload
+        task = lambda: self.handle_message(topic, payload)
+        if topic in LATEST_ONLY_TOPICS or topic.startswith(LATEST_ONLY_PREFIXES):
+            self.gui_queue.schedule(("mensagem", topic), task)
+        elif topic == TOPIC_PRESENCE:
+            # Tópico único de presença dos clientes antigos: a última atualização de cada usuário vence.
+            try:
+                sender = envelope.decode(payload, envelope.KIND_PRESENCE).sender
+            except ValueError:
+                sender = None
+            self.gui_queue.schedule(("mensagem", topic, sender), task)
+        elif topic in DELTA_TOPICS:
+            self.gui_queue.put_capped(topic, task, kind="delta")
+        elif topic == self.personal_topic:
+            self.private_inbox.append(payload)
+            self.gui_queue.schedule("privado", self.drain_private)
+        elif topic.startswith(UNIQUE_PREFIX) and not topic.startswith((f"{UNIQUE_PREFIX}sistema/", f"{UNIQUE_PREFIX}state/")):
+            self.gui_queue.put_capped(topic, task, kind="chat")
         else:
-            self.add_log("FALHA AO CONECTAR. Saindo...")
-            self.after(2000, self.destroy)
+            self.gui_queue.put(task)
 
-    def process_gui_queue(self):
-        try:
-            while True:
-                task = self.gui_queue.get_nowait()
-                if task: task()
-        except queue.Empty: pass
-        finally:
-            self.after(100, self.process_gui_queue)
+    def drain_private(self):
+        # Um bloco por ciclo: uma fila offline grande não trava a tela, e nenhuma mensagem é perdida.
+        for _ in range(min(PRIVATE_CHUNK, len(self.private_inbox))):
+            self.handle_message(self.personal_topic, self.private_inbox.popleft())
+        if self.private_inbox:
+            self.gui_queue.schedule("privado", self.drain_private)
+
+    def report_dropped(self, topic, count):
+        if topic not in DELTA_TOPICS:
+            self.add_log(f"({topic.split('/')[-1]}) ... {count} mensagem(ns) descartada(s) por excesso de carga.")
+
+    def update_queue_status(self):
+        self.queue_status_label.configure(text=self.gui_queue.status_text())
+        self.after(QUEUE_STATUS_MS, self.update_queue_status)
 
-    def on_message(self, client, userdata, message):
-        self.gui_queue.put(lambda: self.handle_message(message.topic, message.payload.decode()))
-        
     def _process_message(self, topic, payload):
-        if topic.startswith(TOPIC_MGMT_USERS):
-            user = topic.split('/')[-1]
-            if not payload:
-                if user in self.users: self.users.remove(user)
-                if user in self.user_status: del self.user_status[user]
-            elif payload == "ADD" and user not in self.users:
-                self.users.append(user)
-            self.update_users_list_display()
-            self.update_send_selectors()
+        self.router.dispatch(topic, payload)
+
+    def _route_topic(self, topic_name):
+        self.router.add(f"{UNIQUE_PREFIX}{topic_name}", self.handle_topic_message)
+
+    def _unroute_topic(self, topic_name):
+        self.router.remove(f"{UNIQUE_PREFIX}{topic_name}", self.handle_topic_message)
+
+    def handle_user_sync(self, topic, payload):
+        user = topic.split('/')[-1]
+        if not payload:
+            self.users.remove(user)
+        elif payload == b"ADD":
+            self.users.add(user)
+        self.schedule_user_row(user)
+        self.gui_queue.schedule("send_selectors", self.update_send_selectors)
+
+    def handle_topic_sync(self, topic, payload):
+        topic_name = topic.split('/')[-1]
+        if not payload:
+            self.topics.remove(topic_name)
+            if topic_name in self.active_subscriptions:
+                self.active_subscriptions.discard(topic_name)
+                self._unroute_topic(topic_name)
+        elif payload == b"ADD":
+            self.topics.add(topic_name)
+        self.gui_queue.schedule(("topic_row", topic_name), lambda: self.update_topics_list_display(topic_name))
+        self.gui_queue.schedule("send_selectors", self.update_send_selectors)
+
+    def handle_mgmt_snapshot(self, topic, payload):
+        try:
+            caught_up = self.mgmt_sync.on_snapshot(payload)
+        except (ValueError, KeyError) as e:
+            self.add_log(f"Snapshot de cadastro ignorado: {e}")
             return
+        if caught_up:
+            # Depois de carregado, os deltas bastam; o snapshot só é pedido de novo se houver lacuna.
+            self.mqtt_client.unsubscribe(TOPIC_MGMT_SNAPSHOT)
 
-        if topic.startswith(TOPIC_MGMT_TOPICS):
-            topic_name = topic.split('/')[-1]
-            if not payload:
-                if topic_name in self.topics: self.topics.discard(topic_name)
-                if topic_name in self.active_subscriptions: self.active_subscriptions.discard(topic_name)
-            elif payload == "ADD" and topic_name not in self.topics:
-                self.topics.add(topic_name)
-            self.update_topics_list_display()
-            self.update_send_selectors()
-            return
-            
-        if topic == TOPIC_PRESENCE:
-            self.handle_presence_update(payload)
-            return
+    def handle_mgmt_delta(self, topic, payload):
+        try:
+            self.mgmt_sync.on_delta(payload)
+        except (ValueError, KeyError) as e:
+            self.add_log(f"Delta de cadastro ignorado: {e}")
 
-        if topic == self.personal_topic:
-            if payload:
-                self.add_log(f"(Privado) de {payload}")
-                self.mqtt_client.publish(f"{TOPIC_ACK_BASE}/{self.user_name}", "ACK", qos=0)
-            return
+    def request_mgmt_snapshot(self):
+        self.mqtt_client.subscribe(TOPIC_MGMT_SNAPSHOT, qos=1)
 
-        if any(topic.endswith(sub) for sub in self.active_subscriptions):
-             if not payload.startswith(f"{self.user_name}:"):
-                topic_name_only = topic.split('/')[-1]
-                self.add_log(f"({topic_name_only}) | {payload}")
-             return
+    def check_mgmt_snapshot(self):
+        if self.mgmt_sync.loaded:
+            return
+        # Gerenciador antigo (sem snapshot): volta a receber um registro retido por usuário e tópico.
+        self.add_log("Snapshot de cadastro indisponível; sincronizando pelos registros individuais.")
+        self.mqtt_client.subscribe(TOPIC_MGMT_USERS_WILDCARD, qos=1)
+        self.mqtt_client.subscribe(TOPIC_MGMT_TOPICS_WILDCARD, qos=1)
+
+    def apply_mgmt_snapshot(self, users, topics):
+        self.users.reset(users)
+        self.topics.reset(topics)
+        for topic_name in self.active_subscriptions - set(topics):
+            self.active_subscriptions.discard(topic_name)
+            self._unroute_topic(topic_name)
+        self.add_log(f"Cadastro carregado: {len(self.users)} usuário(s), {len(self.topics)} tópico(s).")
+        self.gui_queue.schedule("users_list", self.update_users_list_full)
+        self.gui_queue.schedule("topics_list", self.update_topics_list_display)
+        self.gui_queue.schedule("send_selectors", self.update_send_selectors)
+
+    def apply_mgmt_change(self, op, name):
+        payload = b"ADD" if op.endswith("+") else b""
+        if op.startswith("u"):
+            self.handle_user_sync(f"{TOPIC_MGMT_USERS}/{name}", payload)
+        else:
+            self.handle_topic_sync(f"{TOPIC_MGMT_TOPICS}/{name}", payload)
 
-    def handle_message(self, topic, payload):
-        if topic == self.state_topic:
-            if not payload: return
+    def handle_private_message(self, topic, payload):
+        if payload:
             try:
-                subs = json.loads(payload)
-                self.active_subscriptions = set(subs)
-                for sub_topic in self.active_subscriptions:
-                    full_topic_path = f"{UNIQUE_PREFIX}{sub_topic}"
-                    self.mqtt_client.subscribe(full_topic_path, qos=1)
-                self.add_log(f"Estado de inscrições restaurado: {len(subs)} tópico(s) ativo(s).")
-                self.update_topics_list_display()
-                self.update_send_selectors()
-                
-                self.state_restored = True
-                self.add_log("Processando mensagens recebidas durante a sincronização...")
-                for buffered_topic, buffered_payload in self.message_buffer:
-                    self._process_message(buffered_topic, buffered_payload)
-                self.message_buffer.clear()
-                
-            except json.JSONDecodeError:
-                self.add_log("Erro ao decodificar o estado de inscrições.")
+                message = envelope.decode(payload, envelope.KIND_PRIVATE)
+                items = envelope.iter_batch(message) if message.kind == envelope.KIND_BATCH else None
+            except ValueError:
+                self.add_log("Mensagem privada mal formatada ignorada.")
+                return
+            if items is not None:
+                for item in items:
+                    self.handle_private_message(topic, item)
+                return
+            self.add_log(f"(Privado) de {message.sender}: {message.text}", conversation=f"privado/{message.sender}")
+            self.read_ack.ack()
+
+    def handle_topic_message(self, topic, payload):
+        try:
+            message = envelope.decode(payload, envelope.KIND_CHAT)
+            items = envelope.iter_batch(message) if message.kind == envelope.KIND_BATCH else None
+        except ValueError:
+            self.add_log(f"Mensagem mal formatada em {topic} ignorada.")
+            return
+        if items is not None:
+            for item in items:
+                self.handle_topic_message(topic, item)
             return
+        if message.sender != self.user_name:
+            topic_name_only = topic.split('/')[-1]
+            self.add_log(f"({topic_name_only}) | {message.sender}: {message.text}",
+                         conversation=f"topico/{topic[len(UNIQUE_PREFIX):]}")
 
-        if self.state_restored:
+    def handle_message(self, topic, payload):
+        if self.login.handle(topic, payload):
+            return
+        if self.logged_in:
             self._process_message(topic, payload)
         else:
             self.message_buffer.append((topic, payload))
-    
+
+    def restore_subscription_state(self, state):
+        # state: (base, diário) retidos entregues no login. Devolve os tópicos a assinar.
+        if not any(state):
+            return set()
+        try:
+            self.subscription_state.load(*state)
+        except (ValueError, KeyError, TypeError):
+            self.add_log("Erro ao decodificar o estado de inscrições.")
+            return set()
+        previous, self.active_subscriptions = self.active_subscriptions, set(self.subscription_state.topics)
+        for sub_topic in previous - self.active_subscriptions:
+            self._unroute_topic(sub_topic)
+        for sub_topic in self.active_subscriptions - previous:
+            self._route_topic(sub_topic)
+        self.add_log(f"Estado de inscrições restaurado: {len(self.active_subscriptions)} tópico(s) ativo(s).")
+        self.gui_queue.schedule("topics_list", self.update_topics_list_display)
+        self.gui_queue.schedule("send_selectors", self.update_send_selectors)
+        return self.active_subscriptions
+
+    def publish_presence(self, status):
+        payload = envelope.encode(envelope.KIND_PRESENCE, self.user_name, status)
+        self.mqtt_client.publish(self.presence_topic, payload, qos=1, retain=True)
+        if envelope.WRITE_LEGACY:
+            # Gerenciadores antigos só acompanham o tópico único de presença.
+            self.mqtt_client.publish(TOPIC_PRESENCE, payload, qos=1, retain=True)
+
+    def handle_roster_snapshot(self, topic, payload):
+        try:
+            caught_up = self.roster_sync.on_snapshot(payload)
+        except (ValueError, KeyError) as e:
+            self.add_log(f"Snapshot de presença ignorado: {e}")
+            return
+        if caught_up:
+            self.mqtt_client.unsubscribe(TOPIC_PRESENCE_SNAPSHOT)
+
+    def handle_roster_delta(self, topic, payload):
+        try:
+            self.roster_sync.on_delta(payload)
+        except (ValueError, KeyError) as e:
+            self.add_log(f"Lote de presença ignorado: {e}")
+
+    def request_roster_snapshot(self):
+        self.mqtt_client.subscribe(TOPIC_PRESENCE_SNAPSHOT, qos=1)
+
+    def check_roster_snapshot(self):
+        if self.roster_sync.loaded:
+            return
+        # Gerenciador antigo: acompanha a presença de cada usuário diretamente.
+        self.add_log("Lotes de presença indisponíveis; acompanhando a presença individual dos usuários.")
+        self.mqtt_client.subscribe(TOPIC_PRESENCE_USERS_WILDCARD, qos=0)
+        self.mqtt_client.subscribe(TOPIC_PRESENCE, qos=0)
+
+    def apply_roster(self, statuses, full):
+        if full:
+            self.users.replace_statuses(statuses)
+            self.gui_queue.schedule("users_list", self.update_users_list_full)
+            return
+        for user_name, status in statuses.items():
+            if self.users.set_status(user_name, status):
+                self.schedule_user_row(user_name)
+
     def handle_presence_update(self, payload):
         try:
-            user_name, status = payload.split(":")
-            if self.user_status.get(user_name) != status:
-                self.user_status[user_name] = status
-                self.update_users_list_display()
+            update = envelope.decode(payload, envelope.KIND_PRESENCE)
+            user_name, status = update.sender, update.text
+            if self.users.set_status(user_name, status):
+                self.schedule_user_row(user_name)
         except ValueError: pass
 
     def setup_main_ui(self):
@@ -225,11 +423,24 @@ class UserApp(ctk.CTk):
         users_label.grid(row=2, column=0, padx=10, pady=10)
         self.users_list_frame = ctk.CTkScrollableFrame(left_frame)
         self.users_list_frame.grid(row=3, column=0, padx=10, pady=5, sticky="nsew")
+        self.topics_list = KeyedList(self.topics_list_frame, self.create_topic_button, self.update_topic_button,
+                                     row_pack=dict(padx=10, pady=5, fill="x"), name="topicos")
+        self.users_list = KeyedList(self.users_list_frame, self.create_user_list_item,
+                                    sections=(("ONLINE", "Online ({})", (5, 2)), ("OFFLINE", "Offline ({})", (10, 2))),
+                                    row_pack=dict(fill="x", padx=5), name="usuarios")
         right_frame = ctk.CTkFrame(self)
         right_frame.grid(row=0, column=1, padx=10, pady=10, sticky="nsew")
         right_frame.grid_columnconfigure(0, weight=1); right_frame.grid_rowconfigure(0, weight=1)
         self.log_textbox = ctk.CTkTextbox(right_frame, state="disabled", wrap="word")
         self.log_textbox.grid(row=0, column=0, columnspan=2, padx=10, pady=10, sticky="nsew")
+        # Histórico em disco por usuário: a tela abre com a página mais recente das conversas.
+        history = None
+        if self.history_dir:
+            history = HistoryStore(os.path.join(self.history_dir, urllib.parse.quote(self.user_name, safe="")))
+        self.event_log = EventLog(self.log_textbox, self.gui_queue, timestamps=True, history=history)
+        for message, conversation in self.early_log:
+            self.event_log.append(message, conversation)
+        self.early_log.clear()
         self.topic_combobox = ctk.CTkComboBox(right_frame, values=[], button_hover_color=COLOR_ONLINE)
         self.topic_combobox.grid(row=1, column=0, padx=10, pady=5, sticky="ew")
         self.topic_msg_entry = ctk.CTkEntry(right_frame, placeholder_text="Mensagem para o tópico")
@@ -242,6 +453,9 @@ class UserApp(ctk.CTk):
         self.user_msg_entry.grid(row=2, column=1, sticky="ew", padx=10, pady=5)
         send_user_button = ctk.CTkButton(right_frame, text="Enviar para Usuário", command=self.send_to_user)
         send_user_button.grid(row=3, column=1, sticky="ew", padx=10, pady=10)
+        self.queue_status_label = ctk.CTkLabel(right_frame, text="", text_color="gray", anchor="w")
+        self.queue_status_label.grid(row=4, column=0, columnspan=2, padx=10, pady=(0, 5), sticky="ew")
+        self.update_queue_status()
 
     def send_to_topic(self):
         topic_name = self.topic_combobox.get().strip()
@@ -250,9 +464,9 @@ class UserApp(ctk.CTk):
             self.add_log("ALERTA: Selecione um tópico e digite uma mensagem.")
             return
         full_topic_path = f"{UNIQUE_PREFIX}{topic_name}"
-        full_message = f"{self.user_name}: {message}"
+        full_message = envelope.encode(envelope.KIND_CHAT, self.user_name, message)
         self.mqtt_client.publish(full_topic_path, full_message, qos=1)
-        self.add_log(f"Você para ({topic_name}): {message}")
+        self.add_log(f"Você para ({topic_name}): {message}", conversation=f"topico/{topic_name}")
         self.topic_msg_entry.delete(0, "end")
 
     def send_to_user(self):
@@ -261,10 +475,10 @@ class UserApp(ctk.CTk):
         if not recipient or "Selecione" in recipient or "Nenhum" in recipient or not message:
             self.add_log("ALERTA: Selecione um usuário e digite uma mensagem.")
             return
-        payload = f"{self.user_name}: {message}"
+        payload = envelope.encode(envelope.KIND_PRIVATE, self.user_name, message)
         recipient_topic = f"{TOPIC_USER_MSG_BASE}/{recipient}"
         self.mqtt_client.publish(recipient_topic, payload, qos=1, retain=False)
-        self.add_log(f"Você para (Privado) {recipient}: {message}")
+        self.add_log(f"Você para (Privado) {recipient}: {message}", conversation=f"privado/{recipient}")
         self.user_msg_entry.delete(0, "end")
 
     def update_send_selectors(self):
@@ -280,7 +494,7 @@ class UserApp(ctk.CTk):
             self.topic_combobox.configure(values=["Nenhum tópico inscrito"])
             self.topic_combobox.set("Nenhum tópico inscrito")
 
-        other_users = sorted([u for u in self.users if u != self.user_name])
+        other_users = [u for u in self.users if u != self.user_name]
         if other_users:
             current_user = self.user_combobox.get()
             self.user_combobox.configure(values=other_users)
@@ -292,78 +506,101 @@ class UserApp(ctk.CTk):
             self.user_combobox.configure(values=["Nenhum outro usuário"])
             self.user_combobox.set("Nenhum outro usuário")
 
-    def _update_and_publish_subscriptions(self):
-        if self.mqtt_client and self.state_topic:
-            payload = json.dumps(list(self.active_subscriptions))
-            self.mqtt_client.publish(self.state_topic, payload, qos=1, retain=True)
-
     def subscribe_to_topic(self, topic_name):
         full_topic_path = f"{UNIQUE_PREFIX}{topic_name}"
         self.mqtt_client.subscribe(full_topic_path, qos=1)
-        self.active_subscriptions.add(topic_name)
+        if topic_name not in self.active_subscriptions:
+            self.active_subscriptions.add(topic_name)
+            self._route_topic(topic_name)
         self.add_log(f"Inscrito no tópico: {topic_name}")
-        self._update_and_publish_subscriptions()
-        self.update_topics_list_display()
+        if self.subscription_state.add(topic_name):
+            self.subscription_state.publish(self.mqtt_client)
+        self.update_topics_list_display(topic_name)
         self.update_send_selectors()
 
     def unsubscribe_from_topic(self, topic_name):
         full_topic_path = f"{UNIQUE_PREFIX}{topic_name}"
         self.mqtt_client.unsubscribe(full_topic_path)
-        self.active_subscriptions.discard(topic_name)
+        if topic_name in self.active_subscriptions:
+            self.active_subscriptions.discard(topic_name)
+            self._unroute_topic(topic_name)
         self.add_log(f"Inscrição cancelada para: {topic_name}")
-        self._update_and_publish_subscriptions()
-        self.update_topics_list_display()
+        if self.subscription_state.remove(topic_name):
+            self.subscription_state.publish(self.mqtt_client)
+        self.update_topics_list_display(topic_name)
         self.update_send_selectors()
 
-    def update_topics_list_display(self):
-        for widget in self.topics_list_frame.winfo_children(): widget.destroy()
-        
-        for topic_name in sorted(list(self.topics)):
-            is_subscribed = topic_name in self.active_subscriptions
-            btn_text = f"{topic_name} (Sair)" if is_subscribed else topic_name
-            btn_fg_color = ("#4A4A4A", "#555555") if is_subscribed else ("#3B8ED0", "#1F6AA5")
-            btn_command = lambda t=topic_name, sub=is_subscribed: self.unsubscribe_from_topic(t) if sub else self.subscribe_to_topic(t)
-            btn = ctk.CTkButton(self.topics_list_frame, text=btn_text, command=btn_command, fg_color=btn_fg_color)
-            btn.pack(padx=10, pady=5, fill="x")
-
-    def update_users_list_display(self):
-        for widget in self.users_list_frame.winfo_children(): widget.destroy()
-        online_users = [u for u in self.users if self.user_status.get(u) == "ONLINE"]
-        offline_users = [u for u in self.users if self.user_status.get(u) != "ONLINE"]
-        if online_users:
-            header = ctk.CTkLabel(self.users_list_frame, text=f"Online ({len(online_users)})", font=ctk.CTkFont(weight="bold"))
-            header.pack(anchor="w", padx=5, pady=(5, 2))
-            for user_name in sorted(online_users):
-                self.create_user_list_item(user_name, True)
-        if offline_users:
-            header = ctk.CTkLabel(self.users_list_frame, text=f"Offline ({len(offline_users)})", font=ctk.CTkFont(weight="bold"))
-            header.pack(anchor="w", padx=5, pady=(10, 2))
-            for user_name in sorted(offline_users):
-                self.create_user_list_item(user_name, False)
-
-    def create_user_list_item(self, user_name, is_online):
-        color = COLOR_ONLINE if is_online else COLOR_OFFLINE
-        item_frame = ctk.CTkFrame(self.users_list_frame, fg_color="transparent")
-        item_frame.pack(fill="x", padx=5)
+    def update_topics_list_display(self, topic_name=None):
+        if topic_name is None:
+            self.topics_list.sync({t: (None, t in self.active_subscriptions) for t in self.topics})
+        elif topic_name in self.topics:
+            self.topics_list.set(topic_name, topic_name in self.active_subscriptions)
+        else:
+            self.topics_list.remove(topic_name)
+
+    def create_topic_button(self, parent, topic_name, is_subscribed):
+        btn = ctk.CTkButton(parent)
+        self.update_topic_button(btn, topic_name, is_subscribed)
+        return btn
+
+    def update_topic_button(self, btn, topic_name, is_subscribed):
+        btn_text = f"{topic_name} (Sair)" if is_subscribed else topic_name
+        btn_fg_color = ("#4A4A4A", "#555555") if is_subscribed else ("#3B8ED0", "#1F6AA5")
+        btn_command = lambda t=topic_name, sub=is_subscribed: self.unsubscribe_from_topic(t) if sub else self.subscribe_to_topic(t)
+        btn.configure(text=btn_text, command=btn_command, fg_color=btn_fg_color)
+
+    def schedule_user_row(self, user_name):
+        self.gui_queue.schedule(("user_row", user_name), lambda: self.update_users_list_display(user_name))
+
+    def update_users_list_full(self):
+        statuses = {u: "ONLINE" if self.users.status(u) == "ONLINE" else "OFFLINE" for u in self.users}
+        self.users_list.sync({u: (status, status) for u, status in statuses.items()})
+
+    def update_users_list_display(self, user_name):
+        if user_name not in self.users:
+            self.users_list.remove(user_name)
+            return
+        status = "ONLINE" if self.users.status(user_name) == "ONLINE" else "OFFLINE"
+        self.users_list.set(user_name, status, section=status)
+
+    def create_user_list_item(self, parent, user_name, status):
+        color = COLOR_ONLINE if status == "ONLINE" else COLOR_OFFLINE
+        item_frame = ctk.CTkFrame(parent, fg_color="transparent")
         dot_label = ctk.CTkLabel(item_frame, text="●", text_color=color, font=ctk.CTkFont(size=18))
         dot_label.pack(side="left", padx=(5,2))
         name_label = ctk.CTkLabel(item_frame, text=user_name, anchor="w")
         name_label.pack(side="left")
+        return item_frame
 
     def on_closing(self):
-        if self.auth_client: self.auth_client.disconnect()
-        if self.mqtt_client and self.user_name:
-            self.mqtt_client.publish(TOPIC_PRESENCE, f"{self.user_name}:OFFLINE", qos=1, retain=True)
+        if self.mqtt_client and self.logged_in:
+            self.read_ack.close()
+            self.publish_presence("OFFLINE")
+            self.mqtt_client.disconnect()
+        elif self.mqtt_client:
             self.mqtt_client.disconnect()
+        if self.auth_client:
+            self.auth_client.disconnect()
         self.destroy()
 
-    def add_log(self, message):
-        timestamp = datetime.datetime.now().strftime("%H:%M:%S")
-        self.log_textbox.configure(state="normal")
-        self.log_textbox.insert("end", f"[{timestamp}] {message}\n")
-        self.log_textbox.configure(state="disabled")
-        self.log_textbox.see("end")
+    def add_log(self, message, conversation=None):
+        if self.event_log is None:
+            self.early_log.append((message, conversation))
+            return
+        self.event_log.append(message, conversation)
 
 if __name__ == "__main__":
-    app = UserApp()
+    parser = argparse.ArgumentParser(description="Aplicação de usuário MOM.")
+    parser.add_argument("--batch-ms", type=float, default=0,
+                        help="Janela (ms) para agrupar mensagens enviadas ao mesmo tópico (0 = desligado).")
+    parser.add_argument("--login-slo-ms", type=float, default=DEFAULT_LOGIN_SLO_MS,
+                        help="Meta (ms) para o login completo; acima dela um alerta é registrado.")
+    parser.add_argument("--history-dir", default=DEFAULT_HISTORY_DIR,
+                        help="Diretório do histórico local de conversas (vazio = desligado).")
+    compression.add_arguments(parser)
+    metrics.add_arguments(parser)
+    args = parser.parse_args()
+    compression.configure_from_args(args)
+    metrics.start_from_args(args)
+    app = UserApp(batch_window_ms=args.batch_ms, login_slo_ms=args.login_slo_ms, history_dir=args.history_dir)
     app.mainloop()
\ No newline at end of file
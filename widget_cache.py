@@ -0,0 +1,184 @@
+from event_log import REDRAW_SECONDS
+import bisect
+import customtkinter as ctk
+
+PAGE_SIZE = 200
+
+
+class ListSection:
+    def __init__(self, owner, name, title=None, header_pady=(5, 2)):
+        self.owner = owner
+        self.name = name
+        self.title = title
+        self.frame = ctk.CTkFrame(owner.parent, fg_color="transparent")
+        self.header = None
+        if title:
+            self.header = ctk.CTkLabel(self.frame, text="", font=ctk.CTkFont(weight="bold"))
+            self.header.pack(anchor="w", padx=5, pady=header_pady)
+        self.more_button = ctk.CTkButton(self.frame, text="", fg_color="transparent", command=self.show_more)
+        self.more_visible = False
+        self.keys = []
+        self.rows = {}
+        self.limit = owner.page_size
+        self.visible = False
+
+    def insert(self, key):
+        bisect.insort(self.keys, key)
+
+    def discard(self, key):
+        pos = bisect.bisect_left(self.keys, key)
+        if pos < len(self.keys) and self.keys[pos] == key:
+            del self.keys[pos]
+        row = self.rows.pop(key, None)
+        if row is not None:
+            row.destroy()
+
+    def replace(self, key, value):
+        old_row = self.rows.get(key)
+        if old_row is None:
+            return
+        row = self.owner.create_row(self.frame, key, value)
+        row.pack(before=old_row, **self.owner.row_pack)
+        old_row.destroy()
+        self.rows[key] = row
+
+    def show_more(self):
+        self.limit += self.owner.page_size
+        self.render()
+
+    def render(self):
+        with REDRAW_SECONDS.time(widget=self.owner.name):
+            self._render()
+
+    def _render(self):
+        # Apenas a janela [0, limit) da lista ordenada existe como widgets.
+        visible = self.keys[:self.limit]
+        wanted = set(visible)
+        for key in [k for k in self.rows if k not in wanted]:
+            self.rows.pop(key).destroy()
+
+        hidden = len(self.keys) - len(visible)
+        if hidden:
+            self.more_button.configure(text=f"Mostrar mais ({hidden} restantes)")
+            if not self.more_visible:
+                self.more_button.pack(fill="x", padx=5, pady=2)
+                self.more_visible = True
+        elif self.more_visible:
+            self.more_button.pack_forget()
+            self.more_visible = False
+
+        next_widget = self.more_button if hidden else None
+        for key in reversed(visible):
+            row = self.rows.get(key)
+            if row is None:
+                row = self.owner.create_row(self.frame, key, self.owner.entries[key][1])
+                if next_widget is not None:
+                    row.pack(before=next_widget, **self.owner.row_pack)
+                else:
+                    row.pack(**self.owner.row_pack)
+                self.rows[key] = row
+            next_widget = row
+
+        if self.header is not None:
+            self.header.configure(text=self.title.format(len(self.keys)))
+
+
+class KeyedList:
+    def __init__(self, parent, create_row, update_row=None, sections=((None, None),),
+                 row_pack=None, page_size=PAGE_SIZE, name="lista"):
+        self.parent = parent
+        self.name = name
+        self.create_row = create_row
+        self.update_row = update_row
+        self.row_pack = row_pack or {}
+        self.page_size = page_size
+        self.entries = {}
+        self.sections = {}
+        self.order = []
+        for spec in sections:
+            section = ListSection(self, *spec)
+            self.sections[section.name] = section
+            self.order.append(section)
+        self.default_section = self.order[0].name
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+    def set(self, key, value=None, section=None):
+        if section is None:
+            section = self.default_section
+        old = self.entries.get(key)
+        if old == (section, value):
+            return
+        self.entries[key] = (section, value)
+        target = self.sections[section]
+
+        if old is not None and old[0] == section:
+            row = target.rows.get(key)
+            if row is not None:
+                if self.update_row:
+                    self.update_row(row, key, value)
+                else:
+                    target.replace(key, value)
+            return
+
+        if old is not None:
+            self.sections[old[0]].discard(key)
+            self.refresh(self.sections[old[0]])
+        target.insert(key)
+        self.refresh(target)
+
+    def remove(self, key):
+        old = self.entries.pop(key, None)
+        if old is None:
+            return
+        section = self.sections[old[0]]
+        section.discard(key)
+        self.refresh(section)
+
+    def sync(self, items):
+        # items: {chave: (seção, valor)}. Altera apenas as linhas que mudaram.
+        touched = set()
+        for key in [k for k in self.entries if k not in items]:
+            section = self.sections[self.entries.pop(key)[0]]
+            section.discard(key)
+            touched.add(section.name)
+        added = []
+        for key, (section, value) in items.items():
+            if section is None:
+                section = self.default_section
+            old = self.entries.get(key)
+            if old is not None and old[0] == section:
+                self.set(key, value, section)
+                continue
+            if old is not None:
+                self.sections[old[0]].discard(key)
+                touched.add(old[0])
+            added.append((key, section, value))
+        for key, section, value in added:
+            self.entries[key] = (section, value)
+            self.sections[section].keys.append(key)
+            touched.add(section)
+        for name in touched:
+            section = self.sections[name]
+            section.keys.sort()
+            self.refresh(section)
+
+    def refresh(self, section):
+        section.render()
+        should_show = bool(section.keys)
+        if should_show == section.visible:
+            return
+        section.visible = should_show
+        if not should_show:
+            section.frame.pack_forget()
+            return
+        index = self.order.index(section)
+        following = next((s for s in self.order[index + 1:] if s.visible), None)
+        if following is not None:
+            section.frame.pack(fill="x", before=following.frame)
+        else:
+            section.frame.pack(fill="x")